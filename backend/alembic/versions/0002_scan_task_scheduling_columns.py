@@ -0,0 +1,82 @@
+"""scan task scheduling columns
+
+scan_tasks 在引入迁移之前陆续新增的列: 输出存档 / 入库检查点、分片与流水线、合并执行、
+命名队列优先级、心跳与回收、输出缓存，以及 cancelled 状态和防重复提交的部分唯一索引。
+create_all 不会给已有的表加列，旧库的 scan_tasks 可能停留在任意中间状态，因此全部使用 IF NOT EXISTS。
+
+Revision ID: 0002
+Revises: 0001
+Create Date: 2026-10-18 19:02:41.508113
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '0002'
+down_revision: Union[str, Sequence[str], None] = '0001'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+# (列名, 列定义)
+COLUMNS = (
+    ("parent_task_id", "INTEGER REFERENCES scan_tasks(id) ON DELETE CASCADE"),
+    ("target", "VARCHAR"),
+    ("targets", "JSON"),
+    ("pipeline_name", "VARCHAR"),
+    ("stage_index", "INTEGER"),
+    ("batch_leader_id", "INTEGER REFERENCES scan_tasks(id) ON DELETE SET NULL"),
+    ("priority", "INTEGER NOT NULL DEFAULT 5"),
+    ("force", "BOOLEAN NOT NULL DEFAULT false"),
+    ("started_at", "TIMESTAMP WITH TIME ZONE"),
+    ("heartbeat_at", "TIMESTAMP WITH TIME ZONE"),
+    ("requeue_count", "INTEGER NOT NULL DEFAULT 0"),
+    ("artifact_path", "VARCHAR"),
+    ("artifact_size", "BIGINT"),
+    ("checkpoint", "BIGINT NOT NULL DEFAULT 0"),
+    ("results_count", "INTEGER NOT NULL DEFAULT 0"),
+)
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # 新的枚举值在同一事务中不能使用，单独提交
+    with op.get_context().autocommit_block():
+        op.execute("ALTER TYPE task_status_enum ADD VALUE IF NOT EXISTS 'cancelled'")
+
+    for name, definition in COLUMNS:
+        op.execute(f'ALTER TABLE scan_tasks ADD COLUMN IF NOT EXISTS "{name}" {definition}')
+    op.execute("CREATE INDEX IF NOT EXISTS ix_scan_tasks_parent_task_id ON scan_tasks (parent_task_id)")
+    op.execute("CREATE INDEX IF NOT EXISTS ix_scan_tasks_batch_leader_id ON scan_tasks (batch_leader_id)")
+
+    # 建唯一索引前，同一资产同一配置的多个未结束顶层任务只保留最早的一个
+    op.execute("""
+        UPDATE scan_tasks AS t
+        SET status = 'failed', log = '升级时发现同配置的重复任务 (保留任务 ' || keep.id || ')，已标记为失败。'
+        FROM (
+            SELECT min(id) AS id, asset_id, config_name
+            FROM scan_tasks
+            WHERE status IN ('pending', 'running') AND parent_task_id IS NULL
+            GROUP BY asset_id, config_name
+        ) AS keep
+        WHERE t.status IN ('pending', 'running') AND t.parent_task_id IS NULL
+          AND t.asset_id = keep.asset_id AND t.config_name = keep.config_name AND t.id <> keep.id
+    """)
+    op.execute("""
+        CREATE UNIQUE INDEX IF NOT EXISTS uq_scan_tasks_active ON scan_tasks (asset_id, config_name)
+        WHERE status IN ('pending', 'running') AND parent_task_id IS NULL
+    """)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    # PostgreSQL 不支持删除枚举值，cancelled 保留在 task_status_enum 中
+    op.execute("UPDATE scan_tasks SET status = 'failed' WHERE status = 'cancelled'")
+    op.drop_index('uq_scan_tasks_active', table_name='scan_tasks')
+    op.drop_index(op.f('ix_scan_tasks_batch_leader_id'), table_name='scan_tasks')
+    op.drop_index(op.f('ix_scan_tasks_parent_task_id'), table_name='scan_tasks')
+    for name, _ in reversed(COLUMNS):
+        op.drop_column('scan_tasks', name)
@@ -0,0 +1,67 @@
+"""natural key unique constraints
+
+入库去重所依赖的自然键唯一约束，使 INSERT ... ON CONFLICT 成为可能:
+  ports (ip_address_id, port_number)
+  dns_records (host_id, ip_address_id, record_type)  (NULLS NOT DISTINCT，需要 PostgreSQL 15+)
+  http_services (url)
+以及覆盖索引 dns_records (ip_address_id) INCLUDE (host_id) 和 http_services (port_id)。
+建约束前先合并已有的重复行 (保留 id 最小的一条，引用它们的子表改指向保留的行)。
+
+Revision ID: 0003
+Revises: 0002
+Create Date: 2026-10-18 19:06:12.391874
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '0003'
+down_revision: Union[str, Sequence[str], None] = '0002'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def _merge_duplicates(table: str, key: str, children: Sequence[tuple]) -> None:
+    """
+    合并 table 中 key 表达式相同的行: children 中的 (子表, 外键列) 改指向 id 最小的行，再删除其余行。
+    """
+    op.execute(f"""
+        CREATE TEMPORARY TABLE dup_{table} ON COMMIT DROP AS
+        SELECT id, min(id) OVER (PARTITION BY {key}) AS keep_id FROM {table}
+    """)
+    op.execute(f"DELETE FROM dup_{table} WHERE id = keep_id")
+    for child, column in children:
+        op.execute(f"""
+            UPDATE {child} SET {column} = dup.keep_id
+            FROM dup_{table} AS dup WHERE {child}.{column} = dup.id
+        """)
+    op.execute(f"DELETE FROM {table} USING dup_{table} AS dup WHERE {table}.id = dup.id")
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # 先合并端口 (HTTP 服务随之指向保留的端口)，再合并 HTTP 服务与 DNS 记录
+    _merge_duplicates("ports", "ip_address_id, port_number", [("http_services", "port_id")])
+    _merge_duplicates("http_services", "url", [("vulnerabilities", "http_service_id"), ("web_findings", "http_service_id")])
+    _merge_duplicates("dns_records", "host_id, ip_address_id, record_type", [])
+
+    op.create_unique_constraint('uq_port_ip_number', 'ports', ['ip_address_id', 'port_number'])
+    op.create_unique_constraint('uq_dns_record_host_ip_type', 'dns_records', ['host_id', 'ip_address_id', 'record_type'], postgresql_nulls_not_distinct=True)
+    op.drop_index(op.f('ix_http_services_url'), table_name='http_services')
+    op.create_index(op.f('ix_http_services_url'), 'http_services', ['url'], unique=True)
+    op.create_index(op.f('ix_http_services_port_id'), 'http_services', ['port_id'], unique=False)
+    op.create_index('ix_dns_records_ip_address_id', 'dns_records', ['ip_address_id'], unique=False, postgresql_include=['host_id'])
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ix_dns_records_ip_address_id', table_name='dns_records')
+    op.drop_index(op.f('ix_http_services_port_id'), table_name='http_services')
+    op.drop_index(op.f('ix_http_services_url'), table_name='http_services')
+    op.create_index(op.f('ix_http_services_url'), 'http_services', ['url'], unique=False)
+    op.drop_constraint('uq_dns_record_host_ip_type', 'dns_records', type_='unique')
+    op.drop_constraint('uq_port_ip_number', 'ports', type_='unique')
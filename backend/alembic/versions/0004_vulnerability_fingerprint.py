@@ -0,0 +1,98 @@
+"""vulnerability fingerprint
+
+漏洞按指纹去重: 新增 fingerprint (唯一) / first_seen / last_seen / hit_count。
+已有数据用与 ingestion.vulnerability_fingerprint 等价的 SQL 回填指纹，
+同一指纹的多行合并为 id 最小的一行: first_seen / last_seen 取最早 / 最晚的 created_at，
+hit_count 为合并的行数，人工标记的状态取最近一条非 new 的，收藏取任一。
+
+Revision ID: 0004
+Revises: 0003
+Create Date: 2026-10-18 20:14:37.104562
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '0004'
+down_revision: Union[str, Sequence[str], None] = '0003'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+# 与 vulnerability_fingerprint 相同的规范串: 模板 ID (缺失时用名称)、命中位置、matcher 名称、
+# 按码点排序后逗号连接的提取值，以 \x1f 分隔后取 SHA-256
+FINGERPRINT_SQL = r"""
+    encode(sha256(convert_to(concat_ws(E'\x1f',
+        coalesce(nullif(template_id, ''), vulnerability_name),
+        coalesce(matched_at, ''),
+        coalesce(details->>'matcher_name', ''),
+        coalesce(CASE
+            WHEN json_typeof(details->'extracted_results') = 'array' THEN (
+                SELECT string_agg(value, ',' ORDER BY value COLLATE "C")
+                FROM json_array_elements_text(details->'extracted_results') AS value
+            )
+            ELSE details->>'extracted_results'
+        END, '')
+    ), 'UTF8')), 'hex')
+"""
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column('vulnerabilities', sa.Column('fingerprint', sa.String(length=64), nullable=True))
+    op.add_column('vulnerabilities', sa.Column('first_seen', sa.DateTime(timezone=True), server_default=sa.text('now()'), nullable=True))
+    op.add_column('vulnerabilities', sa.Column('last_seen', sa.DateTime(timezone=True), server_default=sa.text('now()'), nullable=True))
+    op.add_column('vulnerabilities', sa.Column('hit_count', sa.Integer(), server_default='1', nullable=False))
+
+    op.execute(f"""
+        UPDATE vulnerabilities
+        SET fingerprint = {FINGERPRINT_SQL},
+            first_seen = coalesce(created_at, now()),
+            last_seen = coalesce(updated_at, created_at, now())
+    """)
+
+    op.execute("""
+        CREATE TEMPORARY TABLE dup_vulnerabilities ON COMMIT DROP AS
+        SELECT id, min(id) OVER (PARTITION BY fingerprint) AS keep_id FROM vulnerabilities
+    """)
+    op.execute("""
+        UPDATE vulnerabilities AS v
+        SET first_seen = agg.first_seen,
+            last_seen = agg.last_seen,
+            hit_count = agg.hit_count,
+            is_bookmarked = agg.is_bookmarked,
+            status = coalesce(agg.status, v.status)
+        FROM (
+            SELECT dup.keep_id,
+                   min(x.first_seen) AS first_seen,
+                   max(x.last_seen) AS last_seen,
+                   count(*) AS hit_count,
+                   bool_or(x.is_bookmarked) AS is_bookmarked,
+                   (array_agg(x.status ORDER BY x.id DESC) FILTER (WHERE x.status <> 'new'))[1] AS status
+            FROM vulnerabilities AS x JOIN dup_vulnerabilities AS dup ON dup.id = x.id
+            GROUP BY dup.keep_id
+            HAVING count(*) > 1
+        ) AS agg
+        WHERE v.id = agg.keep_id
+    """)
+    op.execute("""
+        DELETE FROM vulnerabilities USING dup_vulnerabilities AS dup
+        WHERE vulnerabilities.id = dup.id AND dup.id <> dup.keep_id
+    """)
+
+    op.create_index(op.f('ix_vulnerabilities_fingerprint'), 'vulnerabilities', ['fingerprint'], unique=True)
+    op.create_index(op.f('ix_vulnerabilities_last_seen'), 'vulnerabilities', ['last_seen'], unique=False)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    # 合并掉的重复行无法恢复
+    op.drop_index(op.f('ix_vulnerabilities_last_seen'), table_name='vulnerabilities')
+    op.drop_index(op.f('ix_vulnerabilities_fingerprint'), table_name='vulnerabilities')
+    op.drop_column('vulnerabilities', 'hit_count')
+    op.drop_column('vulnerabilities', 'last_seen')
+    op.drop_column('vulnerabilities', 'first_seen')
+    op.drop_column('vulnerabilities', 'fingerprint')
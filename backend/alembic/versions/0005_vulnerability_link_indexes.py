@@ -0,0 +1,34 @@
+"""vulnerability link indexes
+
+漏洞入库时按 matched_at 关联 HTTPService / Host 后，按资产查询漏洞改为
+http_service_id / host_id 上的半连接，为这两个外键列建索引。
+迁移之前入库的漏洞没有关联，重新扫描命中时会补上 (upsert_vulnerabilities)。
+
+Revision ID: 0005
+Revises: 0004
+Create Date: 2026-10-18 20:52:09.618240
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '0005'
+down_revision: Union[str, Sequence[str], None] = '0004'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_index(op.f('ix_vulnerabilities_host_id'), 'vulnerabilities', ['host_id'], unique=False)
+    op.create_index(op.f('ix_vulnerabilities_http_service_id'), 'vulnerabilities', ['http_service_id'], unique=False)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index(op.f('ix_vulnerabilities_http_service_id'), table_name='vulnerabilities')
+    op.drop_index(op.f('ix_vulnerabilities_host_id'), table_name='vulnerabilities')
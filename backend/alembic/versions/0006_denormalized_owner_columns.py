@@ -0,0 +1,69 @@
+"""denormalized owner columns
+
+ports / http_services / vulnerabilities 增加 project_id / root_asset_id，
+按资产列出时不再沿 HTTPService -> Port -> IPAddress 连接过滤。
+(root_asset_id, id) 复合索引支撑 WHERE root_asset_id = ? ORDER BY id DESC 的分页。
+三张表的唯一键改为按归属划分 (root_asset_id + 原来的自然键 / 指纹)，同一 IP 被多个资产共享时
+端口、Web 服务和漏洞在每个资产下各有一行，不会只出现在最先发现它的资产 (或项目) 下。
+这里只加列和索引，已有数据的归属由 worker 的回填任务 (app/core/backfill.py) 分批补齐，升级时不长时间锁表；
+归属为空的旧行不参与新的唯一键 (NULL 互不相等)，回填时与同一资产下新入库的重复行合并。
+
+Revision ID: 0006
+Revises: 0005
+Create Date: 2026-10-18 21:23:40.271935
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '0006'
+down_revision: Union[str, Sequence[str], None] = '0005'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+TABLES = ('ports', 'http_services', 'vulnerabilities')
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    for table in TABLES:
+        op.add_column(table, sa.Column('project_id', sa.Integer(), nullable=True))
+        op.add_column(table, sa.Column('root_asset_id', sa.Integer(), nullable=True))
+        op.create_foreign_key(f'{table}_project_id_fkey', table, 'projects', ['project_id'], ['id'], ondelete='SET NULL')
+        op.create_foreign_key(f'{table}_root_asset_id_fkey', table, 'assets', ['root_asset_id'], ['id'], ondelete='SET NULL')
+        op.create_index(op.f(f'ix_{table}_project_id'), table, ['project_id'], unique=False)
+        op.create_index(f'ix_{table}_root_asset_id', table, ['root_asset_id', 'id'], unique=False)
+
+    op.drop_constraint('uq_port_ip_number', 'ports', type_='unique')
+    op.create_unique_constraint('uq_port_owner_ip_number', 'ports', ['root_asset_id', 'ip_address_id', 'port_number'])
+    # 原唯一约束的前导列 ip_address_id 用于按 IP 列出端口和级联删除
+    op.create_index('ix_ports_ip_address_id', 'ports', ['ip_address_id'], unique=False)
+    op.drop_index(op.f('ix_http_services_url'), table_name='http_services')
+    op.create_index(op.f('ix_http_services_url'), 'http_services', ['url'], unique=False)
+    op.create_unique_constraint('uq_http_service_owner_url', 'http_services', ['root_asset_id', 'url'])
+    op.drop_index(op.f('ix_vulnerabilities_fingerprint'), table_name='vulnerabilities')
+    op.create_unique_constraint('uq_vulnerability_owner_fingerprint', 'vulnerabilities', ['root_asset_id', 'fingerprint'])
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    # 不同资产下的同一端口 / URL / 指纹已是多行，恢复全局唯一键前需要先手工合并
+    op.drop_constraint('uq_vulnerability_owner_fingerprint', 'vulnerabilities', type_='unique')
+    op.create_index(op.f('ix_vulnerabilities_fingerprint'), 'vulnerabilities', ['fingerprint'], unique=True)
+    op.drop_constraint('uq_http_service_owner_url', 'http_services', type_='unique')
+    op.drop_index(op.f('ix_http_services_url'), table_name='http_services')
+    op.create_index(op.f('ix_http_services_url'), 'http_services', ['url'], unique=True)
+    op.drop_index('ix_ports_ip_address_id', table_name='ports')
+    op.drop_constraint('uq_port_owner_ip_number', 'ports', type_='unique')
+    op.create_unique_constraint('uq_port_ip_number', 'ports', ['ip_address_id', 'port_number'])
+    for table in reversed(TABLES):
+        op.drop_index(f'ix_{table}_root_asset_id', table_name=table)
+        op.drop_index(op.f(f'ix_{table}_project_id'), table_name=table)
+        op.drop_constraint(f'{table}_root_asset_id_fkey', table, type_='foreignkey')
+        op.drop_constraint(f'{table}_project_id_fkey', table, type_='foreignkey')
+        op.drop_column(table, 'root_asset_id')
+        op.drop_column(table, 'project_id')
@@ -0,0 +1,40 @@
+"""results filter indexes
+
+资产结果列表改为游标分页 (WHERE root_asset_id = ? [AND 过滤列 = ?] AND id < 游标 ORDER BY id DESC)，
+每种过滤组合对应一个 (root_asset_id, 过滤列, id) 复合索引，翻到任意一页都是一次索引范围扫描:
+  ports (root_asset_id, port_number, id)
+  http_services (root_asset_id, status_code, id)，以及技术栈过滤用的 GIN (tech::jsonb)
+  vulnerabilities (root_asset_id, severity, id)
+
+Revision ID: 0007
+Revises: 0006
+Create Date: 2026-10-18 21:58:16.804317
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '0007'
+down_revision: Union[str, Sequence[str], None] = '0006'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_index('ix_ports_root_asset_port', 'ports', ['root_asset_id', 'port_number', 'id'], unique=False)
+    op.create_index('ix_http_services_root_asset_status', 'http_services', ['root_asset_id', 'status_code', 'id'], unique=False)
+    op.create_index('ix_http_services_tech', 'http_services', [sa.text('(tech::jsonb)')], unique=False, postgresql_using='gin')
+    op.create_index('ix_vulnerabilities_root_asset_severity', 'vulnerabilities', ['root_asset_id', 'severity', 'id'], unique=False)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ix_vulnerabilities_root_asset_severity', table_name='vulnerabilities')
+    op.drop_index('ix_http_services_tech', table_name='http_services', postgresql_using='gin')
+    op.drop_index('ix_http_services_root_asset_status', table_name='http_services')
+    op.drop_index('ix_ports_root_asset_port', table_name='ports')
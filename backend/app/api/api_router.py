@@ -4,7 +4,7 @@ API v1 的主路由器
 """
 from fastapi import APIRouter
 
-from app.api.v1 import auth, projects, assets, tasks, results, users
+from app.api.v1 import auth, projects, assets, tasks, results, users, export
 
 api_router = APIRouter()
 
@@ -25,3 +25,5 @@ api_router.include_router(tasks.router, prefix="/tasks", tags=["tasks"])
 
 # 结果数据查询
 api_router.include_router(results.router, prefix="/results", tags=["results"])
+# 全量结果流式导出 (/results/assets/{id}/export, /results/projects/{id}/export)
+api_router.include_router(export.router, prefix="/results", tags=["results"])
@@ -3,8 +3,9 @@
 API 路由：用于根资产 (Assets) 和触发扫描
 """
 from typing import Optional
-from fastapi import APIRouter, Depends, HTTPException, status, Body, Query # 导入 Body
+from fastapi import APIRouter, Depends, HTTPException, status, Body, Query, Response # 导入 Body
 from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.future import select
 from sqlalchemy import func
 
@@ -13,12 +14,17 @@ from app.data import models
 from app.api.v1 import schemas # 导入 Pydantic 模型
 
 # 导入 ARQ 配置和扫描配置加载器
-from app.core.arq_config import get_arq_pool, TASK_RUN_SCAN, ARQ_QUEUE_NAME
+from app.core.arq_config import get_arq_pool
 from app.core.config_loader import (
     get_scan_config_by_name,
     get_available_scan_config_names,
     load_scan_configs,
+    get_pipeline_by_name,
+    get_available_pipelines,
 )
+from app.core.sharding import DEFAULT_SHARD_PREFIX, refresh_parent_task, split_cidr
+from app.core.pipeline import validate_pipeline
+from app.core.dispatch import DEFAULT_PRIORITY, MAX_PRIORITY, MIN_PRIORITY, enqueue_scan_task, queue_for_config
 from arq.connections import ArqRedis # 导入 ArqRedis 类型提示
 
 # 1. 创建 APIRouter
@@ -42,6 +48,22 @@ async def list_scan_configs(
         if isinstance(cfg, dict) and cfg.get("config_name")
     ]
 
+@router.get("/scan-pipelines", response_model=list[schemas.ScanPipelineSummary])
+async def list_scan_pipelines(
+    current_user: models.User = Depends(deps.get_current_active_user)
+):
+    """
+    获取可用的扫描流水线列表 (scanners.yaml 中的 pipeline_name 条目)。
+    """
+    return [
+        schemas.ScanPipelineSummary(
+            name=pipeline.get("pipeline_name"),
+            description=pipeline.get("description"),
+            stages=[stage.get("config") for stage in pipeline.get("stages") or []],
+        )
+        for pipeline in get_available_pipelines()
+    ]
+
 @router.get("/assets/search", response_model=list[schemas.AssetSearchRead])
 async def search_assets_by_name(
     name: str = Query(..., description="??????????"),
@@ -130,18 +152,37 @@ async def create_asset_for_project(
     return db_asset
 
 
+async def _find_active_task(db: AsyncSession, asset_id: int, config_name: str) -> Optional[models.ScanTask]:
+    """同一资产同一配置 (或流水线) 未结束的顶层任务"""
+    result = await db.execute(
+        select(models.ScanTask).where(
+            models.ScanTask.asset_id == asset_id,
+            models.ScanTask.config_name == config_name,
+            models.ScanTask.parent_task_id.is_(None),
+            models.ScanTask.status.in_(("pending", "running")),
+        )
+    )
+    return result.scalars().first()
+
+
 # --- 新增：触发扫描的 API ---
 @router.post("/assets/{asset_id}/scan", response_model=schemas.ScanTaskRead, status_code=status.HTTP_202_ACCEPTED)
 async def trigger_scan_for_asset(
     asset_id: int,
+    response: Response,
     # 使用 Body(...) 来明确指定 config_name 来自请求体
     config_name: str = Body(..., embed=True, description="要使用的扫描配置名称 (来自 scanners.yaml)"),
+    shard: bool = Body(False, embed=True, description="CIDR 资产是否按配置的 shard_prefix 拆成多个子任务并行扫描"),
+    priority: int = Body(DEFAULT_PRIORITY, embed=True, ge=MIN_PRIORITY, le=MAX_PRIORITY, description="在命名队列中的优先级 (0-9，越大越先执行)"),
+    force: bool = Body(False, embed=True, description="跳过工具输出缓存 (配置了 cache_ttl 时)，总是重新运行工具"),
     db: AsyncSession = Depends(deps.get_db),
     arq_redis: ArqRedis = Depends(get_arq_pool), # <-- 注入 ARQ 连接池
     current_user: models.User = Depends(deps.get_current_active_user) # 锁定 API
 ):
     """
     为一个根资产触发一个新的扫描任务。
+    该资产已有同配置的未结束任务 (pending / running) 时不再创建新任务，直接返回已有任务 (状态码 200)。
+    配置了 cache_ttl 时，有效期内运行过的同一命令直接从缓存的工具输出入库；force=true 跳过缓存。
 
     需要登录。
     """
@@ -161,36 +202,79 @@ async def trigger_scan_for_asset(
             detail=f"无效的扫描配置名称: '{config_name}'. 可用配置: {available_configs}"
         )
 
+    #    重复提交 (前端双击 / 自动化重试) 时返回已有任务
+    existing_task = await _find_active_task(db, asset_id, config_name)
+    if existing_task:
+        response.status_code = status.HTTP_200_OK
+        return existing_task
+
     # 4. 创建 ScanTask 记录
+    #    CIDR 资产开启分片时: 父任务只负责汇总，每个子网段一个子任务
+    shards = []
+    if shard and asset.type == "cidr":
+        shards = split_cidr(asset.name, int(scan_config.get("shard_prefix") or DEFAULT_SHARD_PREFIX))
+        if len(shards) < 2:
+            shards = []
+
     db_scan_task = models.ScanTask(
         asset_id=asset_id,
         config_name=config_name,
-        status="pending" # 初始状态
+        status="running" if shards else "pending", # 初始状态
+        priority=priority,
+        force=force,
     )
     db.add(db_scan_task)
     try:
+        await db.flush() # 获取父任务 ID
+        child_tasks = [
+            models.ScanTask(
+                asset_id=asset_id,
+                config_name=config_name,
+                status="pending",
+                parent_task_id=db_scan_task.id,
+                target=shard_target,
+                priority=priority,
+                force=force,
+            )
+            for shard_target in shards
+        ]
+        db.add_all(child_tasks)
+        if shards:
+            db_scan_task.log = f"已拆分为 {len(shards)} 个分片任务。"
         await db.commit()
         await db.refresh(db_scan_task) # 获取 task_id
+    except IntegrityError:
+        # 并发的重复提交: 另一个请求已创建了任务 (uq_scan_tasks_active)
+        await db.rollback()
+        existing_task = await _find_active_task(db, asset_id, config_name)
+        if not existing_task:
+            raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail="已有相同的扫描任务正在创建，请稍后重试")
+        response.status_code = status.HTTP_200_OK
+        return existing_task
     except Exception as e:
         await db.rollback()
         raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=f"创建扫描任务失败: {e}")
 
-    # 5. *** 将任务推送到 ARQ 队列 ***
-    #    arq_redis.enqueue_job 会将任务信息发送到 Redis
-    #    TASK_RUN_SCAN 是我们告诉 worker 要执行哪个函数的名字
-    #    db_scan_task.id 是传递给那个函数的参数
+    # 5. *** 将任务推送到命名队列 ***
+    #    按配置的 agent_type 路由到 passive / active-light / active-heavy 等队列 (见 app/core/dispatch.py)，
+    #    worker 按各队列权重公平地取出并执行 (分片时逐个推送子任务)
+    queued_tasks = child_tasks or [db_scan_task]
+    queue_name = queue_for_config(scan_config)
+    enqueued = 0
     try:
-        await arq_redis.enqueue_job(
-            TASK_RUN_SCAN, # 要执行的函数名 (在 worker.py 中定义)
-            db_scan_task.id, # 传递给函数的参数: 任务 ID
-            _queue_name=ARQ_QUEUE_NAME # 指定队列 (可选, 但推荐)
-        )
-        print(f"任务 {db_scan_task.id} (配置: {config_name}) 已成功推送到队列 {ARQ_QUEUE_NAME}")
+        for queued_task in queued_tasks:
+            await enqueue_scan_task(arq_redis, queued_task, asset.project_id)
+            enqueued += 1
+        print(f"任务 {db_scan_task.id} (配置: {config_name}, 分片: {len(child_tasks)}) 已成功推送到队列 {queue_name} (优先级 {priority})")
     except Exception as e:
         # 如果推送到队列失败, 我们应该把数据库中的任务状态改回 'failed' 或删除它
-        db_scan_task.status = "failed"
-        db_scan_task.log = f"推送到队列失败: {e}"
+        # (已推送的子任务继续执行，未推送的子任务标记失败，父任务由子任务结束时重新汇总)
+        for failed_task in queued_tasks[enqueued:]:
+            failed_task.status = "failed"
+            failed_task.log = f"推送到队列失败: {e}"
         await db.commit()
+        if child_tasks:
+            await refresh_parent_task(child_tasks[-1].id)
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail=f"任务已创建但推送到队列失败: {e}"
@@ -199,4 +283,91 @@ async def trigger_scan_for_asset(
     # 6. 返回创建的任务信息 (状态码 202 Accepted 表示请求已接受, 正在后台处理)
     return db_scan_task
 
+@router.post("/assets/{asset_id}/pipeline", response_model=schemas.ScanTaskRead, status_code=status.HTTP_202_ACCEPTED)
+async def trigger_pipeline_for_asset(
+    asset_id: int,
+    response: Response,
+    pipeline_name: str = Body(..., embed=True, description="要运行的流水线名称 (来自 scanners.yaml)"),
+    priority: int = Body(DEFAULT_PRIORITY, embed=True, ge=MIN_PRIORITY, le=MAX_PRIORITY, description="各阶段子任务在命名队列中的优先级"),
+    force: bool = Body(False, embed=True, description="各阶段都跳过工具输出缓存，总是重新运行工具"),
+    db: AsyncSession = Depends(deps.get_db),
+    arq_redis: ArqRedis = Depends(get_arq_pool),
+    current_user: models.User = Depends(deps.get_current_active_user)
+):
+    """
+    为一个根资产运行一条多阶段扫描流水线。
+    只创建并入队第一阶段；后续阶段在上游每提交一批结果后自动创建，返回的父任务汇总整体进度。
+    该资产已有同一流水线的未结束运行时直接返回其父任务 (状态码 200)。
+    """
+    asset = await db.get(models.Asset, asset_id)
+    if not asset:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"资产 ID {asset_id} 不存在")
+
+    pipeline = get_pipeline_by_name(pipeline_name)
+    if not pipeline:
+        available = [p.get("pipeline_name") for p in get_available_pipelines()]
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"无效的流水线名称: '{pipeline_name}'. 可用流水线: {available}"
+        )
+    try:
+        validate_pipeline(pipeline)
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+
+    existing_task = await _find_active_task(db, asset_id, pipeline_name)
+    if existing_task:
+        response.status_code = status.HTTP_200_OK
+        return existing_task
+
+    parent_task = models.ScanTask(
+        asset_id=asset_id,
+        config_name=pipeline_name,
+        pipeline_name=pipeline_name,
+        status="running",
+        log=f"流水线已启动，共 {len(pipeline['stages'])} 个阶段。",
+        priority=priority,
+        force=force,
+    )
+    db.add(parent_task)
+    try:
+        await db.flush()
+        first_stage = models.ScanTask(
+            asset_id=asset_id,
+            config_name=pipeline["stages"][0]["config"],
+            status="pending",
+            parent_task_id=parent_task.id,
+            stage_index=0,
+            priority=priority,
+            force=force,
+        )
+        db.add(first_stage)
+        await db.commit()
+        await db.refresh(parent_task)
+    except IntegrityError:
+        await db.rollback()
+        existing_task = await _find_active_task(db, asset_id, pipeline_name)
+        if not existing_task:
+            raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail="已有相同的流水线任务正在创建，请稍后重试")
+        response.status_code = status.HTTP_200_OK
+        return existing_task
+    except Exception as e:
+        await db.rollback()
+        raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=f"创建流水线任务失败: {e}")
+
+    try:
+        await enqueue_scan_task(arq_redis, first_stage, asset.project_id)
+        print(f"流水线任务 {parent_task.id} ({pipeline_name}) 第一阶段 {first_stage.id} 已推送到队列")
+    except Exception as e:
+        for failed_task in (parent_task, first_stage):
+            failed_task.status = "failed"
+            failed_task.log = f"推送到队列失败: {e}"
+        await db.commit()
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"任务已创建但推送到队列失败: {e}"
+        )
+
+    return parent_task
+
 # ... 未来添加 GET /scans, GET /scans/{scan_id} 等 ...
@@ -0,0 +1,196 @@
+# backend/app/api/v1/export.py
+"""
+资产 / 项目全量结果导出 (NDJSON 或 CSV)。
+结果逐行从数据库服务端游标读出 (AsyncSession.stream + yield_per)，边读边编码、边压缩边发送，
+内存占用与导出的行数无关；客户端声明 Accept-Encoding: gzip 时按 gzip 输出 (Content-Encoding)。
+NDJSON 每行一个实体，带 type 字段 (hosts / ips / ports / http_services / vulnerabilities)；
+CSV 每次只能导出一种实体 (各实体的列不同)。
+"""
+import csv
+import io
+import json
+import os
+import zlib
+from datetime import datetime, timezone
+from typing import Any, AsyncIterator, Dict, List, Literal, Optional
+
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, status
+from fastapi.responses import StreamingResponse
+from sqlalchemy import func
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.future import select
+
+from app.api import deps
+from app.data import models
+from app.data.session import AsyncSessionLocal
+
+router = APIRouter()
+
+# 服务端游标每次取回的行数
+EXPORT_YIELD_PER = int(os.getenv("EXPORT_YIELD_PER", 1000))
+# 攒够多少字节 (压缩前) 发送一次
+EXPORT_CHUNK_BYTES = int(os.getenv("EXPORT_CHUNK_BYTES", 64 * 1024))
+
+ExportEntity = Literal["hosts", "ips", "ports", "http_services", "vulnerabilities"]
+ExportFormat = Literal["ndjson", "csv"]
+EXPORT_ENTITIES = ("hosts", "ips", "ports", "http_services", "vulnerabilities")
+
+MEDIA_TYPES = {"ndjson": "application/x-ndjson", "csv": "text/csv; charset=utf-8"}
+
+
+def _entity_query(entity: str, scope: str, scope_id: int) -> Any:
+    """entity 的导出查询 (只取需要的列)，scope 为 root_asset_id 或 project_id"""
+    if entity == "hosts":
+        # 每个主机一次相关子查询: dns_records 按 host_id 查找，走 uq_dns_record_host_ip_type
+        # (host_id 为前导列且包含 ip_address_id，可以只读索引)，再按主键取 IP；
+        # ix_dns_records_ip_address_id 服务于反方向 (IP -> 主机)，这里用不上。见 test/test_export.py
+        ips = (
+            select(func.array_agg(models.IPAddress.ip_address))
+            .join(models.DNSRecord, models.DNSRecord.ip_address_id == models.IPAddress.id)
+            .where(models.DNSRecord.host_id == models.Host.id)
+            .scalar_subquery()
+        )
+        model = models.Host
+        stmt = select(
+            models.Host.id, models.Host.hostname, models.Host.status, ips.label("ips"), models.Host.is_bookmarked,
+            models.Host.project_id, models.Host.root_asset_id, models.Host.created_at,
+        )
+    elif entity == "ips":
+        model = models.IPAddress
+        stmt = select(
+            models.IPAddress.id, models.IPAddress.ip_address, models.IPAddress.status, models.IPAddress.vendor,
+            models.IPAddress.asn_number, models.IPAddress.asn_name, models.IPAddress.asn_country,
+            models.IPAddress.is_bookmarked, models.IPAddress.project_id, models.IPAddress.root_asset_id,
+            models.IPAddress.created_at,
+        )
+    elif entity == "ports":
+        model = models.Port
+        stmt = select(
+            models.Port.id, models.IPAddress.ip_address.label("ip"), models.Port.port_number, models.Port.service_name,
+            models.Port.project_id, models.Port.root_asset_id, models.Port.created_at,
+        ).join(models.IPAddress, models.Port.ip_address_id == models.IPAddress.id)
+    elif entity == "http_services":
+        model = models.HTTPService
+        stmt = select(
+            models.HTTPService.id, models.HTTPService.port_id, models.HTTPService.url, models.HTTPService.title,
+            models.HTTPService.status_code, models.HTTPService.tech, models.HTTPService.favicon_hash,
+            models.HTTPService.is_bookmarked, models.HTTPService.project_id, models.HTTPService.root_asset_id,
+            models.HTTPService.created_at,
+        )
+    else:
+        model = models.Vulnerability
+        stmt = select(
+            models.Vulnerability.id, models.Vulnerability.vulnerability_name, models.Vulnerability.template_id,
+            models.Vulnerability.severity, models.Vulnerability.status, models.Vulnerability.matched_at,
+            models.Vulnerability.host_id, models.Vulnerability.http_service_id, models.Vulnerability.hit_count,
+            models.Vulnerability.first_seen, models.Vulnerability.last_seen, models.Vulnerability.is_bookmarked,
+            models.Vulnerability.project_id, models.Vulnerability.root_asset_id,
+        )
+    return stmt.where(getattr(model, scope) == scope_id).order_by(model.id)
+
+
+def _json_default(value: Any) -> Any:
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return str(value)
+
+
+def _csv_value(value: Any) -> Any:
+    if value is None:
+        return ""
+    if isinstance(value, datetime):
+        return value.isoformat()
+    if isinstance(value, (list, dict)):
+        return json.dumps(value, ensure_ascii=False, default=_json_default)
+    return value
+
+
+async def _export_stream(
+    scope: str, scope_id: int, entities: List[str], fmt: str, compress: bool,
+) -> AsyncIterator[bytes]:
+    """逐行编码导出内容，攒够 EXPORT_CHUNK_BYTES 发送一次 (gzip 时先压缩)"""
+    compressor = zlib.compressobj(wbits=zlib.MAX_WBITS | 16) if compress else None
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+
+    def take() -> bytes:
+        data = buffer.getvalue().encode()
+        buffer.seek(0)
+        buffer.truncate()
+        return compressor.compress(data) if compressor else data
+
+    # 响应开始后才打开自己的会话: 依赖注入的会话在返回响应时就已关闭
+    async with AsyncSessionLocal() as db:
+        for entity in entities:
+            stmt = _entity_query(entity, scope, scope_id).execution_options(yield_per=EXPORT_YIELD_PER)
+            result = await db.stream(stmt)
+            if fmt == "csv":
+                writer.writerow(result.keys())
+            async for row in result.mappings():
+                if fmt == "csv":
+                    writer.writerow([_csv_value(value) for value in row.values()])
+                else:
+                    buffer.write(json.dumps({"type": entity, **row}, ensure_ascii=False, default=_json_default))
+                    buffer.write("\n")
+                if buffer.tell() >= EXPORT_CHUNK_BYTES:
+                    chunk = take()
+                    if chunk:
+                        yield chunk
+    chunk = take()
+    if compressor:
+        chunk += compressor.flush()
+    if chunk:
+        yield chunk
+
+
+def _export_response(
+    request: Request, scope: str, scope_id: int, entities: Optional[List[str]], fmt: str, filename: str,
+) -> StreamingResponse:
+    entities = list(dict.fromkeys(entities or EXPORT_ENTITIES))
+    if fmt == "csv" and len(entities) != 1:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="CSV 导出一次只能包含一种实体，请用 entities 参数指定 (如 entities=ports)",
+        )
+    compress = "gzip" in request.headers.get("accept-encoding", "").lower()
+    stamp = datetime.now(timezone.utc).strftime("%Y%m%d%H%M%S")
+    suffix = f"-{entities[0]}" if len(entities) == 1 else ""
+    headers = {
+        "Content-Disposition": f'attachment; filename="{filename}{suffix}-{stamp}.{fmt}"',
+        "Vary": "Accept-Encoding",
+    }
+    if compress:
+        headers["Content-Encoding"] = "gzip"
+    return StreamingResponse(
+        _export_stream(scope, scope_id, entities, fmt, compress), media_type=MEDIA_TYPES[fmt], headers=headers,
+    )
+
+
+@router.get("/assets/{asset_id}/export", summary="流式导出资产的全部结果 (NDJSON / CSV)")
+async def export_asset(
+    asset_id: int,
+    request: Request,
+    fmt: ExportFormat = Query("ndjson", alias="format", description="导出格式"),
+    entities: Optional[List[ExportEntity]] = Query(None, description="导出的实体类型 (默认全部；CSV 只能指定一种)"),
+    db: AsyncSession = Depends(deps.get_db),
+    current_user: models.User = Depends(deps.get_current_active_user),
+) -> StreamingResponse:
+    asset = await db.get(models.Asset, asset_id)
+    if not asset:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Asset not found")
+    return _export_response(request, "root_asset_id", asset_id, entities, fmt, f"asset-{asset_id}")
+
+
+@router.get("/projects/{project_id}/export", summary="流式导出项目的全部结果 (NDJSON / CSV)")
+async def export_project(
+    project_id: int,
+    request: Request,
+    fmt: ExportFormat = Query("ndjson", alias="format", description="导出格式"),
+    entities: Optional[List[ExportEntity]] = Query(None, description="导出的实体类型 (默认全部；CSV 只能指定一种)"),
+    db: AsyncSession = Depends(deps.get_db),
+    current_user: models.User = Depends(deps.get_current_active_user),
+) -> StreamingResponse:
+    project = await db.get(models.Project, project_id)
+    if not project:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Project not found")
+    return _export_response(request, "project_id", project_id, entities, fmt, f"project-{project_id}")
@@ -1,5 +1,7 @@
-from typing import Any, Dict, List, Optional
+from typing import Any, Dict, List, Optional, Tuple
 from fastapi import APIRouter, Depends, HTTPException, Query, status
+from sqlalchemy import cast
+from sqlalchemy.dialects.postgresql import JSONB
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.future import select
 from sqlalchemy.orm import selectinload
@@ -9,6 +11,7 @@ from pydantic import BaseModel, Field
 from app.api import deps
 from app.data import models
 from app.api.v1 import schemas
+from app.core.entity_cache import invalidate_entities
 
 router = APIRouter()
 
@@ -182,34 +185,52 @@ async def delete_host_for_asset(
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Host not found")
     await db.delete(host)
     await db.commit()
+    # worker 中缓存的主机 ID 失效
+    await invalidate_entities()
     return {"detail": "deleted"}
 
+async def _keyset_page(db: AsyncSession, stmt: Any, id_column: Any, limit: int, cursor: Optional[int]) -> Tuple[List[Any], int, Optional[int], bool]:
+    """
+    与 get_asset_hosts 相同的游标分页: 按 id 降序，cursor 为上一页最后一条的 id。
+    多取一条判断 has_more；返回 (本页对象, limit, next_cursor, has_more)。
+    """
+    if cursor:
+        stmt = stmt.where(id_column < cursor)
+    stmt = stmt.order_by(id_column.desc()).limit(limit + 1)
+    rows = (await db.execute(stmt)).scalars().all()
+    has_more = len(rows) > limit
+    items = rows[:limit]
+    next_cursor = items[-1].id if has_more and items else None
+    return items, limit, next_cursor, has_more
+
+
 # --- 2. 获取 IP 和 端口 (Ports) ---
 @router.get(
     "/assets/{asset_id}/ports",
-    response_model=List[schemas.PortSummary],
-    summary="获取资产开放端口（分页）",
+    response_model=schemas.PortPage,
+    summary="获取资产开放端口（游标分页）",
 )
 async def get_asset_ports(
     asset_id: int,
-    skip: int = Query(0, ge=0, description="偏移量"),
-    limit: int = Query(100, ge=1, le=500, description="返回条目数"),
+    limit: int = Query(100, ge=1, le=1000, description="返回条目数"),
+    cursor: Optional[int] = Query(None, description="游标 (上一页最后一条的端口 id)"),
+    port: Optional[int] = Query(None, ge=1, le=65535, description="按端口号过滤"),
     db: AsyncSession = Depends(deps.get_db),
     current_user: models.User = Depends(deps.get_current_active_user),
 ) -> Any:
-    """获取指定资产下的开放端口 (通过 IP -> Port 链路过滤)"""
+    """
+    获取指定资产下的开放端口 (按冗余的 root_asset_id 单表过滤)。
+    索引: (root_asset_id, id)，按端口号过滤时 (root_asset_id, port_number, id)。
+    """
     stmt = (
         select(models.Port)
         .options(selectinload(models.Port.ip_address))
-        .join(models.IPAddress, models.Port.ip_address_id == models.IPAddress.id)
-        .where(models.IPAddress.root_asset_id == asset_id)
-        .order_by(models.Port.id.desc())
-        .offset(skip)
-        .limit(limit)
+        .where(models.Port.root_asset_id == asset_id)
     )
-    result = await db.execute(stmt)
-    ports = result.scalars().all()
-    
+    if port is not None:
+        stmt = stmt.where(models.Port.port_number == port)
+    ports, limit, next_cursor, has_more = await _keyset_page(db, stmt, models.Port.id, limit, cursor)
+
     data = []
     for p in ports:
         if p.ip_address:
@@ -219,67 +240,72 @@ async def get_asset_ports(
                 "port": p.port_number,
                 "service": p.service_name
             })
-    return data
+    return {"items": data, "next_cursor": next_cursor, "has_more": has_more, "limit": limit}
 
 # --- 3. 获取 Web 服务 ---
 @router.get(
     "/assets/{asset_id}/web",
-    response_model=List[schemas.HTTPServiceSummary],
-    summary="获取资产 Web 服务（分页）",
+    response_model=schemas.HTTPServicePage,
+    summary="获取资产 Web 服务（游标分页）",
 )
 async def get_asset_web(
     asset_id: int,
-    skip: int = Query(0, ge=0, description="偏移量"),
-    limit: int = Query(100, ge=1, le=500, description="返回条目数"),
+    limit: int = Query(100, ge=1, le=1000, description="返回条目数"),
+    cursor: Optional[int] = Query(None, description="游标 (上一页最后一条的 Web 服务 id)"),
+    status_code: Optional[int] = Query(None, ge=100, le=599, description="按 HTTP 状态码过滤"),
+    tech: Optional[str] = Query(None, description="按技术栈指纹过滤 (与 httpx 输出的条目完全一致，如 Nginx)"),
     db: AsyncSession = Depends(deps.get_db),
     current_user: models.User = Depends(deps.get_current_active_user),
 ) -> Any:
-    stmt = (
-        select(models.HTTPService)
-        .join(models.Port, models.HTTPService.port_id == models.Port.id)
-        .join(models.IPAddress, models.Port.ip_address_id == models.IPAddress.id)
-        .where(models.IPAddress.root_asset_id == asset_id)
-        .order_by(models.HTTPService.id.desc())
-        .offset(skip)
-        .limit(limit)
-    )
-    result = await db.execute(stmt)
-    services = result.scalars().all()
-    return [
-        {"id": s.id, "url": s.url, "title": s.title, "tech": s.tech, "status": s.status_code}
-        for s in services
-    ]
+    """
+    索引: (root_asset_id, id)，按状态码过滤时 (root_asset_id, status_code, id)；
+    技术栈过滤可用 tech::jsonb 上的 GIN 索引 (命中较少时与资产索引做位图合并)。
+    """
+    stmt = select(models.HTTPService).where(models.HTTPService.root_asset_id == asset_id)
+    if status_code is not None:
+        stmt = stmt.where(models.HTTPService.status_code == status_code)
+    if tech:
+        # tech 可能是列表 (httpx) 或对象，jsonb 的 ? 同时匹配数组元素和对象键
+        stmt = stmt.where(cast(models.HTTPService.tech, JSONB).has_key(tech))
+    services, limit, next_cursor, has_more = await _keyset_page(db, stmt, models.HTTPService.id, limit, cursor)
+    return {
+        "items": [
+            {"id": s.id, "url": s.url, "title": s.title, "tech": s.tech, "status": s.status_code}
+            for s in services
+        ],
+        "next_cursor": next_cursor,
+        "has_more": has_more,
+        "limit": limit,
+    }
 
 # --- 4. 获取漏洞 ---
 @router.get(
     "/assets/{asset_id}/vulns",
-    response_model=List[schemas.VulnerabilitySummary],
-    summary="获取资产漏洞（分页）",
+    response_model=schemas.VulnerabilityPage,
+    summary="获取资产漏洞（游标分页）",
 )
 async def get_asset_vulns(
     asset_id: int,
-    skip: int = Query(0, ge=0, description="偏移量"),
-    limit: int = Query(100, ge=1, le=500, description="返回条目数"),
+    limit: int = Query(100, ge=1, le=1000, description="返回条目数"),
+    cursor: Optional[int] = Query(None, description="游标 (上一页最后一条的漏洞 id)"),
+    severity: Optional[schemas.SeverityLiteral] = Query(None, description="按严重程度过滤"),
     db: AsyncSession = Depends(deps.get_db),
     current_user: models.User = Depends(deps.get_current_active_user),
 ) -> Any:
-    stmt = (
-        select(models.Vulnerability)
-        .join(models.HTTPService, models.Vulnerability.http_service_id == models.HTTPService.id, isouter=True)
-        .join(models.Port, models.HTTPService.port_id == models.Port.id, isouter=True)
-        .join(models.IPAddress, models.Port.ip_address_id == models.IPAddress.id, isouter=True)
-        .join(models.Host, models.Vulnerability.host_id == models.Host.id, isouter=True)
-        .where(
-            (models.IPAddress.root_asset_id == asset_id) |
-            (models.Host.root_asset_id == asset_id)
-        )
-        .order_by(models.Vulnerability.id.desc())
-        .offset(skip)
-        .limit(limit)
-    )
-    result = await db.execute(stmt)
-    vulns = result.scalars().all()
-    return [
-        {"id": v.id, "name": v.vulnerability_name, "severity": v.severity, "url": v.matched_at}
-        for v in vulns
-    ]
+    """索引: (root_asset_id, id)，按严重程度过滤时 (root_asset_id, severity, id)"""
+    stmt = select(models.Vulnerability).where(models.Vulnerability.root_asset_id == asset_id)
+    if severity is not None:
+        stmt = stmt.where(models.Vulnerability.severity == severity)
+    vulns, limit, next_cursor, has_more = await _keyset_page(db, stmt, models.Vulnerability.id, limit, cursor)
+    return {
+        "items": [
+            {
+                "id": v.id, "name": v.vulnerability_name, "severity": v.severity, "url": v.matched_at,
+                "first_seen": v.first_seen, "last_seen": v.last_seen, "hit_count": v.hit_count,
+            }
+            for v in vulns
+        ],
+        "next_cursor": next_cursor,
+        "has_more": has_more,
+        "limit": limit,
+    }
@@ -5,7 +5,7 @@
 """
 from pydantic import BaseModel, Field, ConfigDict # <-- 导入 Field
 from datetime import datetime
-from typing import Optional, List, Any, Dict, Literal
+from typing import Optional, List, Any, Dict, Literal, Union
 
 # --- 通用配置与枚举 ---
 class OrmModel(BaseModel):
@@ -19,7 +19,7 @@ HostStatusLiteral = Literal["discovered", "confirmed", "archived", "out_of_scope
 SeverityLiteral = Literal["critical", "high", "medium", "low", "info"]
 VulnStatusLiteral = Literal["new", "reviewed", "false_positive", "remediated"]
 FindingStatusLiteral = Literal["new", "reviewed"]
-TaskStatusLiteral = Literal["pending", "running", "completed", "failed"]
+TaskStatusLiteral = Literal["pending", "running", "completed", "failed", "cancelled"]
 WebFindingStatusLiteral = Literal["new", "reviewed", "false_positive"]
 
 
@@ -165,6 +165,9 @@ class VulnerabilityRead(VulnerabilityBase, OrmModel):
     id: int
     host_id: Optional[int] = None
     http_service_id: Optional[int] = None
+    first_seen: Optional[datetime] = Field(None, description="首次发现时间")
+    last_seen: Optional[datetime] = Field(None, description="最近一次命中时间")
+    hit_count: int = Field(1, description="累计命中次数")
     created_at: datetime
     updated_at: Optional[datetime] = None
 
@@ -181,7 +184,7 @@ class HTTPServiceSummary(BaseModel):
     id: int = Field(..., description="HTTP 服务 ID")
     url: str = Field(..., description="完整 URL")
     title: Optional[str] = Field(None, description="页面标题")
-    tech: Optional[Dict[str, Any]] = Field(None, description="技术栈指纹")
+    tech: Optional[Union[List[str], Dict[str, Any]]] = Field(None, description="技术栈指纹")
     status: Optional[int] = Field(None, description="HTTP 状态码")
 
 
@@ -190,6 +193,9 @@ class VulnerabilitySummary(BaseModel):
     name: str = Field(..., description="漏洞名称或模板名")
     severity: SeverityLiteral = Field(..., description="漏洞严重程度")
     url: Optional[str] = Field(None, description="命中的 URL")
+    first_seen: Optional[datetime] = Field(None, description="首次发现时间")
+    last_seen: Optional[datetime] = Field(None, description="最近一次命中时间")
+    hit_count: int = Field(1, description="累计命中次数")
 
 
 # --- Summaries for list endpoints ---
@@ -204,7 +210,7 @@ class HTTPServiceSummary(BaseModel):
     id: int = Field(..., description="HTTP 服务 ID")
     url: str = Field(..., description="完整 URL")
     title: Optional[str] = Field(None, description="页面标题")
-    tech: Optional[Dict[str, Any]] = Field(None, description="技术栈指纹")
+    tech: Optional[Union[List[str], Dict[str, Any]]] = Field(None, description="技术栈指纹")
     status: Optional[int] = Field(None, description="HTTP 状态码")
 
 
@@ -213,6 +219,28 @@ class VulnerabilitySummary(BaseModel):
     name: str = Field(..., description="漏洞名称或模板名")
     severity: SeverityLiteral = Field(..., description="漏洞严重程度")
     url: Optional[str] = Field(None, description="命中的 URL")
+    first_seen: Optional[datetime] = Field(None, description="首次发现时间")
+    last_seen: Optional[datetime] = Field(None, description="最近一次命中时间")
+    hit_count: int = Field(1, description="累计命中次数")
+
+
+# --- Cursor pages (与 /assets/{id}/hosts 相同: 按 id 降序，next_cursor 为本页最后一条的 id) ---
+class CursorPage(BaseModel):
+    next_cursor: Optional[int] = Field(None, description="下一页游标 (本页最后一条的 id)，没有更多时为空")
+    has_more: bool = Field(..., description="是否还有下一页")
+    limit: int = Field(..., description="本页条目数上限")
+
+
+class PortPage(CursorPage):
+    items: List[PortSummary]
+
+
+class HTTPServicePage(CursorPage):
+    items: List[HTTPServiceSummary]
+
+
+class VulnerabilityPage(CursorPage):
+    items: List[VulnerabilitySummary]
 
 # --- GenericFinding Schemas ---
 class GenericFindingBase(BaseModel):
@@ -246,7 +274,37 @@ class ScanTaskRead(ScanTaskBase, OrmModel):
     id: int
     log: Optional[str] = Field(None, description="任务执行日志 (通常只在失败时填充)")
     created_at: datetime
+    started_at: Optional[datetime] = None
+    heartbeat_at: Optional[datetime] = Field(None, description="执行中的 worker 最近一次心跳")
+    requeue_count: int = Field(0, description="因 worker 失联被重新排队的次数")
     completed_at: Optional[datetime] = None
+    parent_task_id: Optional[int] = Field(None, description="分片子任务所属的父任务 ID")
+    target: Optional[str] = Field(None, description="实际扫描的目标 (分片子网段)，为空时即资产名称")
+    pipeline_name: Optional[str] = Field(None, description="流水线父任务使用的流水线名称")
+    stage_index: Optional[int] = Field(None, description="流水线子任务所处的阶段 (从 0 开始)")
+    batch_leader_id: Optional[int] = Field(None, description="合并执行时代为运行本任务的任务 ID")
+    priority: int = Field(5, description="在命名队列中的优先级 (0-9，越大越先执行)")
+    force: bool = Field(False, description="是否跳过工具输出缓存")
+    artifact_path: Optional[str] = Field(None, description="stdout 输出存档路径")
+    artifact_size: Optional[int] = Field(None, description="存档字节数 (为空表示存档不完整)")
+    checkpoint: int = Field(0, description="已提交入库的解析记录条数")
+    results_count: int = Field(0, description="已新增的数据条数")
+
+
+class ScanQueueSummary(BaseModel):
+    name: str = Field(..., description="命名队列 (passive / active-light / active-heavy 等)")
+    weight: int = Field(..., description="加权公平出队的权重")
+    pending: int = Field(0, description="等待分发到 worker 的任务数")
+
+
+class ProjectShareSummary(BaseModel):
+    project_id: int = Field(..., description="项目 ID (0 表示没有关联资产的任务)")
+    project_name: Optional[str] = None
+    pending: Dict[str, int] = Field(default_factory=dict, description="各命名队列中排队的任务数")
+    inflight: int = Field(0, description="已分发到 worker、尚未结束的任务数")
+    max_inflight: int = Field(..., description="在途任务上限")
+    weight: int = Field(1, description="轮询权重")
+    share: float = Field(0.0, description="在途任务占全部在途任务的比例")
 
 
 class ScanConfigSummary(BaseModel):
@@ -260,6 +318,12 @@ class ScanConfigSummary(BaseModel):
     agent_type: Optional[str] = Field(None, description="扫描代理类型（subdomain/portscan/http/vulnerability 等）")
     description: Optional[str] = Field(None, description="配置描述")
 
+
+class ScanPipelineSummary(BaseModel):
+    name: str = Field(..., description="流水线名称")
+    description: Optional[str] = Field(None, description="流水线描述")
+    stages: List[str] = Field(default_factory=list, description="各阶段使用的扫描配置名称")
+
 # --- RawScanResult Schemas ---
 class RawScanResultBase(BaseModel):
     data: Dict[str, Any] = Field(..., description="扫描工具输出的单条原始数据 (JSON)")
@@ -1,15 +1,75 @@
 from typing import Any, List, Optional
 from datetime import datetime
-from fastapi import APIRouter, Depends, HTTPException, Query
+from fastapi import APIRouter, Depends, HTTPException, Query, status as http_status
 from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy import func, update
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.future import select
+from arq.connections import ArqRedis
 
 from app.api import deps
 from app.data import models
 from app.api.v1 import schemas
+from app.core.arq_config import get_arq_pool
+from app.core.dispatch import enqueue_scan_task, project_shares, queue_lengths, queue_weights
+from app.core.sharding import refresh_parent_task
+from app.core.cancellation import request_cancel
 
 router = APIRouter()
 
+
+async def _project_id_of(db: AsyncSession, task: models.ScanTask) -> Optional[int]:
+    """任务所属项目 (用于按项目公平分发)"""
+    asset = await db.get(models.Asset, task.asset_id) if task.asset_id else None
+    return asset.project_id if asset else None
+
+
+async def _commit_requeue(db: AsyncSession) -> None:
+    """提交重新排队的状态变更；同一资产同一配置已有未结束的任务时 (uq_scan_tasks_active) 返回 409"""
+    try:
+        await db.commit()
+    except IntegrityError:
+        await db.rollback()
+        raise HTTPException(
+            status_code=http_status.HTTP_409_CONFLICT,
+            detail="该资产已有同配置的未结束任务，请等待其结束后再重新排队"
+        )
+
+
+@router.get("/queues", response_model=List[schemas.ScanQueueSummary])
+async def list_scan_queues(
+    arq_redis: ArqRedis = Depends(get_arq_pool),
+    current_user: models.User = Depends(deps.get_current_active_user),
+) -> Any:
+    """
+    各命名队列的权重与等待分发的任务数。
+    """
+    lengths = await queue_lengths(arq_redis)
+    return [
+        schemas.ScanQueueSummary(name=name, weight=weight, pending=lengths.get(name, 0))
+        for name, weight in queue_weights().items()
+    ]
+
+
+@router.get("/shares", response_model=List[schemas.ProjectShareSummary])
+async def list_project_shares(
+    db: AsyncSession = Depends(deps.get_db),
+    arq_redis: ArqRedis = Depends(get_arq_pool),
+    current_user: models.User = Depends(deps.get_current_active_user),
+) -> Any:
+    """
+    各项目当前的公平份额: 排队数、在途数与上限、在途任务占比。
+    只列出有排队或在途任务的项目。
+    """
+    shares = await project_shares(arq_redis)
+    project_ids = [share["project_id"] for share in shares]
+    names = {}
+    if project_ids:
+        result = await db.execute(select(models.Project.id, models.Project.name).where(models.Project.id.in_(project_ids)))
+        names = dict(result.all())
+    return [schemas.ProjectShareSummary(project_name=names.get(share["project_id"]), **share) for share in shares]
+
+
 @router.get("/{task_id}", response_model=schemas.ScanTaskRead)
 async def get_task_status(
     task_id: int,
@@ -28,11 +88,25 @@ async def get_task_status(
         
     return schemas.ScanTaskRead(
         id=task.id,
-        status=task.status,          # pending, running, completed, failed
+        status=task.status,          # pending, running, completed, failed, cancelled
         config_name=task.config_name,
         asset_id=task.asset_id,
         created_at=task.created_at,
+        started_at=task.started_at,
+        heartbeat_at=task.heartbeat_at,
+        requeue_count=task.requeue_count or 0,
         completed_at=task.completed_at,
+        parent_task_id=task.parent_task_id,
+        target=task.target,
+        pipeline_name=task.pipeline_name,
+        stage_index=task.stage_index,
+        batch_leader_id=task.batch_leader_id,
+        priority=task.priority,
+        force=task.force,
+        artifact_path=task.artifact_path,
+        artifact_size=task.artifact_size,
+        checkpoint=task.checkpoint or 0,
+        results_count=task.results_count or 0,
         # 截取日志，避免传输过大
         log=task.log[-2000:] if task.log else ""
     )
@@ -44,6 +118,7 @@ async def list_recent_tasks(
     status: Optional[str] = Query(None, description="按任务状态过滤"),
     asset_id: Optional[int] = Query(None, description="按资产 ID 过滤"),
     config_name: Optional[str] = Query(None, description="按扫描配置名称过滤"),
+    parent_task_id: Optional[int] = Query(None, description="按父任务 ID 过滤 (列出分片子任务)"),
     created_after: Optional[datetime] = Query(None, description="仅返回在此时间之后创建的任务"),
     db: AsyncSession = Depends(deps.get_db),
     current_user: models.User = Depends(deps.get_current_active_user),
@@ -58,6 +133,8 @@ async def list_recent_tasks(
         stmt = stmt.where(models.ScanTask.asset_id == asset_id)
     if config_name:
         stmt = stmt.where(models.ScanTask.config_name == config_name)
+    if parent_task_id:
+        stmt = stmt.where(models.ScanTask.parent_task_id == parent_task_id)
     if created_after:
         stmt = stmt.where(models.ScanTask.created_at >= created_after)
 
@@ -72,8 +149,182 @@ async def list_recent_tasks(
             config_name=t.config_name,
             asset_id=t.asset_id,
             created_at=t.created_at,
+            started_at=t.started_at,
+            heartbeat_at=t.heartbeat_at,
+            requeue_count=t.requeue_count or 0,
             completed_at=t.completed_at,
+            parent_task_id=t.parent_task_id,
+            target=t.target,
+            pipeline_name=t.pipeline_name,
+            stage_index=t.stage_index,
+            batch_leader_id=t.batch_leader_id,
+            priority=t.priority,
+            force=t.force,
+            artifact_path=t.artifact_path,
+            artifact_size=t.artifact_size,
+            checkpoint=t.checkpoint or 0,
+            results_count=t.results_count or 0,
             log=t.log[-2000:] if t.log else None
         )
         for t in tasks
     ]
+
+
+@router.post("/{task_id}/reingest", response_model=schemas.ScanTaskRead, status_code=http_status.HTTP_202_ACCEPTED)
+async def reingest_task(
+    task_id: int,
+    db: AsyncSession = Depends(deps.get_db),
+    arq_redis: ArqRedis = Depends(get_arq_pool),
+    current_user: models.User = Depends(deps.get_current_active_user),
+) -> Any:
+    """
+    从任务的输出存档重新解析入库，不再重新执行扫描工具
+    (用于 worker 入库中途退出、或解析逻辑修复后重放历史输出)。
+    """
+    task = await db.get(models.ScanTask, task_id)
+    if not task:
+        raise HTTPException(status_code=404, detail="Task not found")
+    if task.status in ("pending", "running"):
+        raise HTTPException(status_code=http_status.HTTP_409_CONFLICT, detail=f"任务当前状态为 {task.status}，无法重新入库")
+    if task.batch_leader_id:
+        raise HTTPException(
+            status_code=http_status.HTTP_400_BAD_REQUEST,
+            detail=f"该任务由任务 {task.batch_leader_id} 合并执行，请对该任务重新入库"
+        )
+    if not task.artifact_path or task.artifact_size is None:
+        raise HTTPException(status_code=http_status.HTTP_400_BAD_REQUEST, detail="任务没有完整的输出存档")
+
+    task.status = "pending"
+    task.completed_at = None
+    task.log = None
+    task.checkpoint = 0
+    task.results_count = 0
+    await _commit_requeue(db)
+
+    try:
+        await enqueue_scan_task(arq_redis, task, await _project_id_of(db, task), reingest=True)
+    except Exception as e:
+        task.status = "failed"
+        task.log = f"推送到队列失败: {e}"
+        await db.commit()
+        raise HTTPException(status_code=http_status.HTTP_500_INTERNAL_SERVER_ERROR, detail=f"推送到队列失败: {e}")
+
+    await db.refresh(task)
+    return task
+
+
+@router.post("/{task_id}/retry", response_model=schemas.ScanTaskRead, status_code=http_status.HTTP_202_ACCEPTED)
+async def retry_task(
+    task_id: int,
+    db: AsyncSession = Depends(deps.get_db),
+    arq_redis: ArqRedis = Depends(get_arq_pool),
+    current_user: models.User = Depends(deps.get_current_active_user),
+) -> Any:
+    """
+    重新排队一个失败或已取消的任务。
+    输出存档完整时从存档的检查点续传 (已提交的记录不再重复入库)；否则重新执行扫描工具。
+    分片父任务本身不执行，重试时重新排队其中失败 / 已取消的子任务。
+    """
+    task = await db.get(models.ScanTask, task_id)
+    if not task:
+        raise HTTPException(status_code=404, detail="Task not found")
+    if task.status not in ("failed", "cancelled"):
+        raise HTTPException(status_code=http_status.HTTP_409_CONFLICT, detail=f"只能重试失败或已取消的任务，当前状态为 {task.status}")
+
+    result = await db.execute(
+        select(models.ScanTask).where(
+            models.ScanTask.parent_task_id == task.id,
+            models.ScanTask.status.in_(("failed", "cancelled")),
+        )
+    )
+    failed_children = result.scalars().all()
+    retry_tasks = failed_children or [task]
+    for retry in retry_tasks:
+        retry.status = "pending"
+        retry.completed_at = None
+        retry.log = None
+    if failed_children:
+        task.status = "running"
+        task.completed_at = None
+    await _commit_requeue(db)
+
+    project_id = await _project_id_of(db, task)
+    enqueued = 0
+    try:
+        for retry in retry_tasks:
+            resume = bool(retry.artifact_path) and retry.artifact_size is not None
+            await enqueue_scan_task(arq_redis, retry, project_id, reingest=resume)
+            enqueued += 1
+    except Exception as e:
+        for retry in retry_tasks[enqueued:]:
+            retry.status = "failed"
+            retry.log = f"推送到队列失败: {e}"
+        await db.commit()
+        if failed_children:
+            await refresh_parent_task(failed_children[-1].id)
+        raise HTTPException(status_code=http_status.HTTP_500_INTERNAL_SERVER_ERROR, detail=f"推送到队列失败: {e}")
+
+    await db.refresh(task)
+    return task
+
+
+@router.post("/{task_id}/cancel", response_model=schemas.ScanTaskRead, status_code=http_status.HTTP_202_ACCEPTED)
+async def cancel_task(
+    task_id: int,
+    db: AsyncSession = Depends(deps.get_db),
+    arq_redis: ArqRedis = Depends(get_arq_pool),
+    current_user: models.User = Depends(deps.get_current_active_user),
+) -> Any:
+    """
+    取消一个任务。
+    排队中的任务直接标记为 cancelled；运行中的任务由执行它的 worker 终止整个进程组、
+    提交已解析的结果后标记为 cancelled (接口返回时该任务可能仍为 running)。
+    分片 / 流水线父任务会取消其下所有未结束的子任务。
+    """
+    task = await db.get(models.ScanTask, task_id)
+    if not task:
+        raise HTTPException(status_code=404, detail="Task not found")
+    if task.batch_leader_id and task.status == "running":
+        raise HTTPException(
+            status_code=http_status.HTTP_400_BAD_REQUEST,
+            detail=f"该任务由任务 {task.batch_leader_id} 合并执行，请取消该任务"
+        )
+
+    result = await db.execute(
+        select(models.ScanTask).where(
+            models.ScanTask.parent_task_id == task.id,
+            models.ScanTask.status.in_(("pending", "running")),
+        )
+    )
+    children = result.scalars().all()
+    if not children and task.status not in ("pending", "running"):
+        raise HTTPException(status_code=http_status.HTTP_409_CONFLICT, detail=f"任务当前状态为 {task.status}，无法取消")
+    cancel_tasks = children or [task]
+
+    # 排队中的任务: 只在仍为 pending 时改为 cancelled，与 worker 取走任务互不覆盖
+    pending_ids = [t.id for t in cancel_tasks if t.status == "pending"]
+    cancelled_ids = set()
+    if pending_ids:
+        result = await db.execute(
+            update(models.ScanTask)
+            .where(models.ScanTask.id.in_(pending_ids), models.ScanTask.status == "pending")
+            .values(status="cancelled", completed_at=func.now(), log="任务在开始执行前被取消。")
+            .returning(models.ScanTask.id)
+            .execution_options(synchronize_session=False)
+        )
+        cancelled_ids = {row[0] for row in result.all()}
+    await db.commit()
+
+    # 运行中的任务 (包括刚被 worker 取走的) 通知 worker 终止；合并执行的成员由其 leader 统一终止
+    try:
+        for t in cancel_tasks:
+            if t.id not in cancelled_ids:
+                await request_cancel(arq_redis, t.batch_leader_id or t.id)
+    except Exception as e:
+        raise HTTPException(status_code=http_status.HTTP_500_INTERNAL_SERVER_ERROR, detail=f"发送取消请求失败: {e}")
+
+    if cancelled_ids:
+        # 分片 / 流水线子任务: 汇总父任务的状态
+        await refresh_parent_task(next(iter(cancelled_ids)))
+    await db.refresh(task)
+    return task
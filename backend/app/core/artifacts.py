@@ -0,0 +1,50 @@
+# backend/app/core/artifacts.py
+"""
+扫描输出的落盘存档 (artifact)。
+每个任务的 stdout / stderr 都写入 ARTIFACT_DIR 下的独立文件，
+worker 中途退出后可以直接从存档重新解析入库，而无需重新执行扫描工具。
+"""
+import asyncio
+import os
+from pathlib import Path
+from typing import BinaryIO, Tuple
+
+# 存档目录 (Docker 中建议挂载为 volume)
+ARTIFACT_DIR = Path(os.getenv("ARTIFACT_DIR", Path(__file__).parent.parent.parent / "artifacts"))
+
+
+def artifact_paths(task_id: int) -> Tuple[Path, Path]:
+    """返回任务的 (stdout 存档路径, stderr 存档路径)，并确保目录存在"""
+    ARTIFACT_DIR.mkdir(parents=True, exist_ok=True)
+    return ARTIFACT_DIR / f"task_{task_id}.stdout", ARTIFACT_DIR / f"task_{task_id}.stderr"
+
+
+def stderr_path_for(stdout_path: str) -> Path:
+    """由 stdout 存档路径推导 stderr 存档路径"""
+    return Path(stdout_path).with_suffix(".stderr")
+
+
+class TeeReader:
+    """
+    包装子进程的 StreamReader: 解析器读到的每一块数据同时写入存档文件。
+    同时支持按块读取 (read) 与逐行迭代 (async for)，对解析器透明。
+    """
+
+    def __init__(self, reader: asyncio.StreamReader, sink: BinaryIO):
+        self.reader = reader
+        self.sink = sink
+
+    async def read(self, n: int = -1) -> bytes:
+        chunk = await self.reader.read(n)
+        self.sink.write(chunk)
+        return chunk
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self) -> bytes:
+        line = await self.reader.readline()
+        if not line:
+            raise StopAsyncIteration
+        self.sink.write(line)
+        return line
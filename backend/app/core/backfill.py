@@ -0,0 +1,106 @@
+# backend/app/core/backfill.py
+"""
+归属列回填。
+Port / HTTPService / Vulnerability 的 project_id / root_asset_id 是列表接口单表过滤的依据，也是唯一键的一部分，
+新数据入库时直接写入；迁移 0006 之前的旧数据归属为空，由这里沿外键链补齐:
+  ports           <- ip_addresses (ip_address_id)
+  http_services   <- ports (port_id)
+  vulnerabilities <- http_services (http_service_id)，没有关联服务时 <- hosts (host_id)
+升级之后、回填之前，同一资产可能已经重新入库了相同的端口 / URL / 漏洞 (归属为空的旧行不参与唯一键)。
+这样的旧行不再补归属，而是把引用它的子表改指向同一资产下已有的行，再删除旧行。
+按主键分批处理，每批单独提交，不长时间锁表；找不到来源的行保持为空，不影响后续批次。
+worker 启动时及每天凌晨执行一次 (ARQ cron)，也可以手动运行: python -m app.core.backfill
+"""
+import asyncio
+import os
+from typing import Any, Dict, Sequence, Tuple
+
+from sqlalchemy import and_, case, delete, update
+from sqlalchemy.future import select
+from sqlalchemy.orm import aliased
+
+from app.data.session import AsyncSessionLocal
+from app.data import models
+
+BACKFILL_BATCH_SIZE = int(os.getenv("BACKFILL_BATCH_SIZE", 5000))
+
+# (目标表, 来源表, 目标表上指向来源的外键列, 同一资产下的唯一键列, 引用目标表的 (子表, 外键列名))，按依赖顺序执行
+BACKFILL_STEPS: Sequence[Tuple[Any, Any, Any, Tuple[str, ...], Tuple[Tuple[Any, str], ...]]] = (
+    (models.Port, models.IPAddress, models.Port.ip_address_id, ("ip_address_id", "port_number"),
+     ((models.HTTPService, "port_id"),)),
+    (models.HTTPService, models.Port, models.HTTPService.port_id, ("url",),
+     ((models.Vulnerability, "http_service_id"), (models.WebFinding, "http_service_id"))),
+    (models.Vulnerability, models.HTTPService, models.Vulnerability.http_service_id, ("fingerprint",), ()),
+    (models.Vulnerability, models.Host, models.Vulnerability.host_id, ("fingerprint",), ()),
+)
+
+
+async def _merge_into_owned(db: Any, target: Any, source: Any, foreign_key: Any, key_columns: Tuple[str, ...],
+                            children: Tuple[Tuple[Any, str], ...], ids: Sequence[int]) -> int:
+    """ids 中在其归属资产下已有相同唯一键的旧行: 子表改指向已有的行后删除，返回删除的行数"""
+    kept = aliased(target)
+    rows = (await db.execute(
+        select(target.id, kept.id)
+        .select_from(target)
+        .join(source, foreign_key == source.id)
+        .join(kept, and_(
+            kept.root_asset_id == source.root_asset_id,
+            *(getattr(kept, column) == getattr(target, column) for column in key_columns),
+        ))
+        .where(target.id.in_(ids))
+    )).all()
+    if not rows:
+        return 0
+    keep_of = dict(rows)
+    for child, column in children:
+        child_column = getattr(child, column)
+        await db.execute(
+            update(child)
+            .where(child_column.in_(keep_of))
+            .values({column: case(keep_of, value=child_column)})
+            .execution_options(synchronize_session=False)
+        )
+    await db.execute(delete(target).where(target.id.in_(keep_of)).execution_options(synchronize_session=False))
+    return len(keep_of)
+
+
+async def _backfill_step(target: Any, source: Any, foreign_key: Any, key_columns: Tuple[str, ...],
+                         children: Tuple[Tuple[Any, str], ...], batch_size: int) -> int:
+    """沿 foreign_key 把 source 的归属复制到 target 中归属为空的行，返回处理 (更新或合并) 的行数"""
+    updated = 0
+    last_id = 0
+    while True:
+        async with AsyncSessionLocal() as db:
+            ids = (await db.execute(
+                select(target.id)
+                .where(target.root_asset_id.is_(None), target.id > last_id)
+                .order_by(target.id)
+                .limit(batch_size)
+            )).scalars().all()
+            if not ids:
+                return updated
+            last_id = ids[-1]
+            updated += await _merge_into_owned(db, target, source, foreign_key, key_columns, children, ids)
+            result = await db.execute(
+                update(target)
+                .where(target.id.in_(ids), foreign_key == source.id, source.root_asset_id.is_not(None))
+                .values(project_id=source.project_id, root_asset_id=source.root_asset_id)
+                .execution_options(synchronize_session=False)
+            )
+            await db.commit()
+            updated += result.rowcount
+
+
+async def backfill_owners(batch_size: int = BACKFILL_BATCH_SIZE) -> Dict[str, int]:
+    """补齐所有归属为空的行，返回 {表名: 处理行数}"""
+    counts: Dict[str, int] = {}
+    for target, source, foreign_key, key_columns, children in BACKFILL_STEPS:
+        updated = await _backfill_step(target, source, foreign_key, key_columns, children, batch_size)
+        counts[target.__tablename__] = counts.get(target.__tablename__, 0) + updated
+    if any(counts.values()):
+        print(f"[回填] 归属列已补齐: {counts}")
+    return counts
+
+
+if __name__ == "__main__":
+    asyncio.run(backfill_owners())
@@ -0,0 +1,119 @@
+# backend/app/core/batching.py
+"""
+多目标合并执行 (coalesce)。
+httpx / naabu / dnsx 这类工具每个目标起一个进程时，启动、加载模板、建立连接的开销远大于扫描本身。
+配置了 coalesce_max 与 demux_field 的扫描配置，在 worker 取到任务时会把同项目、同配置的其它 pending 任务
+一起认领 (最多 coalesce_max 个)，所有目标通过 stdin 交给一个进程；
+输出记录再按 demux_field (工具回显的输入目标) 分发回各自的 ScanTask / Asset。
+"""
+from typing import Any, Dict, List, Optional
+
+from sqlalchemy import update
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.future import select
+
+from app.data import models
+
+
+def coalesce_limit(scan_config: Dict[str, Any]) -> int:
+    """配置允许合并的最大任务数 (未开启时为 1)"""
+    if not scan_config.get("demux_field") or not scan_config.get("batch_command_template"):
+        return 1
+    return max(1, int(scan_config.get("coalesce_max") or 1))
+
+
+def normalize_target(value: Any) -> str:
+    """统一目标格式，便于与工具回显的输入字段比较"""
+    return str(value).strip().lower().rstrip(".")
+
+
+async def claim_coalesced_tasks(db: AsyncSession, leader: models.ScanTask, limit: int) -> List[models.ScanTask]:
+    """
+    认领最多 limit 个与 leader 同项目、同配置、同父任务、同优先级的 pending 单目标任务，
+    标记为 running 并记录 batch_leader_id。
+    限定项目与优先级: 其它项目或低优先级的任务不会借 leader 的调度位置提前执行；分片子任务也只与同批的分片合并。
+    使用 FOR UPDATE SKIP LOCKED，多个 worker 同时认领时不会重复；
+    被认领任务由调用方从命名队列中移除；已经分发到 ARQ 队列的 job 会因状态不为 pending 而直接跳过。
+    """
+    if limit <= 0:
+        return []
+    leader_project = select(models.Asset.project_id).where(models.Asset.id == leader.asset_id).scalar_subquery()
+    candidates = (
+        select(models.ScanTask.id)
+        .join(models.Asset, models.Asset.id == models.ScanTask.asset_id)
+        .where(
+            models.ScanTask.status == "pending",
+            models.ScanTask.config_name == leader.config_name,
+            models.ScanTask.id != leader.id,
+            models.ScanTask.targets.is_(None),
+            models.ScanTask.stage_index.is_(None),
+            models.ScanTask.parent_task_id.is_not_distinct_from(leader.parent_task_id),
+            models.ScanTask.priority == leader.priority,
+            models.Asset.project_id == leader_project,
+        )
+        .order_by(models.ScanTask.id)
+        .limit(limit)
+        .with_for_update(of=models.ScanTask, skip_locked=True)
+    )
+    result = await db.execute(
+        update(models.ScanTask)
+        .where(models.ScanTask.id.in_(candidates.scalar_subquery()))
+        .values(status="running", batch_leader_id=leader.id, checkpoint=0, results_count=0,
+                artifact_path=None, artifact_size=None)
+        .returning(models.ScanTask.id)
+        .execution_options(synchronize_session=False)
+    )
+    follower_ids = [row[0] for row in result.all()]
+    if not follower_ids:
+        return []
+    followers = (await db.execute(
+        select(models.ScanTask).where(models.ScanTask.id.in_(follower_ids)).order_by(models.ScanTask.id)
+        .execution_options(populate_existing=True)
+    )).scalars().all()
+    return list(followers)
+
+
+async def load_batch_followers(db: AsyncSession, leader: models.ScanTask) -> List[models.ScanTask]:
+    """重新入库时找回上一次与 leader 合并执行的任务"""
+    result = await db.execute(
+        select(models.ScanTask).where(models.ScanTask.batch_leader_id == leader.id).order_by(models.ScanTask.id)
+    )
+    return list(result.scalars().all())
+
+
+class TaskDemux:
+    """
+    按 demux_field 把合并执行的输出记录分发回各任务。
+    多个任务目标相同 (如同一项目中重名的资产) 时，记录会同时分发给这些任务。
+    """
+
+    def __init__(self, tasks: List[models.ScanTask], assets: Dict[int, models.Asset], field: str):
+        self.tasks = tasks
+        self.assets = assets
+        self.field = field
+        self.tasks_by_id = {task.id: task for task in tasks}
+        self.by_target: Dict[str, List[models.ScanTask]] = {}
+        for task in tasks:
+            self.by_target.setdefault(normalize_target(self.target_of(task)), []).append(task)
+        self.unmatched_count = 0
+        self.processed: Dict[int, int] = {}  # 入库结束后由调用方填入各任务的处理条数
+
+    def target_of(self, task: models.ScanTask) -> str:
+        return task.target or self.assets[task.asset_id].name
+
+    def targets(self) -> List[str]:
+        """去重后的目标列表 (写入 stdin)"""
+        return list(dict.fromkeys(self.target_of(task) for task in self.tasks))
+
+    def split(self, batch: List[Dict[str, Any]]) -> Dict[int, List[Dict[str, Any]]]:
+        """返回 task_id -> 该任务的记录列表；无法匹配的记录计入 unmatched_count 后丢弃"""
+        routed: Dict[int, List[Dict[str, Any]]] = {}
+        for res in batch:
+            value: Optional[Any] = res.get(self.field)
+            owners = self.by_target.get(normalize_target(value)) if value else None
+            if not owners:
+                self.unmatched_count += 1
+                continue
+            for task in owners:
+                routed.setdefault(task.id, []).append(res)
+        return routed
@@ -0,0 +1,74 @@
+# backend/app/core/cancellation.py
+"""
+任务取消与子进程树的终止。
+API 收到取消请求时在 Redis 中写入一个标记 (scan:cancel:{task_id})，
+执行该任务的 worker 在工具运行期间定期检查标记，发现后终止整个进程组；
+已解析的记录照常在最后一个检查点提交，任务标记为 cancelled。
+扫描工具通过 create_subprocess_shell 启动时使用独立的会话 (进程组)，
+因此 shell 派生的 nmap / nuclei 等子进程会一并被终止，不会成为孤儿进程。
+"""
+import asyncio
+import os
+import signal
+from typing import Optional
+
+from app.core.arq_config import get_arq_pool
+
+CANCEL_KEY_PREFIX = os.getenv("SCAN_CANCEL_PREFIX", "scan:cancel:")
+# 取消标记的有效期 (秒)，worker 没有处理 (如任务已结束) 时自动过期
+CANCEL_KEY_TTL = int(os.getenv("SCAN_CANCEL_TTL", 86400))
+# 工具运行期间检查取消标记 / 超时的间隔 (秒)
+CANCEL_POLL_INTERVAL = float(os.getenv("SCAN_CANCEL_POLL_INTERVAL", 2))
+# 发送 SIGTERM 后等待进程组退出的时间，超时再发送 SIGKILL
+KILL_GRACE_SECONDS = float(os.getenv("SCAN_KILL_GRACE_SECONDS", 5))
+
+
+def cancel_key(task_id: int) -> str:
+    return f"{CANCEL_KEY_PREFIX}{task_id}"
+
+
+async def request_cancel(redis, task_id: int) -> None:
+    """标记任务需要取消 (由执行它的 worker 处理)"""
+    await redis.set(cancel_key(task_id), 1, ex=CANCEL_KEY_TTL)
+
+
+async def clear_cancel(task_id: int) -> None:
+    """worker 开始执行或处理完取消后清除标记"""
+    try:
+        redis = await get_arq_pool()
+        await redis.delete(cancel_key(task_id))
+    except Exception as e:
+        print(f"[任务 {task_id}] 清除取消标记失败: {e}")
+
+
+async def is_cancel_requested(task_id: int) -> bool:
+    """worker 端检查取消标记；Redis 不可用时视为未取消 (任务继续执行)"""
+    try:
+        redis = await get_arq_pool()
+        return bool(await redis.exists(cancel_key(task_id)))
+    except Exception as e:
+        print(f"[任务 {task_id}] 检查取消标记失败: {e}")
+        return False
+
+
+def _signal_group(process: asyncio.subprocess.Process, sig: int) -> None:
+    try:
+        os.killpg(process.pid, sig)
+    except ProcessLookupError:
+        pass
+
+
+async def kill_process_group(process: asyncio.subprocess.Process, grace: Optional[float] = KILL_GRACE_SECONDS) -> None:
+    """
+    终止 start_new_session=True 启动的子进程及其派生的整个进程组。
+    先发送 SIGTERM 让工具有机会刷新输出，grace 秒后仍未退出再发送 SIGKILL。
+    """
+    if grace:
+        _signal_group(process, signal.SIGTERM)
+        try:
+            await asyncio.wait_for(process.wait(), timeout=grace)
+        except asyncio.TimeoutError:
+            pass
+    # shell 退出后其子进程可能仍在同一进程组中运行，统一再清理一次
+    _signal_group(process, signal.SIGKILL)
+    await process.wait()
@@ -52,4 +52,30 @@ def get_available_scan_config_names() -> List[str]:
     for config in configs:
         if isinstance(config, dict) and "config_name" in config:
             names.append(config["config_name"])
-    return names
\ No newline at end of file
+    return names
+def get_pipeline_by_name(pipeline_name: str) -> Optional[Dict[str, Any]]:
+    """
+    根据名称查找流水线定义 (scanners.yaml 中带 pipeline_name 的条目)。
+    """
+    configs = load_scan_configs()
+    for config in configs:
+        if isinstance(config, dict) and config.get("pipeline_name") == pipeline_name:
+            return config
+    return None
+
+def get_available_pipelines() -> List[Dict[str, Any]]:
+    """
+    获取所有流水线定义列表。
+    """
+    configs = load_scan_configs()
+    return [config for config in configs if isinstance(config, dict) and config.get("pipeline_name")]
+
+def get_scheduler_settings() -> Dict[str, Any]:
+    """
+    获取调度设置 (scanners.yaml 中的 scheduler 条目)，未配置时返回空字典。
+    """
+    configs = load_scan_configs()
+    for config in configs:
+        if isinstance(config, dict) and isinstance(config.get("scheduler"), dict):
+            return config["scheduler"]
+    return {}
@@ -0,0 +1,340 @@
+# backend/app/core/dispatch.py
+"""
+分类优先级队列与加权公平出队。
+API / 流水线 / 重试等入口不再直接推送到 ARQ 队列，而是按扫描类别放进 Redis 中的命名队列
+(默认 passive / active-light / active-heavy，由配置的 agent_type 自动路由，配置的 queue 字段可覆盖)。
+每个命名队列下再按项目 (Asset.project_id) 分成子队列，子队列是一个有序集合，
+按任务优先级 (0-9，越大越先) 再按入队时间排序。
+worker 内的分发循环只在 ARQ 队列中"可立即执行"的 job 不足时补充:
+  1. 在有可分发任务的命名队列之间按权重做平滑加权轮询 (smooth WRR)
+  2. 在该命名队列内，在未达到在途上限的项目之间同样按项目权重轮询 (公平份额)
+因此 1 万个 nuclei 任务排队时，新的 subfinder 任务最多只需等待几个 job；
+一个项目排入 2 万个资产时，其它项目的任务仍然按轮询穿插执行。
+准入被延后的任务先进入延后集合，到期后由分发循环放回原来的命名队列。
+"""
+import asyncio
+import os
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+from app.data import models
+from app.core.arq_config import TASK_RUN_SCAN, ARQ_QUEUE_NAME
+from app.core.config_loader import get_scan_config_by_name, get_scheduler_settings
+
+# 命名队列在 Redis 中的键前缀
+SCAN_QUEUE_PREFIX = os.getenv("SCAN_QUEUE_PREFIX", "scan:queue:")
+# 延后入队的任务 (有序集合，分数为到期时间的毫秒时间戳)
+SCAN_DELAYED_KEY = os.getenv("SCAN_DELAYED_KEY", "scan:delayed")
+# 各项目在途任务集合的键前缀
+SCAN_INFLIGHT_PREFIX = os.getenv("SCAN_INFLIGHT_PREFIX", "scan:inflight:")
+# ARQ 队列中保持多少个可立即执行的 job (越小越公平，越大空闲时越不容易断流)
+DISPATCH_READY_TARGET = int(os.getenv("DISPATCH_READY_TARGET", 20))
+# 分发循环的间隔 (秒)
+DISPATCH_INTERVAL = float(os.getenv("DISPATCH_INTERVAL", 0.5))
+# 每个项目同时在途 (已分发、未结束) 的任务上限默认值
+DEFAULT_MAX_INFLIGHT_PER_PROJECT = int(os.getenv("MAX_INFLIGHT_PER_PROJECT", 20))
+
+# scanners.yaml 未配置 scheduler.queues 时的默认队列与权重
+DEFAULT_QUEUE_WEIGHTS = {"passive": 5, "active-light": 3, "active-heavy": 1}
+DEFAULT_QUEUE_BY_AGENT_TYPE = {
+    "subdomain": "passive",
+    "http": "active-light",
+    "portscan": "active-heavy",
+    "vulnerability": "active-heavy",
+}
+DEFAULT_QUEUE = "active-light"
+
+# 任务优先级范围
+MIN_PRIORITY = 0
+MAX_PRIORITY = 9
+DEFAULT_PRIORITY = 5
+
+# 没有关联资产的任务归入项目 0
+NO_PROJECT = 0
+
+# 从项目子队列取出一个任务；子队列取空时同时把项目移出该命名队列的项目集合。
+# 用脚本保证原子性，避免与入队 (ZADD + SADD) 交错时把刚入队的项目移出集合
+_POP_SCRIPT = """
+local popped = redis.call('ZPOPMIN', KEYS[1])
+if redis.call('ZCARD', KEYS[1]) == 0 then
+    redis.call('SREM', KEYS[2], ARGV[1])
+end
+return popped
+"""
+
+# 把到期的延后任务移回命名队列中项目的子队列。延后集合的成员为 "队列名|项目|分数|task_id:reingest"，
+# 用脚本保证移动的原子性: 多个 worker 同时处理时不会重复放回，中途退出也不会丢失
+_PROMOTE_SCRIPT = """
+local due = redis.call('ZRANGEBYSCORE', KEYS[1], '-inf', ARGV[1])
+for _, raw in ipairs(due) do
+    local name, project, score, member = string.match(raw, '^(.-)|([^|]+)|([^|]+)|(.+)$')
+    redis.call('ZADD', ARGV[2] .. name .. ':project:' .. project, score, member)
+    redis.call('SADD', ARGV[2] .. name .. ':projects', project)
+    redis.call('ZREM', KEYS[1], raw)
+end
+return #due
+"""
+
+
+def queue_weights(settings: Optional[Dict[str, Any]] = None) -> Dict[str, int]:
+    """命名队列 -> 权重"""
+    settings = settings if settings is not None else get_scheduler_settings()
+    queues = settings.get("queues") or DEFAULT_QUEUE_WEIGHTS
+    return {name: max(1, int(weight)) for name, weight in queues.items()}
+
+
+def queue_for_config(scan_config: Optional[Dict[str, Any]]) -> str:
+    """根据配置的 queue 字段或 agent_type 决定进入哪个命名队列"""
+    settings = get_scheduler_settings()
+    weights = queue_weights(settings)
+    scan_config = scan_config or {}
+    name = scan_config.get("queue")
+    if not name:
+        by_agent_type = settings.get("queue_by_agent_type") or DEFAULT_QUEUE_BY_AGENT_TYPE
+        name = by_agent_type.get(scan_config.get("agent_type"))
+    if name not in weights:
+        name = settings.get("default_queue") or DEFAULT_QUEUE
+    if name not in weights:
+        # 配置中的默认队列也不存在时退回到权重最高的队列
+        name = max(weights, key=weights.get)
+    return name
+
+
+def project_weight(project_id: int, settings: Dict[str, Any]) -> int:
+    """项目在公平份额中的权重 (scheduler.project_weights，默认 1 即纯轮询)"""
+    weights = settings.get("project_weights") or {}
+    return max(1, int(weights.get(project_id, 1)))
+
+
+def project_max_inflight(project_id: int, settings: Dict[str, Any]) -> int:
+    """项目的在途任务上限 (scheduler.project_max_inflight 优先于 max_inflight_per_project)"""
+    overrides = settings.get("project_max_inflight") or {}
+    if project_id in overrides:
+        return int(overrides[project_id])
+    return int(settings.get("max_inflight_per_project") or DEFAULT_MAX_INFLIGHT_PER_PROJECT)
+
+
+def queue_key(name: str) -> str:
+    """命名队列中有待分发任务的项目集合"""
+    return f"{SCAN_QUEUE_PREFIX}{name}:projects"
+
+
+def project_queue_key(name: str, project_id: int) -> str:
+    return f"{SCAN_QUEUE_PREFIX}{name}:project:{project_id}"
+
+
+def inflight_key(project_id: int) -> str:
+    return f"{SCAN_INFLIGHT_PREFIX}{project_id}"
+
+
+def _score(priority: Optional[int]) -> float:
+    """优先级越高分数越小 (先出队)，同优先级按入队时间先后"""
+    priority = DEFAULT_PRIORITY if priority is None else min(max(int(priority), MIN_PRIORITY), MAX_PRIORITY)
+    return (MAX_PRIORITY - priority) * 10 ** 13 + int(time.time() * 1000)
+
+
+def _member(task_id: int, reingest: bool) -> str:
+    return f"{task_id}:{1 if reingest else 0}"
+
+
+def _parse_member(member: Any) -> Tuple[int, bool]:
+    if isinstance(member, bytes):
+        member = member.decode()
+    task_id, reingest = member.split(":", 1)
+    return int(task_id), reingest == "1"
+
+
+def _decode_ids(values) -> List[int]:
+    return sorted(int(v.decode() if isinstance(v, bytes) else v) for v in values)
+
+
+async def _push(redis, name: str, project_id: int, member: str, score: float) -> None:
+    async with redis.pipeline(transaction=True) as pipe:
+        pipe.zadd(project_queue_key(name, project_id), {member: score})
+        pipe.sadd(queue_key(name), project_id)
+        await pipe.execute()
+
+
+async def enqueue_scan_task(redis, task: models.ScanTask, project_id: Optional[int], reingest: bool = False,
+                            delay: float = 0) -> str:
+    """
+    把任务放进对应命名队列中该项目的子队列，返回队列名。
+    同一任务重复入队只保留一个 (有序集合成员为 task_id:reingest)。
+    delay > 0 时先放进延后集合，delay 秒后才进入命名队列参与分发 (准入被延后的任务)。
+    """
+    name = queue_for_config(get_scan_config_by_name(task.config_name))
+    project_id = NO_PROJECT if project_id is None else project_id
+    member, score = _member(task.id, reingest), _score(task.priority)
+    if delay > 0:
+        due = int((time.time() + delay) * 1000)
+        await redis.zadd(SCAN_DELAYED_KEY, {f"{name}|{project_id}|{score}|{member}": due})
+    else:
+        await _push(redis, name, project_id, member, score)
+    return name
+
+
+async def discard_queued_tasks(redis, task: models.ScanTask, project_id: Optional[int], task_ids: List[int]) -> None:
+    """把已被其它任务合并执行的任务从命名队列中移除，避免它们之后再占用分发名额"""
+    if task_ids:
+        name = queue_for_config(get_scan_config_by_name(task.config_name))
+        project_id = NO_PROJECT if project_id is None else project_id
+        await redis.zrem(project_queue_key(name, project_id), *(_member(task_id, False) for task_id in task_ids))
+
+
+async def promote_delayed(redis) -> int:
+    """把已到期的延后任务放回各自的命名队列，返回移动的任务数"""
+    return int(await redis.eval(_PROMOTE_SCRIPT, 1, SCAN_DELAYED_KEY, int(time.time() * 1000), SCAN_QUEUE_PREFIX))
+
+
+async def release_inflight(redis, project_id: int, task_id: int) -> None:
+    """任务执行结束 (不论成败) 后释放项目的在途名额"""
+    await redis.srem(inflight_key(project_id), task_id)
+
+
+async def queue_lengths(redis) -> Dict[str, int]:
+    """各命名队列中等待分发的任务数"""
+    lengths: Dict[str, int] = {}
+    for name in queue_weights():
+        project_ids = _decode_ids(await redis.smembers(queue_key(name)))
+        total = 0
+        for project_id in project_ids:
+            total += int(await redis.zcard(project_queue_key(name, project_id)))
+        lengths[name] = total
+    return lengths
+
+
+async def project_shares(redis) -> List[Dict[str, Any]]:
+    """
+    各项目的排队数 (按命名队列)、在途数、在途上限，以及在途任务占全部在途任务的比例。
+    只列出有排队或在途任务的项目。
+    """
+    settings = get_scheduler_settings()
+    rows: Dict[int, Dict[str, Any]] = {}
+
+    def row(project_id: int) -> Dict[str, Any]:
+        if project_id not in rows:
+            rows[project_id] = {
+                "project_id": project_id,
+                "pending": {},
+                "inflight": 0,
+                "max_inflight": project_max_inflight(project_id, settings),
+                "weight": project_weight(project_id, settings),
+            }
+        return rows[project_id]
+
+    for name in queue_weights(settings):
+        for project_id in _decode_ids(await redis.smembers(queue_key(name))):
+            row(project_id)["pending"][name] = int(await redis.zcard(project_queue_key(name, project_id)))
+    async for key in redis.scan_iter(match=f"{SCAN_INFLIGHT_PREFIX}*"):
+        key = key.decode() if isinstance(key, bytes) else key
+        count = int(await redis.scard(key))
+        if count:
+            row(int(key[len(SCAN_INFLIGHT_PREFIX):]))["inflight"] = count
+
+    total_inflight = sum(r["inflight"] for r in rows.values())
+    for r in rows.values():
+        r["share"] = r["inflight"] / total_inflight if total_inflight else 0.0
+    return [rows[project_id] for project_id in sorted(rows)]
+
+
+class WeightedRoundRobin:
+    """
+    平滑加权轮询 (与 nginx upstream 相同的算法)。
+    权重 5:3:1 时每 9 次选择中三个候选分别被选 5、3、1 次，且相互穿插而不是连续成段；
+    只在当前可选的候选之间选择，不可选的候选不累积份额 (避免恢复后连续占用)。
+    """
+
+    def __init__(self):
+        self.current: Dict[Any, int] = {}
+
+    def pick(self, available: List[Any], weights: Dict[Any, int]) -> Any:
+        total = 0
+        best = None
+        for key in available:
+            weight = weights.get(key, 1)
+            self.current[key] = self.current.get(key, 0) + weight
+            total += weight
+            if best is None or self.current[key] > self.current[best]:
+                best = key
+        self.current[best] -= total
+        return best
+
+
+class Dispatcher:
+    """分发循环的状态: 命名队列之间一个轮询器，每个命名队列内的项目之间各一个轮询器"""
+
+    def __init__(self):
+        self.queues = WeightedRoundRobin()
+        self.projects: Dict[str, WeightedRoundRobin] = {}
+
+    async def _eligible_projects(self, redis, name: str, settings: Dict[str, Any],
+                                 inflight: Dict[int, int]) -> List[int]:
+        """命名队列中有排队任务且未达到在途上限的项目"""
+        eligible = []
+        for project_id in _decode_ids(await redis.smembers(queue_key(name))):
+            if project_id not in inflight:
+                inflight[project_id] = int(await redis.scard(inflight_key(project_id)))
+            if inflight[project_id] < project_max_inflight(project_id, settings):
+                eligible.append(project_id)
+        return eligible
+
+    async def dispatch_once(self, redis, ready_target: int = DISPATCH_READY_TARGET) -> int:
+        """
+        ARQ 队列中可立即执行的 job 少于 ready_target 时，从命名队列按权重补充。
+        返回本次分发的 job 数。多个 worker 同时分发时依靠 ZPOPMIN 的原子性保证不会重复取出
+        (在途上限在多个分发者之间可能被短暂超过一两个)。
+        """
+        await promote_delayed(redis)
+        # ARQ 队列的分数是计划执行时间 (毫秒)，被 Retry 延后的 job 不计入
+        ready = await redis.zcount(ARQ_QUEUE_NAME, 0, int(time.time() * 1000))
+        room = ready_target - ready
+        dispatched = 0
+        settings = get_scheduler_settings()
+        weights = queue_weights(settings)
+        inflight: Dict[int, int] = {}
+        while room > 0:
+            eligible = {}
+            for name in weights:
+                projects = await self._eligible_projects(redis, name, settings, inflight)
+                if projects:
+                    eligible[name] = projects
+            if not eligible:
+                break
+            name = self.queues.pick(list(eligible), weights)
+            rr = self.projects.setdefault(name, WeightedRoundRobin())
+            project_id = rr.pick(eligible[name], {p: project_weight(p, settings) for p in eligible[name]})
+
+            popped = await redis.eval(
+                _POP_SCRIPT, 2, project_queue_key(name, project_id), queue_key(name), project_id
+            )
+            if not popped:
+                continue
+            member, score = popped[0], float(popped[1])
+            task_id, reingest = _parse_member(member)
+            await redis.sadd(inflight_key(project_id), task_id)
+            try:
+                await redis.enqueue_job(
+                    TASK_RUN_SCAN, task_id, reingest=reingest, project_id=project_id, _queue_name=ARQ_QUEUE_NAME
+                )
+            except Exception:
+                # 推送失败时放回原位置，保持原有的优先级和先后顺序
+                await redis.srem(inflight_key(project_id), task_id)
+                await _push(redis, name, project_id, member, score)
+                raise
+            inflight[project_id] += 1
+            dispatched += 1
+            room -= 1
+        return dispatched
+
+
+async def dispatch_loop(redis, interval: float = DISPATCH_INTERVAL) -> None:
+    """worker 启动后常驻的分发循环"""
+    dispatcher = Dispatcher()
+    while True:
+        try:
+            await dispatcher.dispatch_once(redis)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            print(f"[分发] 从命名队列分发任务失败: {e}")
+        await asyncio.sleep(interval)
@@ -0,0 +1,162 @@
+# backend/app/core/entity_cache.py
+"""
+worker 进程内的实体 ID 缓存: 自然键 -> 主键。
+  ips:   IPAddress.ip_address -> id
+  hosts: Host.hostname -> id
+  ports: (Port.root_asset_id, ip_address_id, port_number) -> id  (端口按资产各自一条)
+同一个 worker 反复扫描同一批资产时，入库前的存在性检查 (SELECT) 大部分可以直接命中缓存。
+每类缓存按 LRU 限制条目数 (ENTITY_CACHE_MAX_ENTRIES)。
+
+一致性:
+  - 本事务中新写入 / 查到的 ID 先暂存在会话上，事务提交后才进入缓存 (回滚的插入不会留下无效 ID)。
+  - API 删除实体后递增 Redis 中的代数 (generation) 并通过 pub/sub 广播，
+    各 worker 收到后清空缓存；每个任务开始前也会比对一次代数，防止错过广播。
+"""
+import asyncio
+import os
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, Iterable, Optional, Set, Tuple
+
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+from app.core.arq_config import get_arq_pool
+
+ENTITY_CACHE_MAX_ENTRIES = int(os.getenv("ENTITY_CACHE_MAX_ENTRIES", 200000))
+GENERATION_KEY = os.getenv("ENTITY_CACHE_GENERATION_KEY", "entity:generation")
+INVALIDATE_CHANNEL = os.getenv("ENTITY_CACHE_CHANNEL", "entity:invalidate")
+
+# 会话 info 中暂存待提交条目的键
+_PENDING_KEY = "entity_cache_pending"
+
+
+class EntityIdCache:
+    """有界 LRU: 自然键 -> 主键"""
+
+    def __init__(self, name: str, max_entries: int = ENTITY_CACHE_MAX_ENTRIES):
+        self.name = name
+        self.max_entries = max_entries
+        self.entries: "OrderedDict[Hashable, int]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: Hashable) -> Optional[int]:
+        value = self.entries.get(key)
+        if value is None:
+            self.misses += 1
+            return None
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def get_many(self, keys: Iterable[Hashable]) -> Tuple[Dict[Hashable, int], Set[Hashable]]:
+        """返回 (命中的 键 -> ID, 未命中的键集合)"""
+        found: Dict[Hashable, int] = {}
+        missing: Set[Hashable] = set()
+        for key in keys:
+            value = self.get(key)
+            if value is None:
+                missing.add(key)
+            else:
+                found[key] = value
+        return found, missing
+
+    def put(self, key: Hashable, value: int) -> None:
+        self.entries[key] = value
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+
+    def clear(self) -> None:
+        self.entries.clear()
+
+
+ip_ids = EntityIdCache("ips")
+host_ids = EntityIdCache("hosts")
+port_ids = EntityIdCache("ports")
+CACHES = (ip_ids, host_ids, port_ids)
+
+# 本进程缓存对应的代数 (None 表示尚未与 Redis 同步)
+_generation: Optional[int] = None
+
+
+def clear_all() -> None:
+    for cache in CACHES:
+        cache.clear()
+
+
+def stats() -> Dict[str, Dict[str, int]]:
+    """各缓存的条目数与命中情况 (调试用)"""
+    return {
+        cache.name: {"entries": len(cache.entries), "hits": cache.hits, "misses": cache.misses}
+        for cache in CACHES
+    }
+
+
+def remember(db: Any, cache: EntityIdCache, mapping: Dict[Hashable, int]) -> None:
+    """把本事务中得到的 ID 暂存到会话上，事务提交后再写入缓存"""
+    if mapping:
+        db.info.setdefault(_PENDING_KEY, []).append((cache, _generation, dict(mapping)))
+
+
+@event.listens_for(Session, "after_commit")
+def _promote_pending(session: Session) -> None:
+    for cache, generation, mapping in session.info.pop(_PENDING_KEY, ()):
+        # 暂存之后发生过失效的条目丢弃 (对应的行可能已被删除)
+        if generation == _generation:
+            for key, value in mapping.items():
+                cache.put(key, value)
+
+
+@event.listens_for(Session, "after_rollback")
+def _discard_pending(session: Session) -> None:
+    session.info.pop(_PENDING_KEY, None)
+
+
+def _apply_generation(generation: int) -> None:
+    global _generation
+    if generation != _generation:
+        if _generation is not None:
+            print(f"[实体缓存] 代数 {_generation} -> {generation}，清空缓存")
+        clear_all()
+        _generation = generation
+
+
+async def sync_generation() -> None:
+    """任务开始前比对 Redis 中的代数，不一致时清空缓存；Redis 不可用时同样清空 (不冒险使用旧 ID)"""
+    try:
+        redis = await get_arq_pool()
+        _apply_generation(int(await redis.get(GENERATION_KEY) or 0))
+    except Exception as e:
+        print(f"[实体缓存] 读取代数失败: {e}")
+        _apply_generation(-1)
+
+
+async def invalidate_entities() -> None:
+    """API 删除实体后调用: 递增代数并广播，所有 worker 清空缓存"""
+    try:
+        redis = await get_arq_pool()
+        generation = await redis.incr(GENERATION_KEY)
+        await redis.publish(INVALIDATE_CHANNEL, generation)
+    except Exception as e:
+        print(f"[实体缓存] 广播失效失败: {e}")
+
+
+async def invalidation_listener(redis) -> None:
+    """worker 后台订阅失效广播 (连接断开后重连)"""
+    while True:
+        pubsub = redis.pubsub()
+        try:
+            await pubsub.subscribe(INVALIDATE_CHANNEL)
+            # 订阅之前可能已经错过了广播
+            await sync_generation()
+            async for message in pubsub.listen():
+                if message.get("type") == "message":
+                    _apply_generation(int(message["data"]))
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            print(f"[实体缓存] 订阅失效广播出错: {e}，稍后重连")
+            await asyncio.sleep(5)
+        finally:
+            await pubsub.aclose()
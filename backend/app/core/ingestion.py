@@ -0,0 +1,432 @@
+# backend/app/core/ingestion.py
+"""
+批量入库引擎。
+把解析器产出的记录先缓冲成批 (batch)，每批对每张表只执行一次
+INSERT ... ON CONFLICT DO NOTHING RETURNING (依赖各表自然键上的唯一约束，见 alembic 迁移 0003；
+端口 / Web 服务 / 漏洞的唯一键按所属资产划分，见迁移 0006)，替代逐行 SELECT + flush 的去重方式。
+已在 worker 实体 ID 缓存 (app/core/entity_cache.py) 中的主机名 / IP 直接取 ID，不再写入和补查。
+"""
+import hashlib
+import json
+import os
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple
+from urllib.parse import urlsplit
+
+from sqlalchemy import case, func, insert, literal, literal_column, tuple_
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.future import select
+
+from app.data import models
+from app.core import entity_cache
+
+# 每批缓冲的记录条数 (可通过环境变量调整)
+INGEST_BATCH_SIZE = int(os.getenv("INGEST_BATCH_SIZE", 1000))
+
+# asyncpg 单条语句最多 32767 个绑定参数，多行 VALUES 需要按此切分
+MAX_BIND_PARAMS = 32767
+
+
+def _chunked(rows: List[Any], columns_per_row: int) -> Iterable[List[Any]]:
+    """按绑定参数上限切分多行 VALUES，正常批量下只会切出一段"""
+    size = max(1, MAX_BIND_PARAMS // max(1, columns_per_row))
+    for start in range(0, len(rows), size):
+        yield rows[start:start + size]
+
+
+def extract_subdomain_record(res: Dict[str, Any]) -> Optional[Tuple[str, str, Set[str]]]:
+    """
+    从一条子域名解析结果中提取 (hostname, record_type, ip 集合)。
+    没有 hostname 的记录返回 None。
+    """
+    # Subfinder 常见字段: host / ip / ips / type
+    hostname_raw = res.get("hostname") or res.get("host") or res.get("target")
+    hostname = hostname_raw.lower().rstrip(".") if hostname_raw else None
+    if not hostname:
+        return None
+    record_type = res.get("record_type") or res.get("type") or "A"
+
+    # 支持单个 ip 或 ips 列表
+    ip_values: Set[str] = set()
+    ip_single = res.get("ip")
+    if ip_single:
+        if isinstance(ip_single, list):
+            ip_values.update([ip for ip in ip_single if ip])
+        else:
+            ip_values.add(ip_single)
+    ip_values_raw = res.get("ips") or []
+    if isinstance(ip_values_raw, list):
+        ip_values.update([ip for ip in ip_values_raw if ip])
+    return hostname, record_type, ip_values
+
+
+async def upsert_hosts(db: AsyncSession, hostnames: Set[str], project_id: int, root_asset_id: int) -> Tuple[Dict[str, int], int]:
+    """
+    批量写入 Host，已存在的主机名保持不变。
+    返回 (hostname -> id 映射, 新增数量)。
+    """
+    cached, hostnames = entity_cache.host_ids.get_many(hostnames)
+    if not hostnames:
+        return cached, 0
+    # 排序后写入，降低多个 worker 并发写同一批键时的死锁概率
+    rows = [
+        {"hostname": name, "project_id": project_id, "root_asset_id": root_asset_id, "status": "discovered"}
+        for name in sorted(hostnames)
+    ]
+    id_map: Dict[str, int] = {}
+    for chunk in _chunked(rows, 4):
+        stmt = (
+            pg_insert(models.Host)
+            .values(chunk)
+            .on_conflict_do_nothing(index_elements=[models.Host.hostname])
+            .returning(models.Host.id, models.Host.hostname)
+        )
+        result = await db.execute(stmt)
+        id_map.update({hostname: host_id for host_id, hostname in result.all()})
+    created = len(id_map)
+
+    # ON CONFLICT DO NOTHING 不返回已存在的行，补查一次
+    missing = hostnames - id_map.keys()
+    if missing:
+        result = await db.execute(
+            select(models.Host.id, models.Host.hostname).where(models.Host.hostname.in_(missing))
+        )
+        id_map.update({hostname: host_id for host_id, hostname in result.all()})
+    entity_cache.remember(db, entity_cache.host_ids, id_map)
+    return {**cached, **id_map}, created
+
+
+async def upsert_ip_addresses(db: AsyncSession, ips: Set[str], project_id: int, root_asset_id: int) -> Tuple[Dict[str, int], int]:
+    """
+    批量写入 IPAddress，已存在的 IP 保持不变。
+    返回 (ip -> id 映射, 新增数量)。
+    """
+    cached, ips = entity_cache.ip_ids.get_many(ips)
+    if not ips:
+        return cached, 0
+    rows = [
+        {"ip_address": ip, "project_id": project_id, "root_asset_id": root_asset_id, "status": "discovered"}
+        for ip in sorted(ips)
+    ]
+    id_map: Dict[str, int] = {}
+    for chunk in _chunked(rows, 4):
+        stmt = (
+            pg_insert(models.IPAddress)
+            .values(chunk)
+            .on_conflict_do_nothing(index_elements=[models.IPAddress.ip_address])
+            .returning(models.IPAddress.id, models.IPAddress.ip_address)
+        )
+        result = await db.execute(stmt)
+        id_map.update({ip: ip_id for ip_id, ip in result.all()})
+    created = len(id_map)
+
+    missing = ips - id_map.keys()
+    if missing:
+        result = await db.execute(
+            select(models.IPAddress.id, models.IPAddress.ip_address).where(models.IPAddress.ip_address.in_(missing))
+        )
+        id_map.update({ip: ip_id for ip_id, ip in result.all()})
+    entity_cache.remember(db, entity_cache.ip_ids, id_map)
+    return {**cached, **id_map}, created
+
+
+async def upsert_ports(
+    db: AsyncSession, ports: Dict[Tuple[int, int], Optional[str]], project_id: int, root_asset_id: int,
+) -> Tuple[Dict[Tuple[int, int], int], int]:
+    """
+    批量写入 root_asset_id 资产下的 Port ((ip_address_id, port_number) -> service_name)，该资产下已存在的端口保持不变。
+    多个资产共享同一个 IP 时各自有一条端口记录 (唯一约束 uq_port_owner_ip_number)。
+    返回 ((ip_address_id, port_number) -> id 映射, 新增数量)。
+    """
+    # 缓存的键带上归属: (root_asset_id, ip_address_id, port_number)
+    cached, missing = entity_cache.port_ids.get_many((root_asset_id, ip_id, port_number) for ip_id, port_number in ports)
+    found = {key[1:]: port_id for key, port_id in cached.items()}
+    if not missing:
+        return found, 0
+    rows = [
+        {
+            "ip_address_id": ip_id, "port_number": port_number, "service_name": ports[(ip_id, port_number)],
+            "project_id": project_id, "root_asset_id": root_asset_id,
+        }
+        for _, ip_id, port_number in sorted(missing)
+    ]
+    id_map: Dict[Tuple[int, int, int], int] = {}
+    for chunk in _chunked(rows, 5):
+        stmt = (
+            pg_insert(models.Port)
+            .values(chunk)
+            .on_conflict_do_nothing(constraint="uq_port_owner_ip_number")
+            .returning(models.Port.id, models.Port.ip_address_id, models.Port.port_number)
+        )
+        result = await db.execute(stmt)
+        id_map.update({(root_asset_id, ip_id, port_number): port_id for port_id, ip_id, port_number in result.all()})
+    created = len(id_map)
+
+    rest = missing - id_map.keys()
+    if rest:
+        result = await db.execute(
+            select(models.Port.id, models.Port.ip_address_id, models.Port.port_number)
+            .where(
+                models.Port.root_asset_id == root_asset_id,
+                tuple_(models.Port.ip_address_id, models.Port.port_number).in_(sorted(key[1:] for key in rest)),
+            )
+        )
+        id_map.update({(root_asset_id, ip_id, port_number): port_id for port_id, ip_id, port_number in result.all()})
+    entity_cache.remember(db, entity_cache.port_ids, id_map)
+    return {**found, **{key[1:]: port_id for key, port_id in id_map.items()}}, created
+
+
+async def insert_http_services(db: AsyncSession, rows: List[Dict[str, Any]]) -> int:
+    """
+    批量写入 HTTPService (rows 含 project_id / root_asset_id)，同一资产下 url 已存在的跳过
+    (唯一约束 uq_http_service_owner_url)。返回新增数量。
+    """
+    created = 0
+    for chunk in _chunked(rows, 10):
+        stmt = (
+            pg_insert(models.HTTPService)
+            .values(chunk)
+            .on_conflict_do_nothing(constraint="uq_http_service_owner_url")
+            .returning(models.HTTPService.id)
+        )
+        result = await db.execute(stmt)
+        created += len(result.all())
+    return created
+
+
+async def insert_dns_records(db: AsyncSession, links: Set[Tuple[int, int, str]]) -> int:
+    """
+    批量建立 Host <-> IP 的 DNS 记录，(host_id, ip_address_id, record_type) 已存在则跳过
+    (唯一约束 uq_dns_record_host_ip_type，INSERT ... ON CONFLICT DO NOTHING)。
+    返回新增数量。
+    """
+    if not links:
+        return 0
+    created = 0
+    rows = [
+        {"host_id": host_id, "ip_address_id": ip_id, "record_type": record_type}
+        for host_id, ip_id, record_type in sorted(links)
+    ]
+    for chunk in _chunked(rows, 3):
+        stmt = (
+            pg_insert(models.DNSRecord)
+            .values(chunk)
+            .on_conflict_do_nothing(constraint="uq_dns_record_host_ip_type")
+            .returning(models.DNSRecord.id)
+        )
+        result = await db.execute(stmt)
+        created += len(result.all())
+    return created
+
+
+def _json_text(value: Any) -> Optional[str]:
+    """与 PostgreSQL 的 ->> / json_array_elements_text 相同的文本形式: 字符串原样，null 为 None，其它值为 JSON 文本"""
+    if value is None or isinstance(value, str):
+        return value
+    return json.dumps(value)
+
+
+def vulnerability_fingerprint(template_id: Optional[str], name: str, matched_at: Optional[str], details: Optional[Dict[str, Any]]) -> str:
+    """
+    漏洞指纹: 同一模板在同一位置、由同一 matcher 命中且提取值相同，视为同一个漏洞。
+    sha256(模板 ID (缺失时用名称), 命中位置, matcher 名称, 排序后的提取值)，各部分以 \\x1f 分隔。
+    迁移 0004 用等价的 SQL 为已有数据回填，两边的算法需保持一致 (test/test_ingestion.py 校验)。
+    """
+    details = details or {}
+    extracted = details.get("extracted_results")
+    values = [_json_text(value) for value in (extracted if isinstance(extracted, list) else [extracted])]
+    parts = (
+        template_id or name,
+        matched_at or "",
+        _json_text(details.get("matcher_name")) or "",
+        ",".join(sorted(value for value in values if value is not None)),
+    )
+    return hashlib.sha256("\x1f".join(parts).encode()).hexdigest()
+
+
+async def upsert_vulnerabilities(db: AsyncSession, rows: List[Dict[str, Any]]) -> int:
+    """
+    按 (资产, 指纹) 批量写入 Vulnerability: 新指纹插入，已有指纹只刷新 last_seen / hit_count / 严重程度 / 详情，
+    人工标记的状态 (reviewed / false_positive) 保持不变；已修复 (remediated) 的漏洞再次出现时重新打开为 new。
+    rows 为 Vulnerability 的列值 (不含 fingerprint，含归属 project_id / root_asset_id)，返回新增数量。
+    """
+    by_fingerprint: Dict[Tuple[int, str], Dict[str, Any]] = {}
+    for row in rows:
+        fingerprint = vulnerability_fingerprint(row["template_id"], row["vulnerability_name"], row["matched_at"], row["details"])
+        key = (row["root_asset_id"], fingerprint)
+        if key in by_fingerprint:
+            # 同一批内的重复命中合并 (ON CONFLICT DO UPDATE 不能在一条语句里两次更新同一行)
+            merged = by_fingerprint[key]
+            merged.update(row, hit_count=merged["hit_count"] + 1)
+        else:
+            by_fingerprint[key] = {**row, "fingerprint": fingerprint, "hit_count": 1}
+    if not by_fingerprint:
+        return 0
+
+    table = models.Vulnerability.__table__
+    created = 0
+    for chunk in _chunked([by_fingerprint[key] for key in sorted(by_fingerprint)], 12):
+        stmt = pg_insert(models.Vulnerability).values(chunk)
+        stmt = stmt.on_conflict_do_update(
+            constraint="uq_vulnerability_owner_fingerprint",
+            set_={
+                "severity": stmt.excluded.severity,
+                "details": stmt.excluded.details,
+                # 之前没能关联上的漏洞在重新命中时补上关联
+                "http_service_id": func.coalesce(stmt.excluded.http_service_id, table.c.http_service_id),
+                "host_id": func.coalesce(stmt.excluded.host_id, table.c.host_id),
+                "last_seen": func.now(),
+                "updated_at": func.now(),
+                "hit_count": table.c.hit_count + stmt.excluded.hit_count,
+                "status": case((table.c.status == "remediated", literal("new", table.c.status.type)), else_=table.c.status),
+            },
+        ).returning(literal_column("xmax = 0"))  # 新插入的行 xmax 为 0，被更新的行不为 0
+        result = await db.execute(stmt)
+        created += sum(1 for (inserted,) in result.all() if inserted)
+    return created
+
+
+DEFAULT_PORTS = {"http": 80, "https": 443}
+
+# 会话 info 中缓存各资产服务索引的键 (一个任务一个会话，任务内只加载一次)
+_SERVICE_INDEX_KEY = "asset_service_index"
+
+
+def _split_service_url(url: Optional[str]) -> Optional[Tuple[str, str, Optional[int]]]:
+    """拆出 (scheme, 小写主机名, 端口)；没有 scheme 的 host:port (nuclei 网络类模板) scheme 为空串"""
+    if not url:
+        return None
+    try:
+        parts = urlsplit(url if "://" in url else f"//{url}")
+        hostname = parts.hostname
+        port = parts.port
+    except ValueError:
+        return None
+    if not hostname:
+        return None
+    scheme = parts.scheme.lower()
+    return scheme, hostname.rstrip("."), port or DEFAULT_PORTS.get(scheme)
+
+
+def _format_service_key(scheme: str, hostname: str, port: int) -> str:
+    host = f"[{hostname}]" if ":" in hostname else hostname
+    return f"{scheme}://{host}:{port}"
+
+
+def normalize_service_url(url: Optional[str]) -> Optional[str]:
+    """把 URL 规范化为 scheme://host:port (主机名小写，补全默认端口，去掉路径)，无法规范化时返回 None"""
+    split = _split_service_url(url)
+    if split is None or not split[0] or split[2] is None:
+        return None
+    return _format_service_key(*split)
+
+
+class AssetServiceIndex:
+    """
+    资产下 HTTPService / Host 的内存索引，用于把漏洞的 matched_at 批量关联到 http_service_id / host_id:
+      services: scheme://host:port -> HTTPService ID (同一键对应多个 URL 时取 ID 最小的)
+      hosts:    主机名 -> Host ID
+    """
+
+    def __init__(self, services: Dict[str, int], hosts: Dict[str, int]):
+        self.services = services
+        self.hosts = hosts
+
+    @classmethod
+    async def load(cls, db: AsyncSession, asset_id: int) -> "AssetServiceIndex":
+        services: Dict[str, int] = {}
+        rows = await db.execute(
+            select(models.HTTPService.id, models.HTTPService.url)
+            .where(models.HTTPService.root_asset_id == asset_id)
+            .order_by(models.HTTPService.id)
+        )
+        for service_id, url in rows.all():
+            key = normalize_service_url(url)
+            if key is not None:
+                services.setdefault(key, service_id)
+        rows = await db.execute(select(models.Host.hostname, models.Host.id).where(models.Host.root_asset_id == asset_id))
+        return cls(services, dict(rows.all()))
+
+    def resolve(self, matched_at: Optional[str]) -> Tuple[Optional[int], Optional[int]]:
+        """返回 (http_service_id, host_id)，找不到的为 None"""
+        split = _split_service_url(matched_at)
+        if split is None:
+            return None, None
+        scheme, hostname, port = split
+        service_id = None
+        if scheme and port is not None:
+            service_id = self.services.get(_format_service_key(scheme, hostname, port))
+        elif port is not None:
+            # 没有 scheme 时按端口依次尝试
+            for candidate in ("https", "http"):
+                service_id = self.services.get(_format_service_key(candidate, hostname, port))
+                if service_id is not None:
+                    break
+        return service_id, self.hosts.get(hostname)
+
+
+async def get_service_index(db: AsyncSession, asset_id: int) -> AssetServiceIndex:
+    """取本会话中缓存的资产服务索引，第一次使用时加载"""
+    indexes = db.info.setdefault(_SERVICE_INDEX_KEY, {})
+    if asset_id not in indexes:
+        indexes[asset_id] = await AssetServiceIndex.load(db, asset_id)
+    return indexes[asset_id]
+
+
+class SubdomainIngestor:
+    """
+    子域名发现 (subdomain) 结果的批量入库器。
+    用法: 对每条解析结果调用 add() (或对解析器产出的一批调用 add_many())，
+    结束时调用 flush() 写入剩余缓冲。
+    """
+
+    def __init__(self, db: AsyncSession, task: models.ScanTask, asset: models.Asset, batch_size: int = INGEST_BATCH_SIZE):
+        self.db = db
+        self.task = task
+        self.asset = asset
+        self.batch_size = batch_size
+        self.buffer: List[Tuple[Dict[str, Any], Tuple[str, str, Set[str]]]] = []
+        self.processed_count = 0  # 解析器产出的记录数
+        self.results_count = 0    # 真正新增的实体数 (Host + IP + DNS)
+
+    async def add(self, res: Dict[str, Any]) -> None:
+        self.processed_count += 1
+        extracted = extract_subdomain_record(res)
+        if extracted is None:
+            return
+        self.buffer.append((res, extracted))
+        if len(self.buffer) >= self.batch_size:
+            await self.flush()
+
+    async def add_many(self, records: List[Dict[str, Any]]) -> None:
+        for res in records:
+            await self.add(res)
+
+    async def flush(self) -> None:
+        if not self.buffer:
+            return
+        batch, self.buffer = self.buffer, []
+
+        hostnames = {hostname for _, (hostname, _, _) in batch}
+        ips = {ip for _, (_, _, ip_values) in batch for ip in ip_values}
+
+        # --- Host / IP 去重写入 (每张表一条 INSERT) ---
+        host_ids, host_new = await upsert_hosts(self.db, hostnames, self.asset.project_id, self.asset.id)
+        ip_ids, ip_new = await upsert_ip_addresses(self.db, ips, self.asset.project_id, self.asset.id)
+
+        # --- DNS/IP 关联 (多对多) ---
+        links = {
+            (host_ids[hostname], ip_ids[ip], record_type)
+            for _, (hostname, record_type, ip_values) in batch
+            for ip in ip_values
+        }
+        dns_new = await insert_dns_records(self.db, links)
+
+        # --- 原始结果存档 ---
+        await self.db.execute(
+            insert(models.RawScanResult),
+            [{"scan_task_id": self.task.id, "data": res} for res, _ in batch],
+        )
+
+        # 统计真正新增的实体数量
+        self.results_count += host_new + ip_new + dns_new
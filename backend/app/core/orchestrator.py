@@ -5,20 +5,39 @@
 支持 Web 安全专注流程：Subfinder (被动) -> Nmap (主动) -> httpx (主动) -> Nuclei (主动)
 """
 import asyncio
+import os
+from contextlib import ExitStack
+from typing import Any, AsyncGenerator, AsyncIterator, Awaitable, BinaryIO, Callable, Dict, List, Optional, Tuple
 from urllib.parse import urlparse
 from datetime import datetime, timezone
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy.future import select
+from sqlalchemy import delete, update
 
 from app.data.session import AsyncSessionLocal
 from app.data import models
 from app.core.config_loader import get_scan_config_by_name
+from app.core.ingestion import (
+    INGEST_BATCH_SIZE, SubdomainIngestor, get_service_index, insert_http_services, upsert_ip_addresses, upsert_ports,
+    upsert_vulnerabilities,
+)
+from app.core.artifacts import TeeReader, artifact_paths
+from app.core import entity_cache, output_cache
+from app.core.sharding import refresh_parent_task
+from app.core.pipeline import StageForwarder, enqueue_stage_task, load_stage_forwarder
+from app.core.batching import TaskDemux, claim_coalesced_tasks, coalesce_limit, load_batch_followers
+from app.core.scheduler import AdmissionDeferred, admit
+from app.core.arq_config import get_arq_pool
+from app.core.dispatch import discard_queued_tasks
+from app.core.cancellation import CANCEL_POLL_INTERVAL, clear_cancel, is_cancel_requested, kill_process_group
+from app.core.reaper import heartbeat_loop, requeue_interrupted
 
 # 导入解析器
 from app.parsers.line_parser import LineParser
 from app.parsers.json_lines_parser import JsonLinesParser
 # 注意: 你需要确保 backend/app/parsers/nmap_parser.py 文件存在
 from app.parsers.nmap_parser import NmapXmlParser 
+from app.parsers.process_pool import parse_file_batches
+from app.parsers.base_parser import open_mmap
 
 # --- 解析器注册表 ---
 PARSERS = {
@@ -27,9 +46,454 @@ PARSERS = {
     "nmap_xml": NmapXmlParser, 
 }
 
-async def run_scan_task_logic(task_id: int):
-    print(f"[任务 {task_id}] 开始执行...")
-    
+# 单行输出的最大长度 (字节)，httpx 带 TLS/响应头的 JSON 行可能很长
+STREAM_LINE_LIMIT = int(os.getenv("STREAM_LINE_LIMIT", 16 * 1024 * 1024))
+# 失败时写入 task.log 的 stderr 末尾长度 (字节)
+STDERR_TAIL_BYTES = int(os.getenv("STDERR_TAIL_BYTES", 64 * 1024))
+# 入库时每处理多少条记录提交一次并记录检查点 (scanners.yaml 中可用 commit_every 按配置覆盖)
+INGEST_COMMIT_EVERY = int(os.getenv("INGEST_COMMIT_EVERY", 10000))
+# 扫描工具的默认最长运行时间 (秒，0 表示不限制；scanners.yaml 中可用 timeout 按配置覆盖)
+SCAN_COMMAND_TIMEOUT = float(os.getenv("SCAN_COMMAND_TIMEOUT", 6 * 3600))
+
+
+async def _ingest_port_batch(db: AsyncSession, asset: models.Asset, batch: List[Dict[str, Any]]) -> int:
+    """
+    B. 端口扫描 (Nmap) - [主动扫描阶段]
+    Nmap 会直接向目标 IP 发送 TCP SYN 包，属于主动交互。返回新增数量。
+    """
+    records = [(res["ip"], int(res["port"]), res.get("service")) for res in batch if res.get("ip") and res.get("port")]
+
+    # 1. 确保 IP 存在 (如果不存在则创建)
+    ip_ids, _ = await upsert_ip_addresses(db, {ip for ip, _, _ in records}, asset.project_id, asset.id)
+
+    # 2. 存入端口 (去重)
+    ports: Dict[Tuple[int, int], Optional[str]] = {}
+    for ip, port_num, service in records:
+        ports.setdefault((ip_ids[ip], port_num), service)
+    _, results_count = await upsert_ports(db, ports, asset.project_id, asset.id)
+    return results_count
+
+
+async def _ingest_http_batch(db: AsyncSession, asset: models.Asset, batch: List[Dict[str, Any]]) -> int:
+    """
+    C. Web 服务探测 (httpx) - [主动扫描阶段]
+    httpx 发送 HTTP 请求来获取 Title 和 Tech 指纹，是 Web 安全的核心步骤。返回新增数量。
+    """
+    records = []  # (记录, url, ip, 端口号)
+    for res in batch:
+        url = res.get("url")
+        ip = res.get("ip")
+        port_val = res.get("port")
+
+        if url:
+            # 兜底逻辑：如果 httpx 没返回 IP/Port，尝试从 URL 解析
+            # e.g., http://1.2.3.4:8080/
+            if not ip or not port_val:
+                parsed = urlparse(url)
+                # 如果 netloc 是 IP，直接用；如果是域名，这里没法直接解析，需要依赖 host 字段
+                # 为了简化，假设 httpx 配置了 -ip 选项
+                if not port_val:
+                    port_val = parsed.port if parsed.port else (443 if parsed.scheme == 'https' else 80)
+            try:
+                port_num = int(port_val)
+            except:
+                port_num = 80
+            records.append((res, url, ip, port_num))
+
+    # 1. 查找或创建 IP (如果能拿到 IP)
+    ip_ids, _ = await upsert_ip_addresses(db, {ip for _, _, ip, _ in records if ip}, asset.project_id, asset.id)
+
+    # 2. 查找或创建 Port (如果有关联 IP)
+    port_ids, _ = await upsert_ports(
+        db, {(ip_ids[ip], port_num): "http" for _, _, ip, port_num in records if ip}, asset.project_id, asset.id,
+    )
+
+    # 3. 创建 HTTPService (url 已存在则跳过)
+    #    找不到 Port (httpx 没有返回 IP) 的记录不入库
+    services: Dict[str, Dict[str, Any]] = {}
+    for res, url, ip, port_num in records:
+        if ip and url not in services:
+            services[url] = {
+                "port_id": port_ids[(ip_ids[ip], port_num)],
+                "project_id": asset.project_id,
+                "root_asset_id": asset.id,
+                "url": url,
+                "title": res.get("title"),
+                "status_code": res.get("status_code"),
+                "tech": res.get("tech"),
+                "response_headers": res.get("web_server"),
+                "favicon_hash": res.get("favicon_hash"),
+                "ssl_info": res.get("ssl_info"),
+            }
+    return await insert_http_services(db, list(services.values()))
+
+
+async def _ingest_vulnerability_batch(db: AsyncSession, asset: models.Asset, batch: List[Dict[str, Any]]) -> int:
+    """
+    D. 漏洞扫描 (Nuclei) - [主动扫描阶段]
+    Nuclei 发送 Payload 验证漏洞，是攻击性最强的步骤。返回新增数量。
+    """
+    # matched_at 规范化为 scheme://host:port 后，在资产的服务 / 主机索引里批量查出关联 ID
+    index = await get_service_index(db, asset.id)
+    rows = []
+    for res in batch:
+        vuln_name = res.get("vulnerability_name")
+        severity = res.get("severity")
+        matched_url = res.get("url")
+
+        if vuln_name:
+            # 存入 Vulnerability 表 (按指纹去重，重复命中只刷新 last_seen / hit_count)
+            http_service_id, host_id = index.resolve(matched_url)
+            rows.append({
+                "vulnerability_name": vuln_name,
+                "severity": severity or "medium",
+                "matched_at": matched_url,
+                "template_id": res.get("template_id"),
+                "details": res,
+                "http_service_id": http_service_id,
+                "host_id": host_id,
+                "project_id": asset.project_id,
+                "root_asset_id": asset.id,
+            })
+    return await upsert_vulnerabilities(db, rows)
+
+
+# agent_type -> 单批入库函数 (subdomain 使用 SubdomainIngestor 批量 upsert，单独处理)
+BATCH_INGESTORS = {
+    "portscan": _ingest_port_batch,
+    "http": _ingest_http_batch,
+    "vulnerability": _ingest_vulnerability_batch,
+}
+
+
+async def _skip_records(batches: AsyncIterator[List[Dict[str, Any]]], skip: int) -> AsyncGenerator[List[Dict[str, Any]], None]:
+    """跳过前 skip 条记录 (这些记录在上一次执行中已提交入库)"""
+    async for batch in batches:
+        if skip >= len(batch):
+            skip -= len(batch)
+            continue
+        if skip:
+            batch, skip = batch[skip:], 0
+        yield batch
+
+
+async def _ingest_records(db: AsyncSession, task: models.ScanTask, asset: models.Asset, agent_type: str, batches,
+                          commit_every: int = INGEST_COMMIT_EVERY, forwarder: Optional[StageForwarder] = None) -> Tuple[int, int]:
+    """
+    按 agent_type 把解析器产出的记录写入数据库。
+    batches 是解析器 parse_batches() 的异步生成器，工具仍在运行时就会分批产出。
+    每累计 commit_every 条记录提交一次，并把已提交的记录条数作为检查点写入 task.checkpoint；
+    task.checkpoint 非 0 时 (从存档续传) 先跳过这部分记录。
+    流水线阶段任务传入 forwarder: 每个检查点把新发现的目标作为下一阶段子任务一并提交并入队。
+    返回 (处理条数, 新增条数)，均包含检查点之前已提交的部分。
+    """
+    processed_count = task.checkpoint or 0
+    results_count = task.results_count or 0
+
+    # A. 子域名发现 (Subfinder) - [被动扫描阶段]
+    #    记录先缓冲成批，每批对 Host / IP / DNS 各执行一次批量 upsert
+    ingestor = SubdomainIngestor(db, task, asset) if agent_type == "subdomain" else None
+    ingest_batch = BATCH_INGESTORS.get(agent_type)
+    if ingestor is None and ingest_batch is None:
+        print(f"[任务 {task.id}] 未知的 agent_type: {agent_type}，结果不入库")
+        return processed_count, results_count
+
+    async def checkpoint() -> None:
+        nonlocal results_count
+        if ingestor is not None:
+            # 缓冲区中的记录必须先写入，检查点才与已提交的数据一致
+            await ingestor.flush()
+            results_count += ingestor.results_count
+            ingestor.results_count = 0
+        task.checkpoint = processed_count
+        task.results_count = results_count
+        downstream = forwarder.flush(db) if forwarder is not None else None
+        await db.commit()
+        if downstream is not None:
+            await enqueue_stage_task(db, downstream)
+
+    if forwarder is not None:
+        # 下游尽早开始: 转发粒度不大于 forward_every
+        commit_every = min(commit_every, forwarder.forward_every)
+
+    uncommitted = 0
+    async for batch in _skip_records(batches, processed_count):
+        if forwarder is not None:
+            forwarder.collect(batch)
+        if ingestor is not None:
+            await ingestor.add_many(batch)
+        else:
+            results_count += await ingest_batch(db, asset, batch)
+        processed_count += len(batch)
+        uncommitted += len(batch)
+        if uncommitted >= commit_every:
+            await checkpoint()
+            uncommitted = 0
+
+    await checkpoint()
+    return processed_count, results_count
+
+
+async def _ingest_demuxed(db: AsyncSession, demux: TaskDemux, agent_type: str, batches,
+                          commit_every: int = INGEST_COMMIT_EVERY) -> Tuple[int, int]:
+    """
+    合并执行的入库: 每批记录先按 demux 分发给各任务，再用各任务自己的资产分别入库，
+    每个任务的处理 / 新增条数单独累计。
+    检查点与 _ingest_records 相同，leader.checkpoint 记录全局记录序号 (续传时按它跳过)。
+    返回全部任务合计的 (处理条数, 新增条数)。
+    """
+    leader = demux.tasks[0]
+    processed_count = leader.checkpoint or 0
+    task_processed: Dict[int, int] = {task.id: 0 if task is leader else (task.checkpoint or 0) for task in demux.tasks}
+    task_results: Dict[int, int] = {task.id: task.results_count or 0 for task in demux.tasks}
+
+    ingestors = {
+        task.id: SubdomainIngestor(db, task, demux.assets[task.asset_id])
+        for task in demux.tasks
+    } if agent_type == "subdomain" else None
+    ingest_batch = BATCH_INGESTORS.get(agent_type)
+    if ingestors is None and ingest_batch is None:
+        print(f"[任务 {leader.id}] 未知的 agent_type: {agent_type}，结果不入库")
+        return processed_count, 0
+
+    async def checkpoint() -> None:
+        for task in demux.tasks:
+            if ingestors is not None:
+                ingestor = ingestors[task.id]
+                await ingestor.flush()
+                task_results[task.id] += ingestor.results_count
+                ingestor.results_count = 0
+            task.results_count = task_results[task.id]
+            if task is not leader:
+                task.checkpoint = task_processed[task.id]
+        leader.checkpoint = processed_count
+        await db.commit()
+
+    uncommitted = 0
+    async for batch in _skip_records(batches, processed_count):
+        for task_id, records in demux.split(batch).items():
+            task_processed[task_id] += len(records)
+            if ingestors is not None:
+                await ingestors[task_id].add_many(records)
+            else:
+                asset_id = demux.tasks_by_id[task_id].asset_id
+                task_results[task_id] += await ingest_batch(db, demux.assets[asset_id], records)
+        processed_count += len(batch)
+        uncommitted += len(batch)
+        if uncommitted >= commit_every:
+            await checkpoint()
+            uncommitted = 0
+
+    await checkpoint()
+    demux.processed = task_processed
+    return processed_count, sum(task_results.values())
+
+
+async def _read_tail(stream: asyncio.StreamReader, limit: int = STDERR_TAIL_BYTES, sink: Optional[BinaryIO] = None) -> str:
+    """持续读取 stream 直到 EOF，只保留末尾 limit 字节，避免管道写满阻塞子进程；传入 sink 时完整内容同时写入存档"""
+    tail = bytearray()
+    while True:
+        chunk = await stream.read(65536)
+        if not chunk:
+            break
+        if sink is not None:
+            sink.write(chunk)
+        tail.extend(chunk)
+        if len(tail) > limit:
+            del tail[:-limit]
+    return tail.decode('utf-8', errors='ignore')
+
+
+async def _feed_stdin(stream: asyncio.StreamWriter, data: bytes) -> None:
+    """向子进程 stdin 写入目标列表后关闭；工具提前退出时忽略管道错误"""
+    try:
+        stream.write(data)
+        await stream.drain()
+    except (BrokenPipeError, ConnectionResetError):
+        pass
+    finally:
+        stream.close()
+
+
+class ConsumeFailed(Exception):
+    """
+    流式处理 (consume) 出错，但工具的剩余输出已经读完写入存档、工具已经退出。
+    原始异常为 error；returncode 为 0 时存档是完整的，可以据此从检查点重新入库而不必重新运行工具。
+    """
+
+    def __init__(self, error: Exception, returncode: int):
+        super().__init__(str(error))
+        self.error = error
+        self.returncode = returncode
+
+
+class CommandStop:
+    """
+    工具运行期间的停止条件: 配置的超时，或通过 API 发起的取消请求。
+    看门狗发现任一条件满足时记录 reason ("timeout" / "cancelled") 并终止整个进程组；
+    进程退出后 stdout 到达 EOF，解析与入库照常收尾，已解析的记录在最后一个检查点提交。
+    """
+
+    def __init__(self, task_id: int, timeout: Optional[float] = None, on_cancel: Optional[Callable[[], None]] = None):
+        self.task_id = task_id
+        self.timeout = timeout or None
+        self.on_cancel = on_cancel
+        self.reason: Optional[str] = None
+        self._checked_at: Optional[float] = None
+
+    async def check_cancel(self) -> bool:
+        """
+        检查取消标记 (最多每 CANCEL_POLL_INTERVAL 秒一次)，返回是否已取消。
+        用于没有工具进程可终止的阶段: 从存档 / 缓存重新入库，以及进程池模式在工具结束后的解析。
+        """
+        if self.reason is None:
+            now = asyncio.get_running_loop().time()
+            if self._checked_at is None or now - self._checked_at >= CANCEL_POLL_INTERVAL:
+                self._checked_at = now
+                if await is_cancel_requested(self.task_id):
+                    self.reason = "cancelled"
+                    if self.on_cancel is not None:
+                        self.on_cancel()
+        return self.reason == "cancelled"
+
+    async def batches(self, batches):
+        """包装解析器产出的批次: 每批入库后检查取消标记，已取消时不再产出 (已产出的记录照常在检查点提交)"""
+        try:
+            async for batch in batches:
+                yield batch
+                if await self.check_cancel():
+                    print(f"[任务 {self.task_id}] 收到取消请求，停止入库")
+                    return
+        finally:
+            await batches.aclose()
+
+    async def watch(self, process: asyncio.subprocess.Process) -> None:
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.timeout if self.timeout else None
+        while process.returncode is None:
+            delay = CANCEL_POLL_INTERVAL
+            if deadline is not None:
+                delay = max(0.0, min(delay, deadline - loop.time()))
+            await asyncio.sleep(delay)
+            if process.returncode is not None:
+                return
+            if deadline is not None and loop.time() >= deadline:
+                self.reason = "timeout"
+            elif await is_cancel_requested(self.task_id):
+                self.reason = "cancelled"
+                if self.on_cancel is not None:
+                    self.on_cancel()
+            else:
+                continue
+            print(f"[任务 {self.task_id}] {'执行超时' if self.reason == 'timeout' else '收到取消请求'}，终止进程组 {process.pid}")
+            await kill_process_group(process)
+            return
+
+
+async def _run_command(command: str, stdout, consume: Optional[Callable[[Any], Awaitable[Any]]] = None,
+                       stdout_sink: Optional[BinaryIO] = None, stderr_sink: Optional[BinaryIO] = None,
+                       stdin_data: Optional[bytes] = None, stop: Optional[CommandStop] = None) -> Tuple[int, str, Any]:
+    """
+    执行命令并等待其退出，返回 (returncode, stderr 末尾, consume 的返回值)。
+    stdout 为 PIPE 时由 consume(process.stdout) 边读边处理；也可以直接传入一个文件对象让输出落盘。
+    consume 出错时仍读完剩余输出 (写入 stdout_sink) 并等待工具退出，然后抛出 ConsumeFailed。
+    stdout_sink / stderr_sink: 管道模式下原样写入的存档文件。
+    stdin_data: 写入子进程 stdin 的内容 (多目标任务的目标列表)。
+    stop: 超时 / 取消的看门狗，触发时终止进程组 (原因记录在 stop.reason)。
+    命令在独立的进程组中运行，结束时 (包括异常退出) 整个进程组都会被清理。
+    """
+    process = await asyncio.create_subprocess_shell(
+        command,
+        stdin=asyncio.subprocess.PIPE if stdin_data is not None else None,
+        stdout=stdout,
+        stderr=asyncio.subprocess.PIPE,
+        limit=STREAM_LINE_LIMIT,
+        start_new_session=True,
+    )
+    # stdin / stderr 需要并发读写，否则子进程可能因管道写满而卡住
+    stdin_task = asyncio.create_task(_feed_stdin(process.stdin, stdin_data)) if stdin_data is not None else None
+    stderr_task = asyncio.create_task(_read_tail(process.stderr, sink=stderr_sink))
+    watch_task = asyncio.create_task(stop.watch(process)) if stop is not None else None
+    result = None
+    consume_error = None
+    try:
+        if consume is not None:
+            reader = TeeReader(process.stdout, stdout_sink) if stdout_sink is not None else process.stdout
+            try:
+                result = await consume(reader)
+            except Exception as e:
+                # 入库出错: 不终止工具，照常收完输出，存档完整时重试可以直接从检查点重新入库
+                print(f"处理输出出错，等待工具结束以保留完整存档: {e}")
+                consume_error = e
+            # 解析器提前结束时继续读完剩余输出 (存档保持完整)，避免子进程阻塞在写管道上
+            while await reader.read(65536):
+                pass
+        await process.wait()
+        if consume_error is not None:
+            raise ConsumeFailed(consume_error, process.returncode) from consume_error
+    finally:
+        if watch_task is not None:
+            # 看门狗已触发时等它终止完进程组，否则直接停止看门狗
+            if stop.reason is None:
+                watch_task.cancel()
+            try:
+                await watch_task
+            except asyncio.CancelledError:
+                pass
+        if process.returncode is None:
+            await kill_process_group(process, grace=None)
+        if stdin_task is not None:
+            await stdin_task
+        stderr = await stderr_task
+    return process.returncode, stderr, result
+
+
+async def _mark_failed(task_id: int, follower_ids: List[int], error: Exception, artifact_size: Optional[int] = None) -> None:
+    """任务 (及合并执行的成员) 标记为失败；artifact_size 为失败前已完整写入的存档大小"""
+    # 重新获取 task 以避免 Session 状态问题
+    async with AsyncSessionLocal() as error_db:
+        task_fail = await error_db.get(models.ScanTask, task_id)
+        if task_fail:
+            task_fail.status = "failed"
+            task_fail.log = str(error)
+            if artifact_size is not None:
+                task_fail.artifact_size = artifact_size
+            if task_fail.artifact_size is not None:
+                task_fail.log += f"\n已提交 {task_fail.checkpoint} 条记录，重试时将从存档的检查点续传 (不再运行工具)。"
+        for follower_id in follower_ids:
+            follower_fail = await error_db.get(models.ScanTask, follower_id)
+            if follower_fail:
+                follower_fail.status = "failed"
+                follower_fail.log = f"合并执行的任务 {task_id} 失败: {error}"
+        await error_db.commit()
+
+
+async def run_scan_task_logic(task_id: int, reingest: bool = False, deadline: Optional[float] = None):
+    """
+    执行一个扫描任务。
+    reingest=True 时不再运行工具，直接从任务已有的输出存档重新解析入库；
+    若 task.checkpoint 非 0 则跳过已提交的记录，从检查点续传。
+    配置了 cache_ttl 的任务在缓存有效期内命中同一命令的输出时，同样不运行工具而是从缓存副本入库。
+    deadline: 整个任务的最长执行时间 (秒)，到期时终止工具并把任务标记为失败 (worker 按 job_timeout 传入)。
+    """
+    print(f"[任务 {task_id}] {'从存档重新入库' if reingest else '开始执行'}...")
+    # 到期时取消本协程，由下面的 CancelledError 分支区分到期与 worker 退出
+    current = asyncio.current_task()
+    expired = False
+
+    def expire() -> None:
+        nonlocal expired
+        expired = True
+        current.cancel()
+
+    timer = asyncio.get_running_loop().call_later(deadline, expire) if deadline else None
+    # 其它进程删除过实体时清空本 worker 的实体 ID 缓存
+    await entity_cache.sync_generation()
+    follower_ids = []  # 与本任务合并执行的其它任务
+    artifact_size = None  # 流式入库出错时已完整写入的存档大小 (失败处理中记录，重试时据此重新入库)
+    slot = ExitStack()  # 准入时占用的并发槽位，结束时释放
+    heartbeat = None  # 心跳后台任务 (回收器据此判断 worker 是否失联)
+
     async with AsyncSessionLocal() as db:
         try:
             # 1. 获取任务信息
@@ -48,11 +512,7 @@ async def run_scan_task_logic(task_id: int):
                 await db.commit()
                 return
 
-            # 2. 更新状态为 running
-            task.status = "running"
-            await db.commit()
-
-            # 3. 加载配置
+            # 2. 加载配置
             scan_config = get_scan_config_by_name(task.config_name)
             if not scan_config:
                 raise ValueError(f"配置 '{task.config_name}' 未找到")
@@ -61,277 +521,241 @@ async def run_scan_task_logic(task_id: int):
             parser_type = scan_config.get("output_parser_type")
             data_mapping = scan_config.get("data_mapping", {})
             agent_type = scan_config.get("agent_type")
+            commit_every = int(scan_config.get("commit_every") or INGEST_COMMIT_EVERY)
 
-            # 4. 构造并执行命令
+            # 准入: 并发上限 / 机器负载不满足时延后重试 (重新入库不运行工具，不受限制)
+            if not reingest:
+                slot.enter_context(admit(scan_config))
+
+            # 3. 更新状态为 running，并登记本次输出的存档路径
+            #    只在仍为 pending 时认领，同一任务的重复 job (如回收后重新排队) 不会并发执行
+            started_at = datetime.now(timezone.utc)
+            claimed = (await db.execute(
+                update(models.ScanTask)
+                .where(models.ScanTask.id == task.id, models.ScanTask.status == "pending")
+                .values(status="running", started_at=started_at, heartbeat_at=started_at)
+                .returning(models.ScanTask.id)
+                .execution_options(synchronize_session=False)
+            )).scalar()
+            if not claimed:
+                await db.rollback()
+                print(f"[任务 {task_id}] 已被其它 worker 认领，跳过")
+                return
+            await db.refresh(task)
+            heartbeat_ids = [task.id]
+            heartbeat = asyncio.create_task(heartbeat_loop(heartbeat_ids))
+            if not reingest:
+                # 重新执行工具时输出可能与上次不同，检查点作废
+                stdout_path, stderr_path = artifact_paths(task.id)
+                task.artifact_path = str(stdout_path)
+                task.artifact_size = None
+                task.checkpoint = 0
+                task.results_count = 0
+                task.batch_leader_id = None
+            elif not task.artifact_path or task.artifact_size is None:
+                raise ValueError("任务没有完整的输出存档，无法重新入库")
+            if not task.checkpoint:
+                # 原始结果会随本次解析再次写入，先清掉上一次残留的 (续传时检查点之前的原始结果保留)
+                await db.execute(delete(models.RawScanResult).where(models.RawScanResult.scan_task_id == task.id))
+            await db.commit()
+            # 上一次运行遗留的取消标记不影响本次执行
+            await clear_cancel(task.id)
+
+            # 合并执行: 认领同配置的其它 pending 任务，由本任务一次性运行 (重新入库时找回上次的成员)
+            demux = None
+            followers = []
+            if reingest:
+                followers = await load_batch_followers(db, task)
+            elif not task.targets and task.stage_index is None and coalesce_limit(scan_config) > 1:
+                followers = await claim_coalesced_tasks(db, task, coalesce_limit(scan_config) - 1)
+            if followers:
+                assets = {asset.id: asset}
+                for follower in followers:
+                    follower.status = "running"
+                    if follower.asset_id not in assets:
+                        assets[follower.asset_id] = await db.get(models.Asset, follower.asset_id)
+                    if not task.checkpoint:
+                        # 从头入库 (非续传) 时各成员的计数与原始结果一并重置
+                        follower.checkpoint = 0
+                        follower.results_count = 0
+                        await db.execute(delete(models.RawScanResult).where(models.RawScanResult.scan_task_id == follower.id))
+                await db.commit()
+                follower_ids = [follower.id for follower in followers]
+                if not reingest:
+                    # 被认领的任务在命名队列中的 job 已经没有意义，移除以免之后空占分发名额 (失败不影响执行)
+                    try:
+                        await discard_queued_tasks(await get_arq_pool(), task, asset.project_id, follower_ids)
+                    except Exception as e:
+                        print(f"[任务 {task_id}] 从命名队列移除被合并的任务失败: {e}")
+                heartbeat_ids.extend(follower_ids)
+                demux = TaskDemux([task, *followers], assets, scan_config["demux_field"])
+                print(f"[任务 {task_id}] 合并执行 {len(followers) + 1} 个任务")
+
+            # 4. 构造命令
             #    对于 Web 扫描，目标通常是域名 (example.com)
             #    对于 端口 扫描，目标可能是域名或网段 (1.1.1.0/24)
-            target = asset.name 
-            command = command_template.format(target=target)
-            
-            print(f"[任务 {task_id}] 执行命令: {command}")
-            process = await asyncio.create_subprocess_shell(
-                command,
-                stdout=asyncio.subprocess.PIPE,
-                stderr=asyncio.subprocess.PIPE
-            )
-            stdout_bytes, stderr_bytes = await process.communicate()
-            stdout = stdout_bytes.decode('utf-8', errors='ignore')
-            stderr = stderr_bytes.decode('utf-8', errors='ignore')
-            
-            # 简单错误检查 (有些工具如 subfinder即使成功 stderr 也有内容，需谨慎)
-            if process.returncode != 0 and not stdout:
-                 raise RuntimeError(f"命令执行失败: {stderr}")
+            #    分片子任务只扫描自己的子网段；多目标任务 (流水线下游阶段) 的目标通过 stdin 逐行传入
+            #    合并执行时所有任务的目标一起写入 stdin
+            stdin_data = None
+            targets = demux.targets() if demux else task.targets
+            if targets:
+                command = scan_config.get("batch_command_template")
+                if not command:
+                    raise ValueError(f"配置 '{task.config_name}' 缺少 batch_command_template，无法执行多目标任务")
+                stdin_data = ("\n".join(targets) + "\n").encode()
+            else:
+                target = task.target or asset.name
+                command = command_template.format(target=target)
+
+            # 工具输出缓存: 同一命令在 cache_ttl 秒内运行过时，把缓存复制为本任务的存档后直接入库
+            cache_ttl = float(scan_config.get("cache_ttl") or 0)
+            output_key = output_cache.cache_key(command, stdin_data) if cache_ttl and not reingest else None
+            from_cache = False
+            if output_key and not task.force:
+                cached_size = output_cache.restore(output_key, cache_ttl, stdout_path)
+                if cached_size is not None:
+                    task.artifact_size = cached_size
+                    await db.commit()
+                    from_cache = True
+                    # 不运行工具，提前释放准入槽位
+                    slot.close()
 
-            # 5. 解析与入库
+            # 流水线中非最后阶段的任务: 每批结果转发给下一阶段
+            forwarder = await load_stage_forwarder(db, task)
+
+            # 工具运行的超时 / 取消看门狗 (取消时不再向下游阶段转发)
+            timeout = float(scan_config.get("timeout") or SCAN_COMMAND_TIMEOUT)
+            stop = CommandStop(task.id, timeout, on_cancel=forwarder.close if forwarder else None)
+            
+            # 5. 准备解析器
             parser_class = PARSERS.get(parser_type)
             if not parser_class:
                 raise ValueError(f"未知解析器: {parser_type}")
-            
             parser = parser_class()
-            results_count = 0
-            processed_count = 0
-            
-            # --- 核心数据处理分支 ---
-            
-            # A. 子域名发现 (Subfinder) - [被动扫描阶段]
-            #    Subfinder 默认查询被动源，不直接发包给目标，非常适合前期侦察
-            if agent_type == "subdomain":
-                async for res in parser.parse(stdout, data_mapping):
-                    processed_count += 1
-                    # Subfinder 常见字段: host / ip / ips / type
-                    hostname_raw = res.get("hostname") or res.get("host") or res.get("target")
-                    hostname = hostname_raw.lower().rstrip(".") if hostname_raw else None
-                    record_type = res.get("record_type") or res.get("type") or "A"
-                    # 支持单个 ip 或 ips 列表
-                    ip_values_raw = res.get("ips") or []
-                    ip_single = res.get("ip")
-                    ip_values = set()
-                    # 支持字符串或列表
-                    if ip_single:
-                        if isinstance(ip_single, list):
-                            ip_values.update([ip for ip in ip_single if ip])
-                        else:
-                            ip_values.add(ip_single)
-                    if isinstance(ip_values_raw, list):
-                        ip_values.update([ip for ip in ip_values_raw if ip])
-
-                    if not hostname:
-                        continue
-
-                    # --- Host 去重 ---
-                    existing = await db.execute(select(models.Host).where(models.Host.hostname == hostname))
-                    host_obj = existing.scalars().first()
-                    host_created = False
-                    if not host_obj:
-                        host_obj = models.Host(
-                            hostname=hostname,
-                            project_id=asset.project_id,
-                            root_asset_id=asset.id,
-                            status="discovered"
-                        )
-                        db.add(host_obj)
-                        await db.flush()
-                        host_created = True
-
-                    # --- 原始结果存档 ---
-                    raw = models.RawScanResult(
-                        scan_task_id=task.id,
-                        data=res
+
+            async def ingest(batches):
+                batches = stop.batches(batches)
+                if demux is not None:
+                    return await _ingest_demuxed(db, demux, agent_type, batches, commit_every)
+                return await _ingest_records(db, task, asset, agent_type, batches, commit_every, forwarder)
+
+            # 6. 执行命令并入库 (stdout / stderr 同时写入存档)
+            if reingest or from_cache:
+                # 重新入库 / 命中缓存: 工具输出已在存档中，按 parse_mode 选择进程池或 mmap 直接解析
+                print(f"[任务 {task_id}] 读取{'缓存' if from_cache else '存档'}: {task.artifact_path} (检查点: {task.checkpoint})")
+                returncode, stderr = 0, ""
+                if scan_config.get("parse_mode") == "process":
+                    batches = parse_file_batches(parser_class, task.artifact_path, data_mapping, INGEST_BATCH_SIZE)
+                    processed_count, results_count = await ingest(batches)
+                else:
+                    with open_mmap(task.artifact_path) as mapped:
+                        batches = parser.parse_batches(mapped, data_mapping, INGEST_BATCH_SIZE)
+                        processed_count, results_count = await ingest(batches)
+            elif scan_config.get("parse_mode") == "process":
+                # 进程池模式: stdout 先写入存档，工具结束后交给子进程解析，不占用 worker 的事件循环
+                print(f"[任务 {task_id}] 执行命令: {command}")
+                with open(stdout_path, 'wb') as out, open(stderr_path, 'wb') as err:
+                    returncode, stderr, _ = await _run_command(
+                        command, out, stderr_sink=err, stdin_data=stdin_data, stop=stop
                     )
-                    db.add(raw)
-
-                    # --- DNS/IP 关联 (如果解析到 IP) ---
-                    dns_new = 0
-                    ip_new = 0
-                    for ip_value in ip_values:
-                        existing_ip = await db.execute(select(models.IPAddress).where(models.IPAddress.ip_address == ip_value))
-                        ip_obj = existing_ip.scalars().first()
-                        if not ip_obj:
-                            ip_obj = models.IPAddress(
-                                ip_address=ip_value,
-                                project_id=asset.project_id,
-                                root_asset_id=asset.id,
-                                status="discovered"
-                            )
-                            db.add(ip_obj)
-                            await db.flush()
-                            ip_new += 1
-
-                        # 建立 DNS 记录关联（多对多）
-                        dns_exists = await db.execute(
-                            select(models.DNSRecord).where(
-                                models.DNSRecord.host_id == host_obj.id,
-                                models.DNSRecord.ip_address_id == ip_obj.id,
-                                models.DNSRecord.record_type == record_type
-                            )
+                # 工具正常结束 (退出码 0) 时存档才算完整，立即记录大小，worker 在解析阶段退出也能直接重新入库
+                # (超时 / 取消时存档不完整，只解析已有部分)
+                if stop.reason is None and returncode == 0:
+                    task.artifact_size = os.path.getsize(stdout_path)
+                    await db.commit()
+                batches = parse_file_batches(parser_class, str(stdout_path), data_mapping, INGEST_BATCH_SIZE)
+                processed_count, results_count = await ingest(batches)
+            else:
+                # 默认模式: stdout 以流的方式直接交给解析器，边运行边入库，同时原样写入存档
+                print(f"[任务 {task_id}] 执行命令: {command}")
+                async def consume(stdout):
+                    batches = parser.parse_batches(stdout, data_mapping, INGEST_BATCH_SIZE)
+                    return await ingest(batches)
+                consume_failed = None
+                with open(stdout_path, 'wb') as out, open(stderr_path, 'wb') as err:
+                    try:
+                        returncode, stderr, (processed_count, results_count) = await _run_command(
+                            command, asyncio.subprocess.PIPE, consume, stdout_sink=out, stderr_sink=err,
+                            stdin_data=stdin_data, stop=stop
                         )
-                        if not dns_exists.scalars().first():
-                            dns = models.DNSRecord(
-                                host_id=host_obj.id,
-                                ip_address_id=ip_obj.id,
-                                record_type=record_type
-                            )
-                            db.add(dns)
-                            dns_new += 1
-
-                    # 统计真正新增的实体数量
-                    results_count += (1 if host_created else 0) + ip_new + dns_new
-
-            # B. 端口扫描 (Nmap) - [主动扫描阶段]
-            #    Nmap 会直接向目标 IP 发送 TCP SYN 包，属于主动交互
-            elif agent_type == "portscan":
-                async for res in parser.parse(stdout, data_mapping):
-                    processed_count += 1
-                    ip = res.get("ip")
-                    port_num = res.get("port")
-                    service = res.get("service")
-                    
-                    if ip and port_num:
-                        # 1. 确保 IP 存在 (如果不存在则创建)
-                        existing_ip = await db.execute(select(models.IPAddress).where(models.IPAddress.ip_address == ip))
-                        db_ip = existing_ip.scalars().first()
-
-                        if not db_ip:
-                            db_ip = models.IPAddress(
-                                ip_address=ip,
-                                project_id=asset.project_id,
-                                root_asset_id=asset.id,
-                                status="discovered"
-                            )
-                            db.add(db_ip)
-                            await db.flush() # 立即获取 ID
-                        
-                        # 2. 存入端口 (去重)
-                        existing_port = await db.execute(
-                            select(models.Port).where(
-                                models.Port.ip_address_id == db_ip.id,
-                                models.Port.port_number == port_num
-                            )
-                        )
-                        if not existing_port.scalars().first():
-                            new_port = models.Port(
-                                ip_address_id=db_ip.id,
-                                port_number=port_num,
-                                service_name=service
-                            )
-                            db.add(new_port)
-                            results_count += 1
-
-            # C. Web 服务探测 (httpx) - [主动扫描阶段]
-            #    httpx 发送 HTTP 请求来获取 Title 和 Tech 指纹，是 Web 安全的核心步骤
-            elif agent_type == "http":
-                async for res in parser.parse(stdout, data_mapping):
-                    processed_count += 1
-                    url = res.get("url")
-                    ip = res.get("ip")
-                    port_val = res.get("port")
-                    
-                    if url:
-                        # 兜底逻辑：如果 httpx 没返回 IP/Port，尝试从 URL 解析
-                        # e.g., http://1.2.3.4:8080/
-                        if not ip or not port_val:
-                            parsed = urlparse(url)
-                            # 如果 netloc 是 IP，直接用；如果是域名，这里没法直接解析，需要依赖 host 字段
-                            # 为了简化，假设 httpx 配置了 -ip 选项
-                            if not port_val:
-                                port_val = parsed.port if parsed.port else (443 if parsed.scheme == 'https' else 80)
-
-                        # 1. 查找或创建 IP (如果能拿到 IP)
-                        db_ip_id = None
-                        if ip:
-                            existing_ip = await db.execute(select(models.IPAddress).where(models.IPAddress.ip_address == ip))
-                            db_ip = existing_ip.scalars().first()
-                            if not db_ip:
-                                db_ip = models.IPAddress(
-                                    ip_address=ip,
-                                    project_id=asset.project_id,
-                                    root_asset_id=asset.id,
-                                    status="discovered"
-                                )
-                                db.add(db_ip)
-                                await db.flush()
-                            db_ip_id = db_ip.id
-
-                        # 2. 查找或创建 Port (如果有关联 IP)
-                        db_port_id = None
-                        if db_ip_id and port_val:
-                            try:
-                                port_num = int(port_val)
-                            except:
-                                port_num = 80
-
-                            existing_port = await db.execute(
-                                select(models.Port).where(
-                                    models.Port.ip_address_id == db_ip_id, 
-                                    models.Port.port_number == port_num
-                                )
-                            )
-                            db_port = existing_port.scalars().first()
-                            if not db_port:
-                                db_port = models.Port(ip_address_id=db_ip_id, port_number=port_num, service_name="http")
-                                db.add(db_port)
-                                await db.flush()
-                            db_port_id = db_port.id
-
-                        # 3. 创建 HTTPService
-                        existing_svc = await db.execute(select(models.HTTPService).where(models.HTTPService.url == url))
-                        if not existing_svc.scalars().first():
-                            # 如果找不到 Port，暂时允许 port_id 为空 (需要在 model 允许 nullable)
-                            # 或者，我们这里强行要求 httpx 必须关联到一个 Port，否则不入库
-                            if db_port_id: 
-                                new_svc = models.HTTPService(
-                                    port_id=db_port_id,
-                                    url=url,
-                                    title=res.get("title"),
-                                    status_code=res.get("status_code"),
-                                    tech=res.get("tech"),
-                                    response_headers=res.get("web_server"),
-                                    favicon_hash=res.get("favicon_hash"),
-                                    ssl_info=res.get("ssl_info")
-                                )
-                                db.add(new_svc)
-                                results_count += 1
-
-            # D. 漏洞扫描 (Nuclei) - [主动扫描阶段]
-            #    Nuclei 发送 Payload 验证漏洞，是攻击性最强的步骤
-            elif agent_type == "vulnerability":
-                async for res in parser.parse(stdout, data_mapping):
-                    processed_count += 1
-                    vuln_name = res.get("vulnerability_name")
-                    severity = res.get("severity")
-                    matched_url = res.get("url")
-                    
-                    if vuln_name:
-                        # 存入 Vulnerability 表
-                        # 这里未来可以做更细的关联：通过 matched_url 反查 HTTPService ID
-                        new_vuln = models.Vulnerability(
-                            vulnerability_name=vuln_name,
-                            severity=severity or "medium",
-                            matched_at=matched_url,
-                            template_id=res.get("template_id"),
-                            details=res 
-                        )
-                        db.add(new_vuln)
-                        results_count += 1
+                    except ConsumeFailed as e:
+                        consume_failed = e
+                        returncode = e.returncode
+                if stop.reason is None and returncode == 0:
+                    task.artifact_size = os.path.getsize(stdout_path)
+                if consume_failed is not None:
+                    # 入库出错但工具已正常跑完: 存档完整，失败处理中记录其大小，重试时从检查点重新入库
+                    artifact_size = task.artifact_size
+                    raise consume_failed.error
 
-            # --- 结束分支 ---
+            # 超时: 已解析的记录已在检查点提交，任务按失败处理
+            if stop.reason == "timeout":
+                raise TimeoutError(
+                    f"执行超时 ({stop.timeout:.0f} 秒)，已提交 {processed_count} 条，新增 {results_count} 条数据。"
+                )
 
-            if results_count > 0:
-                await db.commit()
-            
-            task.status = "completed"
+            # 简单错误检查 (有些工具如 subfinder即使成功 stderr 也有内容，需谨慎)
+            if stop.reason is None and returncode != 0 and processed_count == 0:
+                 raise RuntimeError(f"命令执行失败: {stderr}")
+
+            # 工具正常结束的完整输出写入缓存 (缓存出错不影响任务本身)
+            if output_key and not from_cache and stop.reason is None and returncode == 0:
+                try:
+                    output_cache.store(output_key, stdout_path)
+                except OSError as e:
+                    print(f"[任务 {task_id}] 写入输出缓存失败: {e}")
+
+            # 数据已在 _ingest_records 中按检查点分段提交
+            cancelled = stop.reason == "cancelled"
+            task.status = "cancelled" if cancelled else "completed"
             task.completed_at = datetime.now(timezone.utc)
-            task.log = f"扫描完成，处理 {processed_count} 条，新增 {results_count} 条数据。"
+            if cancelled:
+                elapsed = (task.completed_at - task.started_at).total_seconds()
+                task.log = f"任务已取消 (运行 {elapsed:.0f} 秒)，处理 {processed_count} 条，新增 {results_count} 条数据。"
+            else:
+                task.log = f"扫描完成，处理 {processed_count} 条，新增 {results_count} 条数据。"
+                if from_cache:
+                    task.log += " (命中工具输出缓存，未重新运行工具)"
+            if demux is not None:
+                task.log += f" (合并执行 {len(demux.tasks)} 个任务，未能匹配目标的记录 {demux.unmatched_count} 条)"
+                for follower in followers:
+                    follower.status = task.status
+                    follower.completed_at = task.completed_at
+                    follower.log = (
+                        f"由任务 {task.id} 合并执行{' (已取消)' if cancelled else ''}，"
+                        f"处理 {demux.processed.get(follower.id, 0)} 条，新增 {follower.results_count} 条数据。"
+                    )
             await db.commit()
-            print(f"[任务 {task_id}] 完成。新增数据: {results_count}")
+            if cancelled:
+                await clear_cancel(task.id)
+            print(f"[任务 {task_id}] {'已取消' if cancelled else '完成'}。新增数据: {results_count}")
 
+        except AdmissionDeferred:
+            # 任务保持 pending，交给 worker 延后重试
+            raise
+        except asyncio.CancelledError:
+            await db.rollback()
+            if not expired:
+                # worker 退出 (排空超时后 ARQ 取消了 job): 工具进程组已在 _run_command 中终止，
+                # 已提交的检查点保留，任务恢复为 pending 后由 ARQ 重新执行
+                print(f"[任务 {task_id}] 被中断")
+                await requeue_interrupted(task_id, follower_ids)
+                raise
+            # 超过任务时限: 取消来自上面的定时器，不再传播 (ARQ 不会重新执行这个 job)，任务按失败处理
+            if hasattr(current, "uncancel"):
+                current.uncancel()
+            print(f"[任务 {task_id}] 超过任务时限 ({deadline:.0f} 秒)，已中止")
+            await _mark_failed(task_id, follower_ids, TimeoutError(f"超过任务时限 ({deadline:.0f} 秒)，任务已中止。"))
         except Exception as e:
             print(f"[任务 {task_id}] 异常: {e}")
             await db.rollback()
-            # 重新获取 task 以避免 Session 状态问题
-            async with AsyncSessionLocal() as error_db:
-                task_fail = await error_db.get(models.ScanTask, task_id)
-                if task_fail:
-                    task_fail.status = "failed"
-                    task_fail.log = str(e)
-                    await error_db.commit()
+            await _mark_failed(task_id, follower_ids, e, artifact_size)
+        finally:
+            if timer is not None:
+                timer.cancel()
+            slot.close()
+            if heartbeat is not None:
+                heartbeat.cancel()
+            # 分片 / 流水线子任务: 汇总父任务的状态与计数
+            for finished_id in (task_id, *follower_ids):
+                await refresh_parent_task(finished_id)
@@ -0,0 +1,104 @@
+# backend/app/core/output_cache.py
+"""
+工具输出缓存。
+subfinder 这类被动数据源在一天内重复运行，结果几乎完全相同。配置了 cache_ttl 的扫描配置，
+工具正常结束后把 stdout 存档复制一份到 OUTPUT_CACHE_DIR，键为渲染后命令 (及 stdin 目标列表) 的 SHA-256；
+之后同一命令在 cache_ttl 秒内再次触发时，worker 直接从缓存副本入库，不再运行工具。
+缓存总大小超过 OUTPUT_CACHE_MAX_BYTES 时按最近使用时间 (LRU) 淘汰。
+触发扫描时 force=true 可跳过缓存 (仍会刷新缓存)。
+
+缓存文件的 mtime 为写入时间 (判断 TTL)，atime 为最近一次命中时间 (LRU 淘汰，命中时显式更新，不依赖挂载选项)。
+"""
+import hashlib
+import os
+import shutil
+import time
+from pathlib import Path
+from typing import Optional
+
+from app.core.artifacts import ARTIFACT_DIR
+
+OUTPUT_CACHE_DIR = Path(os.getenv("OUTPUT_CACHE_DIR", ARTIFACT_DIR / "cache"))
+# 缓存总大小上限 (字节)，默认 5GB
+OUTPUT_CACHE_MAX_BYTES = int(os.getenv("OUTPUT_CACHE_MAX_BYTES", 5 * 1024 ** 3))
+
+
+def cache_key(command: str, stdin_data: Optional[bytes] = None) -> str:
+    """渲染后的命令 (及 stdin 输入) 的 SHA-256"""
+    digest = hashlib.sha256(command.encode())
+    if stdin_data:
+        digest.update(b"\0")
+        digest.update(stdin_data)
+    return digest.hexdigest()
+
+
+def _cache_path(key: str) -> Path:
+    return OUTPUT_CACHE_DIR / f"{key}.stdout"
+
+
+def lookup(key: str, ttl: float) -> Optional[Path]:
+    """返回未过期的缓存文件路径 (并记为最近使用)，不存在或已过期时返回 None"""
+    path = _cache_path(key)
+    try:
+        stat = path.stat()
+    except FileNotFoundError:
+        return None
+    now = time.time()
+    if now - stat.st_mtime > ttl:
+        return None
+    try:
+        os.utime(path, (now, stat.st_mtime))
+    except FileNotFoundError:
+        # 刚好被其它 worker 淘汰
+        return None
+    return path
+
+
+def restore(key: str, ttl: float, dest: Path) -> Optional[int]:
+    """
+    命中时把缓存复制为任务自己的存档 dest，返回存档字节数；未命中返回 None。
+    复制而不是硬链接: 任务重新执行时会原地截断自己的存档，不能影响缓存。
+    """
+    path = lookup(key, ttl)
+    if path is None:
+        return None
+    try:
+        shutil.copyfile(path, dest)
+    except FileNotFoundError:
+        return None
+    return os.path.getsize(dest)
+
+
+def store(key: str, src: Path) -> None:
+    """把完整的存档写入缓存 (先写临时文件再原子替换，并发写入同一键时互不影响)，随后按 LRU 淘汰"""
+    OUTPUT_CACHE_DIR.mkdir(parents=True, exist_ok=True)
+    path = _cache_path(key)
+    tmp = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+    try:
+        shutil.copyfile(src, tmp)
+        os.replace(tmp, path)
+    finally:
+        tmp.unlink(missing_ok=True)
+    evict(OUTPUT_CACHE_MAX_BYTES)
+
+
+def evict(max_bytes: int) -> int:
+    """缓存总大小超过 max_bytes 时，从最久未使用的文件开始删除，返回删除的文件数"""
+    entries = []
+    total = 0
+    for path in OUTPUT_CACHE_DIR.glob("*.stdout"):
+        try:
+            stat = path.stat()
+        except FileNotFoundError:
+            continue
+        entries.append((stat.st_atime, stat.st_size, path))
+        total += stat.st_size
+    removed = 0
+    entries.sort()
+    for _, size, path in entries:
+        if total <= max_bytes:
+            break
+        path.unlink(missing_ok=True)
+        total -= size
+        removed += 1
+    return removed
@@ -0,0 +1,152 @@
+# backend/app/core/pipeline.py
+"""
+声明式多阶段扫描流水线 (scanners.yaml 中带 pipeline_name 的条目)。
+一次流水线运行 = 一个父 ScanTask + 各阶段的子任务。
+上游阶段每提交一批结果，就把其中发现的实体 (hosts / ips / ports / urls)
+作为目标列表创建下一阶段的子任务并立即入队，下游无需等待上游整体结束。
+"""
+import os
+from typing import Any, Dict, List, Optional
+
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.data import models
+from app.core.arq_config import get_arq_pool
+from app.core.config_loader import get_pipeline_by_name, get_scan_config_by_name
+from app.core.dispatch import enqueue_scan_task
+from app.core.ingestion import extract_subdomain_record
+
+# 下游阶段可以使用的输入类型
+PIPELINE_INPUT_KINDS = ("hosts", "ips", "ports", "urls")
+# 上游每提交多少条记录就向下游转发一次 (阶段中可用 forward_every 覆盖)
+PIPELINE_FORWARD_EVERY = int(os.getenv("PIPELINE_FORWARD_EVERY", 1000))
+
+
+def validate_pipeline(pipeline: Dict[str, Any]) -> None:
+    """检查流水线定义，不合法时抛出 ValueError"""
+    stages = pipeline.get("stages")
+    if not isinstance(stages, list) or not stages:
+        raise ValueError(f"流水线 '{pipeline.get('pipeline_name')}' 没有定义 stages")
+    for index, stage in enumerate(stages):
+        scan_config = get_scan_config_by_name(stage.get("config"))
+        if not scan_config:
+            raise ValueError(f"流水线阶段 {index} 引用了不存在的配置: '{stage.get('config')}'")
+        if index == 0:
+            continue
+        if stage.get("input") not in PIPELINE_INPUT_KINDS:
+            raise ValueError(f"流水线阶段 {index} 的 input 必须是 {PIPELINE_INPUT_KINDS} 之一")
+        if not scan_config.get("batch_command_template"):
+            raise ValueError(f"配置 '{stage.get('config')}' 缺少 batch_command_template，不能作为下游阶段")
+
+
+def extract_targets(kind: str, res: Dict[str, Any]) -> List[str]:
+    """从一条解析结果中提取指定类型的下游目标"""
+    if kind == "hosts":
+        extracted = extract_subdomain_record(res)
+        return [extracted[0]] if extracted else []
+    if kind == "ips":
+        ips = []
+        for key in ("ip", "ips"):
+            value = res.get(key)
+            if isinstance(value, list):
+                ips.extend(ip for ip in value if ip)
+            elif value:
+                ips.append(value)
+        return ips
+    if kind == "ports":
+        # 优先保留主机名 (naabu 的 host 字段)，便于下游 httpx 按虚拟主机访问
+        address = res.get("host") or res.get("ip")
+        port = res.get("port")
+        return [f"{address}:{port}"] if address and port else []
+    if kind == "urls":
+        url = res.get("url")
+        return [url] if url else []
+    return []
+
+
+class StageForwarder:
+    """
+    把一个阶段子任务的结果转发给下一阶段。
+    collect() 收集每批记录中的目标 (与本次流水线运行中已转发过的目标去重)，
+    flush() 在检查点提交前把已收集的目标变成一个下一阶段的子任务。
+    """
+
+    def __init__(self, task: models.ScanTask, pipeline: Dict[str, Any]):
+        self.task = task
+        self.next_index = task.stage_index + 1
+        self.next_stage = pipeline["stages"][self.next_index]
+        self.kind = self.next_stage["input"]
+        self.forward_every = int(self.next_stage.get("forward_every") or PIPELINE_FORWARD_EVERY)
+        self.seen = set()
+        self.pending: List[str] = []
+        self.closed = False
+
+    def close(self) -> None:
+        """任务被取消: 丢弃未转发的目标，之后不再创建下游子任务"""
+        self.closed = True
+        self.pending = []
+
+    def collect(self, batch: List[Dict[str, Any]]) -> None:
+        if self.closed:
+            return
+        for res in batch:
+            for target in extract_targets(self.kind, res):
+                if target not in self.seen:
+                    self.seen.add(target)
+                    self.pending.append(target)
+
+    def flush(self, db: AsyncSession) -> Optional[models.ScanTask]:
+        """创建下一阶段子任务 (随调用方的检查点一起提交)，没有新目标时返回 None"""
+        if not self.pending:
+            return None
+        child = models.ScanTask(
+            asset_id=self.task.asset_id,
+            config_name=self.next_stage["config"],
+            status="pending",
+            parent_task_id=self.task.parent_task_id,
+            stage_index=self.next_index,
+            targets=self.pending,
+            priority=self.task.priority,
+            force=self.task.force,
+        )
+        self.pending = []
+        db.add(child)
+        return child
+
+
+async def load_stage_forwarder(db: AsyncSession, task: models.ScanTask) -> Optional[StageForwarder]:
+    """流水线中非最后阶段的子任务返回对应的 StageForwarder，其它任务返回 None"""
+    if task.stage_index is None or not task.parent_task_id:
+        return None
+    parent = await db.get(models.ScanTask, task.parent_task_id)
+    if not parent or not parent.pipeline_name:
+        return None
+    pipeline = get_pipeline_by_name(parent.pipeline_name)
+    if not pipeline or task.stage_index + 1 >= len(pipeline.get("stages") or []):
+        return None
+    forwarder = StageForwarder(task, pipeline)
+    # 重新入库 / 重试时上游结果会被再次收集: 已有下一阶段子任务中的目标不再重复转发
+    existing = await db.execute(
+        select(models.ScanTask.targets).where(
+            models.ScanTask.parent_task_id == task.parent_task_id,
+            models.ScanTask.stage_index == forwarder.next_index,
+        )
+    )
+    for targets in existing.scalars():
+        forwarder.seen.update(targets or [])
+    return forwarder
+
+
+async def enqueue_stage_task(db: AsyncSession, child: models.ScanTask) -> None:
+    """把已提交的下一阶段子任务推送到队列，失败时把该子任务标记为失败"""
+    try:
+        arq_redis = await get_arq_pool()
+        asset = await db.get(models.Asset, child.asset_id)
+        queue = await enqueue_scan_task(arq_redis, child, asset.project_id if asset else None)
+        print(f"[流水线] 阶段 {child.stage_index} 子任务 {child.id} 已入队 {queue}，目标 {len(child.targets)} 个")
+    except Exception as e:
+        print(f"[流水线] 子任务 {child.id} 推送到队列失败: {e}")
+        child.status = "failed"
+        child.log = f"推送到队列失败: {e}"
+        await db.commit()
@@ -0,0 +1,180 @@
+# backend/app/core/reaper.py
+"""
+运行中任务的心跳与回收。
+worker 执行任务期间每隔 HEARTBEAT_INTERVAL 秒刷新 ScanTask.heartbeat_at；
+worker 容器被强制重启 / 崩溃时心跳停止，周期性的回收任务 (ARQ cron) 发现心跳超过
+HEARTBEAT_TIMEOUT 的 running 任务后重新排队 (输出存档完整时从检查点续传)，
+超过 REAPER_MAX_REQUEUES 次仍未完成的任务标记为失败。
+worker 正常退出 (SIGTERM 排空超时) 时被中断的任务由 requeue_interrupted 立即处理，不必等待回收。
+"""
+import asyncio
+import os
+from datetime import datetime, timedelta, timezone
+from typing import List, Optional
+
+from sqlalchemy import and_, func, or_, update
+from sqlalchemy.future import select
+
+from app.data.session import AsyncSessionLocal
+from app.data import models
+from app.core.arq_config import get_arq_pool
+from app.core.batching import load_batch_followers
+from app.core.dispatch import NO_PROJECT, enqueue_scan_task, release_inflight
+from app.core.sharding import refresh_parent_task
+
+# 心跳间隔 (秒)
+HEARTBEAT_INTERVAL = float(os.getenv("TASK_HEARTBEAT_INTERVAL", 30))
+# 超过多久没有心跳视为 worker 已失联 (秒)，需明显大于心跳间隔
+HEARTBEAT_TIMEOUT = float(os.getenv("TASK_HEARTBEAT_TIMEOUT", 300))
+# 同一任务因 worker 失联最多被重新排队的次数，超过后标记为失败
+REAPER_MAX_REQUEUES = int(os.getenv("REAPER_MAX_REQUEUES", 3))
+
+
+async def heartbeat_loop(task_ids: List[int], interval: float = HEARTBEAT_INTERVAL) -> None:
+    """
+    持续刷新 task_ids 中仍在运行的任务的心跳 (由 run_scan_task_logic 在后台启动，任务结束时取消)。
+    task_ids 可以在运行中追加 (合并执行认领的任务)。
+    """
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            async with AsyncSessionLocal() as db:
+                await db.execute(
+                    update(models.ScanTask)
+                    .where(models.ScanTask.id.in_(list(task_ids)), models.ScanTask.status == "running")
+                    .values(heartbeat_at=func.now())
+                    .execution_options(synchronize_session=False)
+                )
+                await db.commit()
+        except Exception as e:
+            print(f"[心跳] 刷新任务 {task_ids[0]} 的心跳失败: {e}")
+
+
+async def _project_id(db, task: models.ScanTask) -> Optional[int]:
+    asset = await db.get(models.Asset, task.asset_id) if task.asset_id else None
+    return asset.project_id if asset else None
+
+
+def can_resume(task: models.ScanTask) -> bool:
+    """输出存档完整 (工具已正常结束) 时可以从检查点续传，不必重新运行工具"""
+    return bool(task.artifact_path) and task.artifact_size is not None
+
+
+async def resumes_from_artifact(task_id: int) -> bool:
+    """ARQ 重新执行被中断的 job 时，是否按 requeue_interrupted 的决定从存档续传 (而不是重新运行工具)"""
+    async with AsyncSessionLocal() as db:
+        task = await db.get(models.ScanTask, task_id)
+        return task is not None and task.status == "pending" and can_resume(task)
+
+
+async def requeue_interrupted(task_id: int, follower_ids: List[int]) -> None:
+    """
+    worker 退出时被中断的任务: 恢复为 pending (已提交的检查点保留)，由 ARQ 重新执行原 job。
+    与回收器相同，输出存档完整时重新执行改为从检查点续传，合并成员保持关联，由 leader 一并重新入库；
+    否则重新运行工具，合并成员解除合并并各自重新入队 (它们原来的 job 已经结束)。
+    """
+    async with AsyncSessionLocal() as db:
+        task = await db.get(models.ScanTask, task_id)
+        if not task or task.status != "running":
+            return
+        resume = can_resume(task)
+        task.status = "pending"
+        task.log = (
+            f"worker 退出，任务已重新排队 (此前已提交 {task.checkpoint} 条记录)"
+            f"{'，将从检查点续传' if resume else ''}。"
+        )
+        followers = []
+        for follower_id in follower_ids:
+            follower = await db.get(models.ScanTask, follower_id)
+            if not resume and follower and follower.status == "running" and follower.batch_leader_id == task_id:
+                follower.status = "pending"
+                follower.batch_leader_id = None
+                follower.log = f"合并执行的任务 {task_id} 因 worker 退出中断，已重新排队。"
+                followers.append(follower)
+        await db.commit()
+        print(f"[任务 {task_id}] worker 退出，任务已恢复为 pending{' (将从检查点续传)' if resume else ''} (解除合并的成员 {len(followers)} 个)")
+
+        if followers:
+            redis = await get_arq_pool()
+            for follower in followers:
+                await enqueue_scan_task(redis, follower, await _project_id(db, follower))
+
+
+async def reap_stale_tasks() -> int:
+    """
+    回收心跳超时的 running 任务，返回处理的任务数。
+    父任务 (分片 / 流水线) 不直接执行、合并执行的成员随其 leader 处理，都不在检查范围内。
+    使用 FOR UPDATE SKIP LOCKED，多个 worker 同时回收时互不重复。
+    """
+    cutoff = datetime.now(timezone.utc) - timedelta(seconds=HEARTBEAT_TIMEOUT)
+    requeued = []  # (task, project_id, reingest)
+    reaped = []
+    async with AsyncSessionLocal() as db:
+        stale = (await db.execute(
+            select(models.ScanTask)
+            .where(
+                models.ScanTask.status == "running",
+                models.ScanTask.started_at.is_not(None),
+                models.ScanTask.batch_leader_id.is_(None),
+                or_(
+                    models.ScanTask.heartbeat_at < cutoff,
+                    and_(models.ScanTask.heartbeat_at.is_(None), models.ScanTask.started_at < cutoff),
+                ),
+            )
+            .order_by(models.ScanTask.id)
+            .with_for_update(skip_locked=True)
+        )).scalars().all()
+
+        for task in stale:
+            followers = [f for f in await load_batch_followers(db, task) if f.status == "running"]
+            last_seen = task.heartbeat_at or task.started_at
+            project_id = await _project_id(db, task)
+            reaped.append((task, project_id))
+            if task.requeue_count >= REAPER_MAX_REQUEUES:
+                task.status = "failed"
+                task.completed_at = func.now()
+                task.log = (
+                    f"worker 心跳超时 (最后心跳 {last_seen:%Y-%m-%d %H:%M:%S})，"
+                    f"已重新排队 {task.requeue_count} 次仍未完成，放弃执行。"
+                )
+                for follower in followers:
+                    follower.status = "failed"
+                    follower.completed_at = func.now()
+                    follower.log = f"合并执行的任务 {task.id} 因 worker 失联失败。"
+                continue
+
+            # 输出存档完整时从检查点续传 (合并成员保持关联，由 leader 重新入库时一并处理)；
+            # 否则重新执行工具，合并成员解除合并后各自排队
+            resume = can_resume(task)
+            task.requeue_count += 1
+            task.status = "pending"
+            task.log = (
+                f"worker 心跳超时 (最后心跳 {last_seen:%Y-%m-%d %H:%M:%S})，"
+                f"第 {task.requeue_count} 次重新排队{'，将从检查点续传' if resume else ''}。"
+            )
+            requeued.append((task, project_id, resume))
+            if not resume:
+                for follower in followers:
+                    follower.status = "pending"
+                    follower.batch_leader_id = None
+                    follower.log = f"合并执行的任务 {task.id} 因 worker 失联中断，已重新排队。"
+                    requeued.append((follower, await _project_id(db, follower), False))
+        await db.commit()
+
+        if reaped:
+            redis = await get_arq_pool()
+            # 失联 worker 占用的项目在途名额不会再被释放，这里代为释放
+            for task, project_id in reaped:
+                await release_inflight(redis, NO_PROJECT if project_id is None else project_id, task.id)
+            for task, project_id, resume in requeued:
+                try:
+                    await enqueue_scan_task(redis, task, project_id, reingest=resume)
+                except Exception as e:
+                    task.status = "failed"
+                    task.log = f"重新排队失败: {e}"
+                    await db.commit()
+            print(f"[回收] 心跳超时的任务 {len(reaped)} 个，重新排队 {len(requeued)} 个")
+
+    for task, _ in reaped:
+        await refresh_parent_task(task.id)
+    return len(reaped)
@@ -0,0 +1,118 @@
+# backend/app/core/scheduler.py
+"""
+worker 端的准入调度 (admission)。
+ARQ 的 max_jobs 只限制总并发: 5 个 nmap -sS 能压垮机器，5 个 dnsx 却几乎不占资源。
+这里在任务真正开始前检查:
+  1. 按 agent_type / 按配置的并发上限 (scanners.yaml 的 scheduler 条目与配置的 max_concurrency)
+  2. 机器负载: 重型任务要求 1 分钟 load / CPU 核数低于阈值，所有任务要求可用内存高于下限
+不满足时抛出 AdmissionDeferred，由 worker 延后重新入队，空出的槽位留给轻量的被动任务。
+计数只在当前 worker 进程内生效 (保护的是这台机器的资源)。
+"""
+import os
+import random
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+from app.core.config_loader import get_scheduler_settings
+
+# 默认阈值 (scanners.yaml 的 scheduler 条目可覆盖)
+DEFAULT_MAX_LOAD_PER_CPU = float(os.getenv("SCHEDULER_MAX_LOAD_PER_CPU", 1.5))
+DEFAULT_MIN_FREE_MEMORY_MB = int(os.getenv("SCHEDULER_MIN_FREE_MEMORY_MB", 512))
+DEFAULT_DEFER_SECONDS = float(os.getenv("SCHEDULER_DEFER_SECONDS", 15))
+DEFAULT_HEAVY_AGENT_TYPES = ("portscan", "vulnerability")
+
+
+class AdmissionDeferred(Exception):
+    """任务暂不满足准入条件，需要延后 delay 秒再试"""
+
+    def __init__(self, reason: str, delay: float):
+        super().__init__(reason)
+        self.reason = reason
+        self.delay = delay
+
+
+# 当前 worker 进程内各限流键的运行中任务数
+_running: Dict[str, int] = {}
+
+
+def _limit_keys(scan_config: Dict[str, Any], settings: Dict[str, Any]) -> List[Tuple[str, int]]:
+    """返回该配置需要检查的 (限流键, 上限) 列表"""
+    keys: List[Tuple[str, int]] = []
+    agent_type = scan_config.get("agent_type")
+    by_agent_type = settings.get("max_concurrency_by_agent_type") or {}
+    if agent_type in by_agent_type:
+        keys.append((f"agent_type:{agent_type}", int(by_agent_type[agent_type])))
+    if scan_config.get("max_concurrency"):
+        keys.append((f"config:{scan_config.get('config_name')}", int(scan_config["max_concurrency"])))
+    return keys
+
+
+def read_free_memory_mb() -> Optional[float]:
+    """读取 /proc/meminfo 的 MemAvailable (MB)，非 Linux 环境返回 None (不做内存检查)"""
+    try:
+        with open("/proc/meminfo", "r") as f:
+            for line in f:
+                if line.startswith("MemAvailable:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return None
+
+
+def read_load_per_cpu() -> Optional[float]:
+    """1 分钟平均负载 / CPU 核数，不支持的平台返回 None"""
+    try:
+        return os.getloadavg()[0] / (os.cpu_count() or 1)
+    except (OSError, AttributeError):
+        return None
+
+
+def is_heavy(scan_config: Dict[str, Any], settings: Dict[str, Any]) -> bool:
+    """重型任务 (主动扫描) 需要额外的负载检查；配置中的 heavy 字段优先"""
+    if "heavy" in scan_config:
+        return bool(scan_config["heavy"])
+    heavy_types = settings.get("heavy_agent_types") or DEFAULT_HEAVY_AGENT_TYPES
+    return scan_config.get("agent_type") in heavy_types
+
+
+def _defer(reason: str, settings: Dict[str, Any]) -> AdmissionDeferred:
+    delay = float(settings.get("defer_seconds") or DEFAULT_DEFER_SECONDS)
+    # 加一点随机抖动，避免被延后的任务同时回来
+    return AdmissionDeferred(reason, delay * random.uniform(0.8, 1.5))
+
+
+@contextmanager
+def admit(scan_config: Dict[str, Any]) -> Iterator[None]:
+    """
+    准入检查并占用并发槽位，with 块结束时释放。
+    不满足条件时抛出 AdmissionDeferred (此时没有占用任何槽位)。
+    """
+    settings = get_scheduler_settings()
+    keys = _limit_keys(scan_config, settings)
+    for key, limit in keys:
+        if _running.get(key, 0) >= limit:
+            raise _defer(f"{key} 并发已达上限 {limit}", settings)
+
+    min_free_mb = float(settings.get("min_free_memory_mb") or DEFAULT_MIN_FREE_MEMORY_MB)
+    free_mb = read_free_memory_mb()
+    if free_mb is not None and free_mb < min_free_mb:
+        raise _defer(f"可用内存 {free_mb:.0f}MB 低于 {min_free_mb:.0f}MB", settings)
+
+    if is_heavy(scan_config, settings):
+        max_load = float(settings.get("max_load_per_cpu") or DEFAULT_MAX_LOAD_PER_CPU)
+        load = read_load_per_cpu()
+        if load is not None and load > max_load:
+            raise _defer(f"单核负载 {load:.2f} 高于 {max_load:.2f}", settings)
+
+    for key, _ in keys:
+        _running[key] = _running.get(key, 0) + 1
+    try:
+        yield
+    finally:
+        for key, _ in keys:
+            _running[key] -= 1
+
+
+def running_snapshot() -> Dict[str, int]:
+    """当前 worker 进程内各限流键的运行中任务数 (调试用)"""
+    return {key: count for key, count in _running.items() if count}
@@ -0,0 +1,109 @@
+# backend/app/core/sharding.py
+"""
+CIDR 资产的分片扫描。
+一个大网段 (如 /16) 被拆成若干子网段，每段作为一个子 ScanTask 单独入队，
+由多个 worker 并行执行；父 ScanTask 不直接执行，只汇总子任务的状态与计数。
+(流水线运行同样使用父子任务结构，汇总逻辑共用 refresh_parent_task)
+"""
+import ipaddress
+import os
+from typing import Dict, List, Tuple
+
+from sqlalchemy import func
+from sqlalchemy.future import select
+
+from app.data.session import AsyncSessionLocal
+from app.data import models
+
+# scanners.yaml 未配置 shard_prefix 时的默认分片大小 (IPv4 /24 = 256 个地址)
+DEFAULT_SHARD_PREFIX = int(os.getenv("DEFAULT_SHARD_PREFIX", 24))
+# 单个网段最多拆出的分片数，超过时自动增大分片
+MAX_SCAN_SHARDS = int(os.getenv("MAX_SCAN_SHARDS", 1024))
+
+
+def split_cidr(cidr: str, shard_prefix: int = DEFAULT_SHARD_PREFIX, max_shards: int = MAX_SCAN_SHARDS) -> List[str]:
+    """
+    把 CIDR 拆成前缀长度为 shard_prefix 的子网段列表。
+    网段本身不大于分片大小、或无法解析为网段时原样返回。
+    """
+    try:
+        network = ipaddress.ip_network(cidr.strip(), strict=False)
+    except ValueError:
+        return [cidr]
+
+    prefix = min(max(shard_prefix, network.prefixlen), network.max_prefixlen)
+    # 分片过多时 (如 /8 按 /24 拆出 65536 段) 逐级增大分片
+    while prefix > network.prefixlen and 2 ** (prefix - network.prefixlen) > max_shards:
+        prefix -= 1
+    if prefix == network.prefixlen:
+        return [str(network)]
+    return [str(subnet) for subnet in network.subnets(new_prefix=prefix)]
+
+
+async def refresh_parent_task(task_id: int) -> None:
+    """
+    子任务状态变化后调用: 若该任务属于某个父任务，重新汇总父任务的状态与计数。
+    父任务行使用 SELECT ... FOR UPDATE 加锁，多个分片同时结束时依次汇总。
+    """
+    async with AsyncSessionLocal() as db:
+        parent_id = (await db.execute(
+            select(models.ScanTask.parent_task_id).where(models.ScanTask.id == task_id)
+        )).scalar()
+        if not parent_id:
+            return
+
+        parent = (await db.execute(
+            select(models.ScanTask).where(models.ScanTask.id == parent_id).with_for_update()
+        )).scalars().first()
+        if not parent:
+            return
+
+        rows = (await db.execute(
+            select(
+                models.ScanTask.stage_index,
+                models.ScanTask.config_name,
+                models.ScanTask.status,
+                func.count(),
+                func.coalesce(func.sum(models.ScanTask.checkpoint), 0),
+                func.coalesce(func.sum(models.ScanTask.results_count), 0),
+            )
+            .where(models.ScanTask.parent_task_id == parent_id)
+            .group_by(models.ScanTask.stage_index, models.ScanTask.config_name, models.ScanTask.status)
+        )).all()
+        by_status: Dict[str, int] = {}
+        by_stage: Dict[Tuple[int, str], Dict[str, int]] = {}
+        processed_count = results_count = 0
+        for stage_index, config_name, status, count, processed, results in rows:
+            by_status[status] = by_status.get(status, 0) + count
+            stage = by_stage.setdefault((stage_index, config_name), {})
+            stage[status] = stage.get(status, 0) + count
+            processed_count += processed
+            results_count += results
+        total = sum(by_status.values())
+
+        finished = by_status.get("completed", 0) + by_status.get("failed", 0) + by_status.get("cancelled", 0)
+        if finished < total:
+            parent.status = "running"
+            parent.completed_at = None
+        elif by_status.get("failed"):
+            parent.status = "failed"
+            parent.completed_at = func.now()
+        else:
+            parent.status = "cancelled" if by_status.get("cancelled") else "completed"
+            parent.completed_at = func.now()
+
+        parent.checkpoint = processed_count
+        parent.results_count = results_count
+        label = "子任务" if parent.pipeline_name else "分片"
+        parent.log = (
+            f"{label} {total} 个: 完成 {by_status.get('completed', 0)}，失败 {by_status.get('failed', 0)}，"
+            f"取消 {by_status.get('cancelled', 0)}，未结束 {total - finished}。处理 {processed_count} 条，新增 {results_count} 条数据。"
+        )
+        if parent.pipeline_name:
+            # 流水线按阶段列出进度
+            for (stage_index, config_name), stage in sorted(by_stage.items(), key=lambda item: item[0][0] or 0):
+                parent.log += (
+                    f"\n阶段 {stage_index} [{config_name}]: 完成 {stage.get('completed', 0)}/{sum(stage.values())}"
+                    f"，失败 {stage.get('failed', 0)}"
+                )
+        await db.commit()
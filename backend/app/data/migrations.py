@@ -0,0 +1,42 @@
+# backend/app/data/migrations.py
+"""
+数据库结构版本检查。
+表结构由 Alembic 迁移管理 (backend/alembic)，应用启动时只比对数据库中记录的迁移版本
+与代码中的最新版本 (head)，不再反射 / create_all 整个结构。
+部署时先执行 `alembic upgrade head` (docker-compose 中 backend 服务启动前自动执行)。
+"""
+from pathlib import Path
+from typing import Optional
+
+from alembic.config import Config
+from alembic.runtime.migration import MigrationContext
+from alembic.script import ScriptDirectory
+from sqlalchemy.ext.asyncio import AsyncEngine
+
+ALEMBIC_INI = Path(__file__).resolve().parent.parent.parent / "alembic.ini"
+
+
+class SchemaOutdated(RuntimeError):
+    """数据库结构版本与代码不一致"""
+
+
+def head_revision() -> Optional[str]:
+    """代码中的最新迁移版本"""
+    return ScriptDirectory.from_config(Config(str(ALEMBIC_INI))).get_current_head()
+
+
+async def current_revision(engine: AsyncEngine) -> Optional[str]:
+    """数据库当前的迁移版本 (没有 alembic_version 表时为 None)"""
+    async with engine.connect() as conn:
+        return await conn.run_sync(lambda sync_conn: MigrationContext.configure(sync_conn).get_current_revision())
+
+
+async def check_schema_revision(engine: AsyncEngine) -> str:
+    """数据库已升级到最新版本时返回版本号，否则抛出 SchemaOutdated"""
+    head = head_revision()
+    current = await current_revision(engine)
+    if current != head:
+        raise SchemaOutdated(
+            f"数据库结构版本为 {current or '未初始化'}，代码要求 {head}，请先在 backend/ 目录下运行 `alembic upgrade head`"
+        )
+    return current
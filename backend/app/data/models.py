@@ -3,7 +3,8 @@
 定义数据库的所有表模型 (最终版本，包含完整的标签支持 + Favicon Hash + ASN信息)
 """
 from sqlalchemy import (
-    Column, Integer, String, DateTime, func, Boolean, ForeignKey, Text, JSON, Enum, Table, UniqueConstraint
+    Column, Integer, BigInteger, String, DateTime, func, Boolean, ForeignKey, Text, JSON, Enum, Table, UniqueConstraint,
+    Index, text
 )
 from sqlalchemy.orm import relationship # 用于定义表之间的关系
 
@@ -124,6 +125,13 @@ class Host(Base):
 class DNSRecord(Base):
     """DNS 记录 (多对多关联表)"""
     __tablename__ = "dns_records"
+    __table_args__ = (
+        # 入库时按 (主机, IP, 记录类型) 去重 (INSERT ... ON CONFLICT DO NOTHING)；record_type 为空的记录同样视为重复
+        UniqueConstraint("host_id", "ip_address_id", "record_type", name="uq_dns_record_host_ip_type",
+                         postgresql_nulls_not_distinct=True),
+        # 按 IP 反查主机: 索引中带上 host_id，无需回表
+        Index("ix_dns_records_ip_address_id", "ip_address_id", postgresql_include=["host_id"]),
+    )
     id = Column(Integer, primary_key=True, index=True)
     host_id = Column(Integer, ForeignKey("hosts.id", ondelete="CASCADE"), nullable=False) # 级联删除
     ip_address_id = Column(Integer, ForeignKey("ip_addresses.id", ondelete="CASCADE"), nullable=False) # 级联删除
@@ -135,9 +143,22 @@ class DNSRecord(Base):
 class Port(Base):
     """端口"""
     __tablename__ = "ports"
+    __table_args__ = (
+        # 同一资产下同一 IP 的同一端口只保留一条 (入库时 ON CONFLICT DO NOTHING)；
+        # 多个资产共享的 IP 在每个资产下各有一条端口记录
+        UniqueConstraint("root_asset_id", "ip_address_id", "port_number", name="uq_port_owner_ip_number"),
+        # 按 IP 列出端口
+        Index("ix_ports_ip_address_id", "ip_address_id"),
+        # 按资产分页列出 (WHERE root_asset_id = ? ORDER BY id DESC)
+        Index("ix_ports_root_asset_id", "root_asset_id", "id"),
+        Index("ix_ports_root_asset_port", "root_asset_id", "port_number", "id"),
+    )
     id = Column(Integer, primary_key=True, index=True)
     ip_address_id = Column(Integer, ForeignKey("ip_addresses.id", ondelete="CASCADE"), nullable=False) # 级联删除
     port_number = Column(Integer, nullable=False, index=True)
+    # 归属 (入库时按扫描任务的资产填写，同时是唯一键的一部分；列表接口按它单表过滤；旧数据由 app/core/backfill.py 回填)
+    project_id = Column(Integer, ForeignKey("projects.id", ondelete="SET NULL"), nullable=True, index=True)
+    root_asset_id = Column(Integer, ForeignKey("assets.id", ondelete="SET NULL"), nullable=True)
     service_name = Column(String, nullable=True)
     created_at = Column(DateTime(timezone=True), server_default=func.now())
     updated_at = Column(DateTime(timezone=True), onupdate=func.now())
@@ -150,9 +171,21 @@ class Port(Base):
 class HTTPService(Base):
     """Web 服务"""
     __tablename__ = "http_services"
+    __table_args__ = (
+        # 同一资产下同一 URL 只保留一条 (入库时 ON CONFLICT DO NOTHING)
+        UniqueConstraint("root_asset_id", "url", name="uq_http_service_owner_url"),
+        # 按资产分页列出 (WHERE root_asset_id = ? ORDER BY id DESC)
+        Index("ix_http_services_root_asset_id", "root_asset_id", "id"),
+        Index("ix_http_services_root_asset_status", "root_asset_id", "status_code", "id"),
+        # 按技术栈过滤 (tech::jsonb ? 'Nginx')
+        Index("ix_http_services_tech", text("(tech::jsonb)"), postgresql_using="gin"),
+    )
     id = Column(Integer, primary_key=True, index=True)
-    port_id = Column(Integer, ForeignKey("ports.id", ondelete="CASCADE"), nullable=False) # 级联删除
+    port_id = Column(Integer, ForeignKey("ports.id", ondelete="CASCADE"), nullable=False, index=True) # 级联删除
     url = Column(String, nullable=False, index=True)
+    # 归属 (入库时按扫描任务的资产填写，同时是唯一键的一部分；列表接口按它单表过滤；旧数据由 app/core/backfill.py 回填)
+    project_id = Column(Integer, ForeignKey("projects.id", ondelete="SET NULL"), nullable=True, index=True)
+    root_asset_id = Column(Integer, ForeignKey("assets.id", ondelete="SET NULL"), nullable=True)
     title = Column(String, nullable=True)
     status_code = Column(Integer, nullable=True, index=True)
     tech = Column(JSON, nullable=True)
@@ -173,9 +206,20 @@ class HTTPService(Base):
 class Vulnerability(Base):
     """漏洞"""
     __tablename__ = "vulnerabilities"
+    __table_args__ = (
+        # 指纹按资产去重: 不同资产 (包括不同项目) 命中同一个漏洞时各自一条
+        UniqueConstraint("root_asset_id", "fingerprint", name="uq_vulnerability_owner_fingerprint"),
+        # 按资产分页列出 (WHERE root_asset_id = ? ORDER BY id DESC)
+        Index("ix_vulnerabilities_root_asset_id", "root_asset_id", "id"),
+        Index("ix_vulnerabilities_root_asset_severity", "root_asset_id", "severity", "id"),
+    )
     id = Column(Integer, primary_key=True, index=True)
-    host_id = Column(Integer, ForeignKey("hosts.id", ondelete="CASCADE"), nullable=True) # 级联删除
-    http_service_id = Column(Integer, ForeignKey("http_services.id", ondelete="CASCADE"), nullable=True) # 级联删除
+    # 入库时由 matched_at 关联 (见 ingestion.AssetServiceIndex)
+    host_id = Column(Integer, ForeignKey("hosts.id", ondelete="CASCADE"), nullable=True, index=True) # 级联删除
+    http_service_id = Column(Integer, ForeignKey("http_services.id", ondelete="CASCADE"), nullable=True, index=True) # 级联删除
+    # 归属 (入库时按扫描任务的资产填写，同时是唯一键的一部分；列表接口按它单表过滤；旧数据由 app/core/backfill.py 回填)
+    project_id = Column(Integer, ForeignKey("projects.id", ondelete="SET NULL"), nullable=True, index=True)
+    root_asset_id = Column(Integer, ForeignKey("assets.id", ondelete="SET NULL"), nullable=True)
 
     vulnerability_name = Column(String, nullable=False, index=True)
     template_id = Column(String, nullable=True, index=True)
@@ -184,6 +228,11 @@ class Vulnerability(Base):
     details = Column(JSON, nullable=True)
     status = Column(Enum("new", "reviewed", "false_positive", "remediated", name="vuln_status_enum"), default="new", nullable=False, index=True)
     is_bookmarked = Column(Boolean, default=False, nullable=False, index=True)
+    # 去重指纹 (模板 + 命中位置 + matcher + 提取值，见 ingestion.vulnerability_fingerprint)，同一资产内重复命中只刷新下面三列
+    fingerprint = Column(String(64), nullable=True)
+    first_seen = Column(DateTime(timezone=True), server_default=func.now())
+    last_seen = Column(DateTime(timezone=True), server_default=func.now(), index=True)
+    hit_count = Column(Integer, default=1, server_default="1", nullable=False)
     created_at = Column(DateTime(timezone=True), server_default=func.now())
     updated_at = Column(DateTime(timezone=True), onupdate=func.now())
 
@@ -216,17 +265,45 @@ class GenericFinding(Base):
 class ScanTask(Base):
     """扫描任务"""
     __tablename__ = "scan_tasks"
+    __table_args__ = (
+        # 同一资产同一配置 (或流水线) 同时只能有一个未结束的顶层任务，重复提交时返回已有任务
+        # (分片 / 流水线子任务与父任务共用资产和配置，不在约束范围内)
+        Index(
+            "uq_scan_tasks_active", "asset_id", "config_name", unique=True,
+            postgresql_where=text("status IN ('pending', 'running') AND parent_task_id IS NULL"),
+        ),
+    )
     id = Column(Integer, primary_key=True, index=True)
     asset_id = Column(Integer, ForeignKey("assets.id"), nullable=True) # 关联到根资产
+    parent_task_id = Column(Integer, ForeignKey("scan_tasks.id", ondelete="CASCADE"), nullable=True, index=True) # 分片子任务所属的父任务
+    target = Column(String, nullable=True) # 本任务实际扫描的目标 (分片子网段)；为空时使用资产名称
+    targets = Column(JSON, nullable=True) # 多目标任务的目标列表 (通过 stdin 交给 batch_command_template)
+    pipeline_name = Column(String, nullable=True) # 流水线父任务: 使用的流水线名称
+    stage_index = Column(Integer, nullable=True) # 流水线子任务: 所处阶段 (从 0 开始)
+    batch_leader_id = Column(Integer, ForeignKey("scan_tasks.id", ondelete="SET NULL"), nullable=True, index=True) # 合并执行时由哪个任务代为运行
+    priority = Column(Integer, default=5, server_default="5", nullable=False) # 在命名队列中的优先级 (0-9，越大越先执行)
+    force = Column(Boolean, default=False, server_default="false", nullable=False) # 跳过工具输出缓存，总是重新运行工具
 
     config_name = Column(String, nullable=False, index=True) # 使用的 scanners.yaml 中的配置名
-    status = Column(Enum("pending", "running", "completed", "failed", name="task_status_enum"), default="pending", nullable=False, index=True)
+    status = Column(Enum("pending", "running", "completed", "failed", "cancelled", name="task_status_enum"), default="pending", nullable=False, index=True)
     log = Column(Text, nullable=True)
     created_at = Column(DateTime(timezone=True), server_default=func.now())
+    started_at = Column(DateTime(timezone=True), nullable=True) # 最近一次开始执行的时间
+    heartbeat_at = Column(DateTime(timezone=True), nullable=True) # 执行中的 worker 最近一次心跳
+    requeue_count = Column(Integer, default=0, server_default="0", nullable=False) # 因 worker 失联被重新排队的次数
     completed_at = Column(DateTime(timezone=True), nullable=True)
 
+    # --- 输出存档 ---
+    artifact_path = Column(String, nullable=True) # stdout 存档文件路径 (stderr 为同名 .stderr 文件)
+    artifact_size = Column(BigInteger, nullable=True) # 存档字节数，工具正常结束 (退出码 0) 后才写入；为空表示存档不完整或工具执行失败
+
+    # --- 入库检查点 ---
+    checkpoint = Column(BigInteger, default=0, server_default="0", nullable=False) # 已提交入库的解析记录条数 (续传时跳过)
+    results_count = Column(Integer, default=0, server_default="0", nullable=False) # 截至检查点已新增的数据条数
+
     # --- 关系 ---
     asset = relationship("Asset", back_populates="scan_tasks")
+    children = relationship("ScanTask", cascade="all, delete-orphan", passive_deletes=True, foreign_keys=[parent_task_id])
     raw_results = relationship("RawScanResult", back_populates="scan_task", cascade="all, delete-orphan")
 
 
@@ -2,30 +2,200 @@
 """
 定义解析器 (Parser) 的基类/接口。
 """
-from abc import ABC, abstractmethod
+import asyncio
+import mmap
+import os
+import time
+from abc import ABC
+from contextlib import contextmanager
 # --- 关键修复：导入 AsyncGenerator ---
-from typing import List, Dict, Any, AsyncGenerator 
+from typing import List, Dict, Any, AsyncGenerator, AsyncIterable, Iterator, Optional, Union
 # --- 结束修复 ---
 
+# 解析器可接受的原始输出: 完整字符串/字节串、只读映射的存档文件 (mmap)，或子进程 stdout 这样的异步字节流
+RawOutput = Union[str, bytes, mmap.mmap, AsyncIterable[bytes]]
+
+# 按块读取时每块的大小 (字节)
+CHUNK_SIZE = 64 * 1024
+
+# parse_batches() 默认每批的记录数
+DEFAULT_BATCH_SIZE = 1000
+
+# 解析大段输出时主动让出事件循环的频率: 每 N 行或每 X 毫秒一次 (先到为准)
+YIELD_EVERY_LINES = int(os.getenv("PARSER_YIELD_EVERY_LINES", 1000))
+YIELD_INTERVAL_MS = float(os.getenv("PARSER_YIELD_INTERVAL_MS", 20))
+
+
+@contextmanager
+def open_mmap(path: str) -> Iterator[Union[mmap.mmap, bytes]]:
+    """
+    只读映射整个文件，按需由操作系统换页，不占用进程堆内存。
+    空文件无法 mmap，此时返回 b""。
+    """
+    with open(path, 'rb') as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            yield b""
+            return
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            yield mapped
+
+
+def iter_buffer_lines(buffer: Union[mmap.mmap, bytes], start: int = 0, end: Optional[int] = None) -> Iterator[bytes]:
+    """
+    逐行切出缓冲区中 [start, end) 字节区间内 "起始于" 该区间的行 (保留换行符)。
+    相邻区间拼起来恰好覆盖每一行一次，可以把大文件切成若干段并行解析。
+    """
+    size = len(buffer)
+    end = size if end is None else min(end, size)
+    pos = start
+    if start > 0:
+        # 跨越起点的半行属于上一段
+        newline = buffer.find(b"\n", start - 1)
+        pos = size if newline == -1 else newline + 1
+    while pos < end:
+        newline = buffer.find(b"\n", pos)
+        stop = size if newline == -1 else newline + 1
+        yield buffer[pos:stop]
+        pos = stop
+
+
+async def iter_raw_lines(raw_output: RawOutput) -> AsyncGenerator[Union[str, bytes], None]:
+    """
+    逐行产出原始输出，不做解码: str 输入产出 str，字节输入/字节流产出 bytes。
+    供 orjson 这类可以直接解析 bytes 的解析器省去一次解码。
+    """
+    if isinstance(raw_output, (str, bytes)):
+        for line in raw_output.splitlines():
+            yield line
+    elif isinstance(raw_output, mmap.mmap):
+        for line in iter_buffer_lines(raw_output):
+            yield line
+    else:
+        async for line in raw_output:
+            yield line
+
+
+async def iter_lines(raw_output: RawOutput) -> AsyncGenerator[str, None]:
+    """
+    把原始输出统一转换为逐行文本 (不含换行符)。
+    对异步字节流 (如 asyncio.StreamReader) 逐行读取，内存占用与输出总量无关。
+    """
+    if isinstance(raw_output, str):
+        for line in raw_output.splitlines():
+            yield line
+    elif isinstance(raw_output, bytes):
+        for line in raw_output.splitlines():
+            yield line.decode('utf-8', errors='ignore')
+    elif isinstance(raw_output, mmap.mmap):
+        for line in iter_buffer_lines(raw_output):
+            yield line.decode('utf-8', errors='ignore').rstrip('\r\n')
+    else:
+        async for line in raw_output:
+            yield line.decode('utf-8', errors='ignore').rstrip('\r\n')
+
+
+async def iter_chunks(raw_output: RawOutput, chunk_size: int = CHUNK_SIZE) -> AsyncGenerator[bytes, None]:
+    """
+    把原始输出统一转换为字节块，供 XML 等需要增量 feed 的格式使用。
+    对 StreamReader 按固定大小读取，不要求输出按行分隔。
+    """
+    if isinstance(raw_output, str):
+        for start in range(0, len(raw_output), chunk_size):
+            yield raw_output[start:start + chunk_size].encode('utf-8')
+    elif isinstance(raw_output, (bytes, mmap.mmap)):
+        for start in range(0, len(raw_output), chunk_size):
+            yield raw_output[start:start + chunk_size]
+    elif hasattr(raw_output, "read"):
+        while True:
+            chunk = await raw_output.read(chunk_size)
+            if not chunk:
+                break
+            yield chunk
+    else:
+        async for chunk in raw_output:
+            yield chunk
+
+
+def read_line_range(path: str, start: int = 0, end: Optional[int] = None) -> Iterator[bytes]:
+    """同步地通过 mmap 读取文件中 [start, end) 字节区间起始的行 (见 iter_buffer_lines)"""
+    with open_mmap(path) as mapped:
+        yield from iter_buffer_lines(mapped, start, end)
+
+
+class LoopYielder:
+    """
+    节流版的 asyncio.sleep(0)。
+    逐行调用 tick()，只有累计 YIELD_EVERY_LINES 行或距上次让出超过 YIELD_INTERVAL_MS 时才真正让出，
+    避免每行一次的调度开销，同时不让长时间解析饿死同一事件循环里的其它任务。
+    """
+
+    def __init__(self, every_lines: int = YIELD_EVERY_LINES, interval_ms: float = YIELD_INTERVAL_MS):
+        self.every_lines = every_lines
+        self.interval = interval_ms / 1000
+        self._lines = 0
+        self._last = time.monotonic()
+
+    async def tick(self) -> None:
+        self._lines += 1
+        now = time.monotonic()
+        if self._lines >= self.every_lines or now - self._last >= self.interval:
+            self._lines = 0
+            await asyncio.sleep(0)
+            self._last = time.monotonic()
+
+
 class BaseParser(ABC):
-    """所有解析器的抽象基类"""
+    """
+    所有解析器的抽象基类。
+    子类至少实现 parse() 与 parse_batches() 中的一个: 内置解析器原生实现 parse_batches()，
+    parse() 作为逐条接口的兼容层保留；只实现 parse() 的解析器由基类自动攒批。
+    实现了同步 parse_file() 的解析器可以在进程池中解析落盘的输出 (见 process_pool.py)。
+    """
+
+    # 输出能否按字节区间切分后分段并行解析 (逐行格式、按 <host> 切分的 Nmap XML 为 True)
+    splittable = False
 
-    @abstractmethod
     # --- 关键修复：使用 AsyncGenerator ---
-    async def parse(self, raw_output: str, data_mapping: Dict[str, str]) -> AsyncGenerator[Dict[str, Any], None]:
+    async def parse(self, raw_output: RawOutput, data_mapping: Dict[str, str]) -> AsyncGenerator[Dict[str, Any], None]:
     # --- 结束修复 ---
         """
-        解析原始输出字符串。
+        解析原始输出。
 
         Args:
-            raw_output: 扫描工具的原始标准输出 (stdout)。
+            raw_output: 扫描工具的原始标准输出 (stdout)。可以是完整字符串，
+                        也可以是 asyncio.create_subprocess_shell 的 stdout 流，
+                        后者允许在工具仍在运行时边读边解析。
             data_mapping: 来自 scanners.yaml 的 data_mapping 配置, 指导如何提取字段。
 
         Yields:
             一个字典, 代表一条解析后的记录 (符合我们内部 UDF 的部分结构)。
             使用 AsyncGenerator (yield) 允许处理大量输出而无需一次性加载到内存。
         """
-        # 这个 yield {} 只是为了满足抽象方法的要求，并让类型检查器满意
-        # 在实际的子类中它会被覆盖掉
-        yield {}
-        raise NotImplementedError
\ No newline at end of file
+        if type(self).parse_batches is BaseParser.parse_batches:
+            raise NotImplementedError(f"{type(self).__name__} 需要实现 parse() 或 parse_batches()")
+        async for batch in self.parse_batches(raw_output, data_mapping):
+            for record in batch:
+                yield record
+
+    async def parse_batches(self, raw_output: RawOutput, data_mapping: Dict[str, str], batch_size: int = DEFAULT_BATCH_SIZE) -> AsyncGenerator[List[Dict[str, Any]], None]:
+        """
+        批量解析接口: 与 parse() 相同的输入，但每次产出最多 batch_size 条记录组成的列表，
+        省去逐条经过异步生成器的开销，便于入库端按批写库。
+        """
+        if type(self).parse is BaseParser.parse:
+            raise NotImplementedError(f"{type(self).__name__} 需要实现 parse() 或 parse_batches()")
+        batch: List[Dict[str, Any]] = []
+        async for record in self.parse(raw_output, data_mapping):
+            batch.append(record)
+            if len(batch) >= batch_size:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+
+    def parse_file(self, path: str, data_mapping: Dict[str, str], start: int = 0, end: Optional[int] = None) -> List[Dict[str, Any]]:
+        """
+        同步解析文件中 [start, end) 字节区间的输出，返回记录列表。
+        在进程池的子进程中调用，因此不能依赖事件循环；不可切分的格式忽略 start/end。
+        """
+        raise NotImplementedError(f"{type(self).__name__} 不支持进程池解析")
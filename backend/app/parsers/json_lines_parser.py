@@ -5,68 +5,114 @@
 支持使用 "点符号" (dot notation) 进行嵌套字段映射。
 """
 import json
-import asyncio
 # --- 关键修复：导入 AsyncGenerator ---
-from typing import List, Dict, Any, AsyncGenerator, Optional
+from typing import List, Dict, Any, AsyncGenerator, Optional, Tuple, Union
 # --- 结束修复 ---
 from json import JSONDecodeError
-from .base_parser import BaseParser
+from .base_parser import BaseParser, DEFAULT_BATCH_SIZE, LoopYielder, RawOutput, iter_raw_lines, read_line_range
+
+# orjson 比标准库 json 快数倍，且可以直接解析 bytes；未安装时回退到标准库
+# (orjson.JSONDecodeError 是 json.JSONDecodeError 的子类, 下面的 except 对两者都有效)
+try:
+    import orjson
+    _json_loads = orjson.loads
+except ImportError:  # pragma: no cover
+    _json_loads = json.loads
+
+# 预编译后的映射: ((目标字段, 键路径元组), ...)，键路径为 None 表示 "self" (整个对象)
+CompiledMapping = Tuple[Tuple[str, Optional[Tuple[str, ...]]], ...]
+
+
+def compile_mapping(data_mapping: Dict[str, str]) -> CompiledMapping:
+    """把 data_mapping 中的点符号路径一次性拆分好，避免每行重复 split"""
+    return tuple(
+        (target_field, None if source_path == "self" else tuple(source_path.split('.')))
+        for target_field, source_path in data_mapping.items()
+    )
+
+
+# 辅助函数，用于按预拆分的键路径访问嵌套字典
+def _get_nested_value(data: Dict[str, Any], keys: Tuple[str, ...]) -> Optional[Any]:
+    value: Any = data
+    for key in keys:
+        if not isinstance(value, dict): # 如果中间路径不是字典, 则无法继续访问
+            return None
+        value = value.get(key)
+        if value is None: # 如果 get() 返回 None, 提前退出
+            return None
+    return value
+
+
+def _preview(line: Union[str, bytes]) -> str:
+    """日志里展示的行内容 (截断过长的行)"""
+    if isinstance(line, bytes):
+        line = line.decode('utf-8', errors='ignore')
+    return line[:200]
+
+
+def _parse_line(line: Union[str, bytes], mapping: CompiledMapping) -> Optional[Dict[str, Any]]:
+    """解析一行 JSON 并按映射提取字段；空行、无法解析或映射结果为空时返回 None"""
+    stripped_line = line.strip()
+    if not stripped_line:
+        return None # 跳过空行
 
-# 辅助函数，用于通过点符号访问嵌套字典
-def _get_nested_value(data: Dict[str, Any], key_path: str) -> Optional[Any]:
-    keys = key_path.split('.')
-    value = data
     try:
-        for key in keys:
-            if isinstance(value, dict):
-                value = value.get(key)
-            else: # 如果中间路径不是字典, 则无法继续访问
-                return None
-            if value is None: # 如果 get() 返回 None, 提前退出
-                return None
-        return value
-    except Exception: # 捕获可能的 AttributeError 等
-        return None
+        data = _json_loads(stripped_line)
+        if not isinstance(data, dict):
+            print(f"警告: JsonLinesParser 跳过非字典行: {_preview(stripped_line)}")
+            return None
+
+        parsed_record: Dict[str, Any] = {}
+        for target_field, keys in mapping:
+            if keys is None:
+                parsed_record[target_field] = data
+            else:
+                value = _get_nested_value(data, keys)
+                if value is not None:
+                    parsed_record[target_field] = value
+        return parsed_record or None
+
+    except JSONDecodeError:
+        print(f"警告: JsonLinesParser 无法解析 JSON 行: {_preview(stripped_line)}")
+    except Exception as e:
+        print(f"错误: JsonLinesParser 在处理行时出错: {_preview(stripped_line)}, 错误: {e}")
+    return None
 
 
 class JsonLinesParser(BaseParser):
     """解析 JSON Lines 格式的输出"""
 
+    splittable = True
+
     # --- 关键修复：使用 AsyncGenerator ---
-    async def parse(self, raw_output: str, data_mapping: Dict[str, str]) -> AsyncGenerator[Dict[str, Any], None]:
+    async def parse_batches(self, raw_output: RawOutput, data_mapping: Dict[str, str], batch_size: int = DEFAULT_BATCH_SIZE) -> AsyncGenerator[List[Dict[str, Any]], None]:
     # --- 结束修复 ---
         """
         解析原始输出。data_mapping 定义了如何从 JSON 对象映射到目标字段。
         支持点符号, 例如: {'severity': 'info.severity'}
         如果 data_mapping 中某个值为 'self', 则将整个 JSON 对象映射到对应键。
+        每次产出最多 batch_size 条记录组成的列表 (逐条接口 parse() 由基类提供)。
         """
-        lines = raw_output.splitlines()
-        for line in lines:
-            stripped_line = line.strip()
-            if not stripped_line:
-                continue # 跳过空行
-
-            try:
-                data = json.loads(stripped_line)
-                if not isinstance(data, dict):
-                    print(f"警告: JsonLinesParser 跳过非字典行: {stripped_line}")
-                    continue
-
-                parsed_record: Dict[str, Any] = {}
-                for target_field, source_path in data_mapping.items():
-                    if source_path == "self":
-                        parsed_record[target_field] = data
-                    else:
-                        value = _get_nested_value(data, source_path)
-                        if value is not None: 
-                            parsed_record[target_field] = value
-                
-                if parsed_record: 
-                    yield parsed_record
-
-            except JSONDecodeError:
-                print(f"警告: JsonLinesParser 无法解析 JSON 行: {stripped_line}")
-            except Exception as e:
-                print(f"错误: JsonLinesParser 在处理行时出错: {stripped_line}, 错误: {e}")
-            
-            await asyncio.sleep(0)
\ No newline at end of file
+        mapping = compile_mapping(data_mapping)
+        batch: List[Dict[str, Any]] = []
+        yielder = LoopYielder()
+        async for line in iter_raw_lines(raw_output):
+            record = _parse_line(line, mapping)
+            if record:
+                batch.append(record)
+                if len(batch) >= batch_size:
+                    yield batch
+                    batch = []
+            # 按行数/时间节流地让出事件循环
+            await yielder.tick()
+        if batch:
+            yield batch
+
+    def parse_file(self, path: str, data_mapping: Dict[str, str], start: int = 0, end: Optional[int] = None) -> List[Dict[str, Any]]:
+        mapping = compile_mapping(data_mapping)
+        records: List[Dict[str, Any]] = []
+        for line in read_line_range(path, start, end):
+            record = _parse_line(line, mapping)
+            if record:
+                records.append(record)
+        return records
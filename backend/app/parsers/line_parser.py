@@ -3,37 +3,59 @@
 通用行解析器 (Line Parser)。
 处理每行代表一个值的简单文本输出。
 """
-import asyncio
 # --- 关键修复：导入 AsyncGenerator ---
-from typing import List, Dict, Any, AsyncGenerator
+from typing import List, Dict, Any, AsyncGenerator, Optional
 # --- 结束修复 ---
-from .base_parser import BaseParser
+from .base_parser import BaseParser, DEFAULT_BATCH_SIZE, LoopYielder, RawOutput, iter_lines, read_line_range
+
+def _find_mapping_field(data_mapping: Dict[str, str]) -> Optional[str]:
+    """找到 data_mapping 中值为 "self" 的键"""
+    for key, value in data_mapping.items():
+        if value == "self":
+            return key
+    print("警告: LineParser 的 data_mapping 未找到值为 'self' 的键。无法解析。")
+    return None
+
 
 class LineParser(BaseParser):
     """解析每行一个值的文本输出"""
 
+    splittable = True
+
     # --- 关键修复：使用 AsyncGenerator ---
-    async def parse(self, raw_output: str, data_mapping: Dict[str, str]) -> AsyncGenerator[Dict[str, Any], None]:
+    async def parse_batches(self, raw_output: RawOutput, data_mapping: Dict[str, str], batch_size: int = DEFAULT_BATCH_SIZE) -> AsyncGenerator[List[Dict[str, Any]], None]:
     # --- 结束修复 ---
         """
         解析原始输出。data_mapping 应该包含一个键, 其值为 "self",
         表示这一行本身应该映射到哪个字段。
         例如: {'hostname': 'self'}
+        每次产出最多 batch_size 条记录组成的列表 (逐条接口 parse() 由基类提供)。
         """
-        mapping_field = None
-        for key, value in data_mapping.items():
-            if value == "self":
-                mapping_field = key
-                break
-        
+        mapping_field = _find_mapping_field(data_mapping)
         if not mapping_field:
-            print("警告: LineParser 的 data_mapping 未找到值为 'self' 的键。无法解析。")
             return # 无法解析则直接返回
 
-        lines = raw_output.splitlines()
-        for line in lines:
+        batch: List[Dict[str, Any]] = []
+        yielder = LoopYielder()
+        async for line in iter_lines(raw_output):
             stripped_line = line.strip()
             if stripped_line: # 忽略空行
-                yield {mapping_field: stripped_line}
-            # 在处理大量行时给 asyncio 一个喘息的机会
-            await asyncio.sleep(0)
\ No newline at end of file
+                batch.append({mapping_field: stripped_line})
+                if len(batch) >= batch_size:
+                    yield batch
+                    batch = []
+            # 在处理大量行时给 asyncio 一个喘息的机会 (按行数/时间节流)
+            await yielder.tick()
+        if batch:
+            yield batch
+
+    def parse_file(self, path: str, data_mapping: Dict[str, str], start: int = 0, end: Optional[int] = None) -> List[Dict[str, Any]]:
+        mapping_field = _find_mapping_field(data_mapping)
+        if not mapping_field:
+            return []
+        records: List[Dict[str, Any]] = []
+        for line in read_line_range(path, start, end):
+            stripped_line = line.decode('utf-8', errors='ignore').strip()
+            if stripped_line:
+                records.append({mapping_field: stripped_line})
+        return records
@@ -1,18 +1,130 @@
 # backend/app/parsers/nmap_parser.py
+import mmap
+import re
 import xml.etree.ElementTree as ET
-from typing import Dict, Any, AsyncGenerator
-from .base_parser import BaseParser
+from typing import Dict, Any, AsyncGenerator, List, Optional, Union
+from .base_parser import BaseParser, CHUNK_SIZE, DEFAULT_BATCH_SIZE, RawOutput, iter_chunks, open_mmap
+
+# Nmap XML 文档的起始标签，之前的内容 (警告信息等) 全部丢弃
+NMAPRUN_TAG = b'<nmaprun'
+NMAPRUN_END_TAG = b'</nmaprun>'
+# <host> 的起始标签 (不匹配 <hostnames> / <hosthint>)；属性值中的 "<" 必须转义，因此不会误匹配
+HOST_START = re.compile(rb'<host[\s>]')
+
+
+def _records_from_host(host: ET.Element) -> List[Dict[str, Any]]:
+    """从一个已闭合的 <host> 元素中提取所有开放端口记录"""
+    records: List[Dict[str, Any]] = []
+
+    # 获取 IP 地址
+    address = host.find("address[@addrtype='ipv4']")
+    if address is None:
+        return records
+    ip_addr = address.get('addr')
+
+    # 检查主机状态
+    status = host.find('status')
+    if status is None or status.get('state') != 'up':
+        return records
+
+    # 遍历 <ports> 下的 <port>
+    ports = host.find('ports')
+    if ports is None:
+        return records
+
+    for port in ports.findall('port'):
+        state = port.find('state')
+        if state is None or state.get('state') != 'open':
+            continue
+
+        port_id = int(port.get('portid'))
+        protocol = port.get('protocol')
+
+        service_elem = port.find('service')
+        service_name = service_elem.get('name') if service_elem is not None else "unknown"
+        product = service_elem.get('product') if service_elem is not None else None
+        version = service_elem.get('version') if service_elem is not None else None
+
+        # 构建返回字典
+        records.append({
+            "ip": ip_addr,
+            "port": port_id,
+            "protocol": protocol,
+            "service": service_name,
+            "product": product,
+            "version": version
+        })
+    return records
+
+
+class NmapStreamParser:
+    """
+    Nmap XML 的增量解析状态机 (同步实现)。
+    每次 feed() 一个字节块，返回期间闭合的 <host> 中的端口记录；
+    处理完的 <host> 会立即从树中清除，内存占用只与单个主机的大小有关。
+    """
+
+    def __init__(self):
+        self._parser = ET.XMLPullParser(events=("start", "end"))
+        self._root: Optional[ET.Element] = None
+        self._started = False
+        self._preamble = b""
+
+    def feed(self, chunk: bytes) -> List[Dict[str, Any]]:
+        if not self._started:
+            # 跳过 <nmaprun 之前的非 XML 头部 (起始标签可能跨块，先暂存)
+            self._preamble += chunk
+            xml_start = self._preamble.find(NMAPRUN_TAG)
+            if xml_start == -1:
+                self._preamble = self._preamble[-(len(NMAPRUN_TAG) - 1):]
+                return []
+            chunk = self._preamble[xml_start:]
+            self._preamble = b""
+            self._started = True
+        self._parser.feed(chunk)
+        return self._collect()
+
+    def close(self) -> List[Dict[str, Any]]:
+        if not self._started:
+            return []
+        self._parser.close()
+        return self._collect()
+
+    def _collect(self) -> List[Dict[str, Any]]:
+        records: List[Dict[str, Any]] = []
+        for event, elem in self._parser.read_events():
+            if event == "start":
+                if self._root is None:
+                    self._root = elem
+            elif elem.tag == 'host':
+                records.extend(_records_from_host(elem))
+                # 释放已处理的节点: <host> 是 <nmaprun> 的直接子节点，
+                # 此时根节点下的其它子节点也都已闭合，可以整体清空
+                self._root.clear()
+        return records
+
+
+def _host_start(buffer: Union[bytes, mmap.mmap], pos: int) -> Optional[int]:
+    """pos 及之后第一个 <host> 起始标签的位置"""
+    match = HOST_START.search(buffer, pos)
+    return match.start() if match else None
+
 
 class NmapXmlParser(BaseParser):
     """
     解析 Nmap 的 XML 输出 (-oX)。
     提取主机 IP、开放端口、服务名称等信息。
+    进程池解析时按 <host> 起始标签切分: 每段只解析起始于该字节区间的主机。
     """
 
-    async def parse(self, raw_output: str, data_mapping: Dict[str, str]) -> AsyncGenerator[Dict[str, Any], None]:
+    splittable = True
+
+    async def parse_batches(self, raw_output: RawOutput, data_mapping: Dict[str, str], batch_size: int = DEFAULT_BATCH_SIZE) -> AsyncGenerator[List[Dict[str, Any]], None]:
         """
-        Nmap XML 解析逻辑。
+        Nmap XML 解析逻辑 (增量)。
+        <host> 元素闭合后其端口立即进入当前批次，支持 nmap 仍在运行时的流式输入。
         Yields:
+            最多 batch_size 条端口记录组成的列表，每条形如
             {
                 "ip": "192.168.1.1",
                 "port": 80,
@@ -22,57 +134,53 @@ class NmapXmlParser(BaseParser):
                 "version": "1.18.0"
             }
         """
+        stream_parser = NmapStreamParser()
+        batch: List[Dict[str, Any]] = []
         try:
-            # 移除可能的非 XML 头部干扰
-            xml_start = raw_output.find('<nmaprun')
-            if xml_start == -1:
-                return
-            clean_xml = raw_output[xml_start:]
-            
-            root = ET.fromstring(clean_xml)
-
-            # 遍历所有 <host> 节点
-            for host in root.findall('host'):
-                # 获取 IP 地址
-                address = host.find("address[@addrtype='ipv4']")
-                if address is None:
-                    continue
-                ip_addr = address.get('addr')
-
-                # 检查主机状态
-                status = host.find('status')
-                if status is None or status.get('state') != 'up':
-                    continue
-
-                # 遍历 <ports> 下的 <port>
-                ports = host.find('ports')
-                if ports is None:
-                    continue
-
-                for port in ports.findall('port'):
-                    state = port.find('state')
-                    if state is None or state.get('state') != 'open':
-                        continue
-
-                    port_id = int(port.get('portid'))
-                    protocol = port.get('protocol')
-                    
-                    service_elem = port.find('service')
-                    service_name = service_elem.get('name') if service_elem is not None else "unknown"
-                    product = service_elem.get('product') if service_elem is not None else None
-                    version = service_elem.get('version') if service_elem is not None else None
-
-                    # 构建返回字典
-                    yield {
-                        "ip": ip_addr,
-                        "port": port_id,
-                        "protocol": protocol,
-                        "service": service_name,
-                        "product": product,
-                        "version": version
-                    }
+            async for chunk in iter_chunks(raw_output):
+                batch.extend(stream_parser.feed(chunk))
+                # 每读一块就把攒满的批次交出去 (流式输入时一块通常只含少量主机)
+                while len(batch) >= batch_size:
+                    yield batch[:batch_size]
+                    batch = batch[batch_size:]
+            batch.extend(stream_parser.close())
 
         except ET.ParseError as e:
+            # 输出被截断 (如 nmap 被中断) 时，已闭合主机的端口仍会在下面产出
             print(f"NmapXmlParser XML 解析错误: {e}")
         except Exception as e:
-            print(f"NmapXmlParser 未知错误: {e}")
\ No newline at end of file
+            print(f"NmapXmlParser 未知错误: {e}")
+
+        while batch:
+            yield batch[:batch_size]
+            batch = batch[batch_size:]
+
+    def parse_file(self, path: str, data_mapping: Dict[str, str], start: int = 0, end: Optional[int] = None) -> List[Dict[str, Any]]:
+        """
+        解析起始于 [start, end) 字节区间的 <host> (跨越 end 的主机属于本段)。
+        这些主机在文件中是连续的一段，套上 <nmaprun> 根节点后交给增量解析器，
+        相邻区间拼起来恰好覆盖每个主机一次，段的大小 (而不是整个文件) 决定返回列表的大小。
+        """
+        stream_parser = NmapStreamParser()
+        records: List[Dict[str, Any]] = []
+        try:
+            with open_mmap(path) as mapped:
+                size = len(mapped)
+                end = size if end is None else min(end, size)
+                first = _host_start(mapped, start)
+                if first is None or first >= end:
+                    return records
+                stop = _host_start(mapped, end)
+                if stop is None:
+                    # 最后一段: 到 </nmaprun> 为止 (输出被截断时到文件末尾)
+                    stop = mapped.rfind(NMAPRUN_END_TAG, first)
+                    stop = size if stop == -1 else stop
+                stream_parser.feed(NMAPRUN_TAG + b'>')
+                for offset in range(first, stop, CHUNK_SIZE):
+                    records.extend(stream_parser.feed(mapped[offset:min(offset + CHUNK_SIZE, stop)]))
+                records.extend(stream_parser.feed(NMAPRUN_END_TAG))
+            records.extend(stream_parser.close())
+        except ET.ParseError as e:
+            # 截断的最后一个主机被丢弃，已闭合主机的端口保留
+            print(f"NmapXmlParser XML 解析错误: {e}")
+        return records
@@ -0,0 +1,80 @@
+# backend/app/parsers/process_pool.py
+"""
+进程池解析 (offload)。
+超大输出 (几百 MB 的 Nmap XML、上百万行的 JSONL) 在 worker 的事件循环里解析会卡住同进程的其它任务。
+对在 scanners.yaml 中声明 parse_mode: "process" 的配置，输出先落盘，
+再把文件路径交给 ProcessPoolExecutor 的子进程解析，主进程只接收解析好的记录批次。
+"""
+import asyncio
+import multiprocessing
+import os
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, AsyncGenerator, Dict, List, Optional, Type
+
+from .base_parser import BaseParser, DEFAULT_BATCH_SIZE
+
+# 进程池大小 (2c/4g 的机器建议 1~2)
+PARSER_POOL_WORKERS = int(os.getenv("PARSER_POOL_WORKERS", 2))
+# 可切分格式每个子任务解析的字节数
+PARSER_SEGMENT_BYTES = int(os.getenv("PARSER_SEGMENT_BYTES", 8 * 1024 * 1024))
+
+_executor: Optional[ProcessPoolExecutor] = None
+
+
+def get_executor() -> ProcessPoolExecutor:
+    """懒加载全局进程池 (使用 spawn，避免 fork 带上事件循环和数据库连接)"""
+    global _executor
+    if _executor is None:
+        _executor = ProcessPoolExecutor(
+            max_workers=PARSER_POOL_WORKERS,
+            mp_context=multiprocessing.get_context("spawn"),
+        )
+    return _executor
+
+
+def shutdown_executor() -> None:
+    """关闭进程池 (在 worker 关闭时调用)"""
+    global _executor
+    if _executor is not None:
+        _executor.shutdown(wait=False, cancel_futures=True)
+        _executor = None
+
+
+def _parse_segment(parser_class: Type[BaseParser], path: str, data_mapping: Dict[str, str], start: int, end: Optional[int]) -> List[Dict[str, Any]]:
+    """在子进程中执行: 解析文件的一段"""
+    return parser_class().parse_file(path, data_mapping, start, end)
+
+
+async def parse_file_batches(parser_class: Type[BaseParser], path: str, data_mapping: Dict[str, str], batch_size: int = DEFAULT_BATCH_SIZE) -> AsyncGenerator[List[Dict[str, Any]], None]:
+    """
+    在进程池中解析文件，按原始顺序产出最多 batch_size 条记录组成的列表。
+    可切分的格式按 PARSER_SEGMENT_BYTES 分段，同时最多有 PARSER_POOL_WORKERS 段在解析，
+    主进程的内存占用与段大小相关，而与文件总大小无关。
+    """
+    loop = asyncio.get_running_loop()
+    executor = get_executor()
+
+    size = os.path.getsize(path)
+    if parser_class.splittable:
+        segments = [(start, min(start + PARSER_SEGMENT_BYTES, size)) for start in range(0, size, PARSER_SEGMENT_BYTES)]
+    else:
+        segments = [(0, None)] if size else []
+
+    in_flight: deque = deque()
+    pending = iter(segments)
+    try:
+        while True:
+            while len(in_flight) < PARSER_POOL_WORKERS:
+                segment = next(pending, None)
+                if segment is None:
+                    break
+                in_flight.append(loop.run_in_executor(executor, _parse_segment, parser_class, path, data_mapping, *segment))
+            if not in_flight:
+                break
+            records = await in_flight.popleft()
+            for start in range(0, len(records), batch_size):
+                yield records[start:start + batch_size]
+    finally:
+        for future in in_flight:
+            future.cancel()
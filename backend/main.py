@@ -8,7 +8,7 @@ from fastapi.middleware.cors import CORSMiddleware
 from fastapi.responses import FileResponse
 from fastapi.staticfiles import StaticFiles
 from app.data.session import engine
-from app.data.base import Base
+from app.data.migrations import SchemaOutdated, check_schema_revision
 
 # 导入我们刚刚创建的“主 API 路由器”
 from app.api.api_router import api_router
@@ -42,16 +42,18 @@ FRONTEND_DIST = BASE_DIR / "frontend" / "dist"
 # 2. 定义一个“启动”事件 (保持不变)
 @app.on_event("startup")
 async def on_startup():
-    print("FastAPI 启动中，正在尝试连接数据库并创建表...")
+    print("FastAPI 启动中，正在检查数据库结构版本...")
+    # 表结构由 Alembic 迁移管理 (alembic upgrade head)，这里只比对迁移版本
     # 简单重试，防止数据库尚未就绪时立即报错
     retry = 0
     last_err = None
     while retry < 5:
         try:
-            async with engine.begin() as conn:
-                await conn.run_sync(Base.metadata.create_all)
-            print("数据库表检查/创建完毕。")
+            revision = await check_schema_revision(engine)
+            print(f"数据库结构版本 {revision}，检查完毕。")
             break
+        except SchemaOutdated:
+            raise
         except Exception as e:
             last_err = e
             retry += 1
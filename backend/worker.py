@@ -4,23 +4,82 @@ ARQ 扫描工人 (Worker)。
 这个进程会连接到 Redis, 监听任务队列, 并执行扫描任务。
 """
 import asyncio
+import os
+from typing import Optional
+
+from arq import cron
 
 # 导入 ARQ 配置 (Redis 设置, 队列名, 任务名)
 from app.core.arq_config import redis_settings, ARQ_QUEUE_NAME, TASK_RUN_SCAN
 
 # 导入我们真正的任务执行逻辑
 from app.core.orchestrator import run_scan_task_logic
+from app.core.scheduler import AdmissionDeferred, running_snapshot
+from app.core.dispatch import dispatch_loop, enqueue_scan_task, release_inflight
+from app.core.reaper import reap_stale_tasks, resumes_from_artifact
+from app.core.backfill import backfill_owners
+from app.core.entity_cache import invalidation_listener
+from app.data import models
+from app.data.session import AsyncSessionLocal
+
+# 单个 job 的最长执行时间 (秒)，即 ARQ 的 job_timeout
+JOB_TIMEOUT = int(os.getenv("WORKER_JOB_TIMEOUT", 24 * 3600))
+# 任务自己的时限比 job_timeout 提前这么多秒到期: 到期时终止工具、任务标记为失败并释放项目的在途名额。
+# 若等到 ARQ 的 job_timeout，job 被直接取消且不会重新执行，任务会停在 pending 而没有对应的 job
+JOB_TIMEOUT_MARGIN = int(os.getenv("WORKER_JOB_TIMEOUT_MARGIN", 60))
 
 # --- ARQ 任务函数 ---
 # 这个函数的名字必须和 arq_config.py 中定义的 TASK_RUN_SCAN 匹配
-async def run_scan_task(ctx, task_id: int):
+async def run_scan_task(ctx, task_id: int, reingest: bool = False, project_id: Optional[int] = None):
     """
     ARQ 调用这个函数来执行扫描任务。
-    'ctx' 是 ARQ 提供的上下文信息 (我们这里暂时不用)。
+    'ctx' 是 ARQ 提供的上下文信息 (用到其中的 Redis 连接)。
     'task_id' 是我们从 API 推送过来的数据库任务 ID。
+    'reingest' 为 True 时只从输出存档重新入库，不执行扫描工具。
+    'project_id' 由分发循环填入，任务结束后释放该项目的在途名额。
     """
-    print(f"Worker 收到任务: {TASK_RUN_SCAN}, task_id={task_id}")
-    await run_scan_task_logic(task_id)
+    print(f"Worker 收到任务: {TASK_RUN_SCAN}, task_id={task_id}, reingest={reingest}")
+    if not reingest and ctx.get("job_try", 1) > 1:
+        # ARQ 重新执行被中断 (worker 退出) 的 job: 与回收器相同，输出存档完整时从检查点续传而不重新运行工具
+        reingest = await resumes_from_artifact(task_id)
+    will_rerun = False  # job 会被 ARQ 再次执行时保留项目的在途名额
+    try:
+        await run_scan_task_logic(task_id, reingest=reingest, deadline=max(JOB_TIMEOUT - JOB_TIMEOUT_MARGIN, 1))
+    except AdmissionDeferred as e:
+        # 准入未通过: 任务保持 pending，延后重新入队，空出的槽位留给其它 (轻量) 任务。
+        # 不使用 arq.Retry: Retry 每次都计入 max_tries，排队久的任务达到上限后 job 会被丢弃，任务永远停在 pending；
+        # 延后的任务回到自己的命名队列，到期后与其它任务一起按权重、项目份额和优先级重新分发
+        print(f"任务 {task_id} 延后 {e.delay:.0f}s: {e.reason} (运行中: {running_snapshot()})")
+        await _requeue_deferred(ctx["redis"], task_id, reingest, e.delay)
+    except asyncio.CancelledError:
+        # worker 排空超时被中断: 任务已恢复为 pending，ARQ 会把 job 交给其它 worker 重新执行
+        # (超过任务时限不会走到这里: run_scan_task_logic 在 job_timeout 之前自行中止并标记失败，正常返回)
+        will_rerun = True
+        raise
+    finally:
+        # 执行、失败和延后都释放项目的在途名额 (延后的任务重新分发时再占用)；ARQ 会重新执行的 job 保留名额
+        if project_id is not None and not will_rerun:
+            await release_inflight(ctx["redis"], project_id, task_id)
+
+
+async def _requeue_deferred(redis, task_id: int, reingest: bool, delay: float) -> None:
+    """把准入被延后的任务放回它的命名队列 (所属项目的子队列)，delay 秒后才参与分发"""
+    async with AsyncSessionLocal() as db:
+        task = await db.get(models.ScanTask, task_id)
+        if task is None or task.status != "pending":
+            return
+        asset = await db.get(models.Asset, task.asset_id)
+    await enqueue_scan_task(redis, task, asset.project_id if asset else None, reingest=reingest, delay=delay)
+
+
+async def reap_stale_tasks_job(ctx):
+    """定时回收心跳超时的 running 任务 (worker 崩溃 / 容器被强制重启后遗留的任务)"""
+    await reap_stale_tasks()
+
+
+async def backfill_owners_job(ctx):
+    """补齐旧数据中端口 / Web 服务 / 漏洞的归属列 (已补齐时只有几条空查询)"""
+    await backfill_owners()
 
 
 # --- ARQ Worker 设置 ---
@@ -32,14 +91,23 @@ class WorkerSettings:
     # 1. Redis 连接设置
     redis_settings = redis_settings
 
-    # 2. 要监听的队列名称 (可以监听多个)
+    # 2. 要监听的队列名称
+    #    API 把任务放进各命名队列 (app/core/dispatch.py)，由上面的分发循环按权重转入这个队列
     queue_name = ARQ_QUEUE_NAME
 
     # 3. Worker 可以执行的任务函数列表
     functions = [run_scan_task]
 
+    #    每分钟回收一次心跳超时的任务 (多个 worker 时 ARQ 保证同一时刻只有一个执行)
+    #    归属列回填: 启动时及每天 04:00 各执行一次
+    cron_jobs = [
+        cron(reap_stale_tasks_job, run_at_startup=True),
+        cron(backfill_owners_job, hour={4}, minute={0}, run_at_startup=True),
+    ]
+
     # 4. Worker 启动时执行的函数 (可选)
-    async def startup(ctx):
+    #    ARQ 只认 on_startup / on_shutdown 这两个名字 (arq.worker.get_kwargs 按 Worker 的参数名取值)
+    async def on_startup(ctx):
         print("ARQ Worker 启动中...")
         # 可以在这里预加载配置或初始化资源
         from app.core.config_loader import load_scan_configs
@@ -48,25 +116,49 @@ class WorkerSettings:
             print("扫描配置已成功预加载。")
         except Exception as e:
             print(f"警告: Worker 启动时加载扫描配置失败: {e}")
+        # 启动分发循环: 按权重从 passive / active-light / active-heavy 等命名队列向 ARQ 队列补充任务
+        ctx["dispatcher"] = asyncio.create_task(dispatch_loop(ctx["redis"]))
+        # 订阅实体删除广播，及时清空 worker 内的实体 ID 缓存
+        ctx["entity_cache_listener"] = asyncio.create_task(invalidation_listener(ctx["redis"]))
         print("ARQ Worker 已准备好接收任务。")
 
     # 5. Worker 关闭时执行的函数 (可选)
-    async def shutdown(ctx):
+    async def on_shutdown(ctx):
         print("ARQ Worker 关闭中...")
+        # 停止分发循环与实体缓存订阅
+        for name in ("dispatcher", "entity_cache_listener"):
+            background = ctx.get(name)
+            if background:
+                background.cancel()
+                try:
+                    await background
+                except asyncio.CancelledError:
+                    pass
+        # 关闭解析进程池 (如果启用过)
+        from app.parsers.process_pool import shutdown_executor
+        shutdown_executor()
+        # 关闭流水线转发使用的 ARQ 连接池
+        from app.core.arq_config import close_arq_pool
+        await close_arq_pool()
 
     # 6. --- 重要的并发限制 ---
     #    限制 worker 最多同时执行多少个任务 (保护 VPS 资源)
-    #    对于 2c/4g 的 VPS, 这个值需要谨慎设置, 例如 5 或 10
-    max_jobs = 5 
+    #    按 agent_type / 配置的并发上限和负载、内存准入由 app/core/scheduler.py 负责
+    #    (见 scanners.yaml 的 scheduler 条目)，重型扫描被限住时，空出的槽位由轻量的被动任务填充，
+    #    因此这里的总并发可以比单纯按重型任务估算时大一些
+    max_jobs = int(os.getenv("WORKER_MAX_JOBS", 10))
+
+    #    单个任务最大执行时间 (秒)。扫描工具本身的超时由 scanners.yaml 的 timeout (默认 SCAN_COMMAND_TIMEOUT) 控制，
+    #    超时后终止进程组并提交已解析的结果；这里只是兜底，需大于最长的工具超时加上解析入库的时间
+    #    (任务在此之前 JOB_TIMEOUT_MARGIN 秒自行中止，见 run_scan_task)
+    job_timeout = JOB_TIMEOUT
 
-    #    (未来可以根据任务类型进行更精细的限流, 如此处注释掉的示例)
-    # job_timeout = 3_600 # 单个任务最大执行时间 (秒), 例如 1 小时
-    # max_tries = 3 # 任务失败后的最大重试次数
+    # 7. --- 优雅退出 (滚动部署) ---
+    #    收到 SIGTERM / SIGINT 后不再取新 job，等待运行中的任务最多 job_completion_wait 秒；
+    #    仍未结束的任务会被取消: 终止工具进程组，保留已提交的检查点，任务恢复为 pending 并由其它 worker 重新执行。
+    #    容器的停止宽限期 (docker-compose 的 stop_grace_period) 需要大于这个值
+    job_completion_wait = int(os.getenv("WORKER_DRAIN_SECONDS", 120))
     # keep_result_forever = False # 不永久保留成功任务的结果在 Redis 中
-    # max_jobs_by_function_name = {
-    #     'run_scan_task': 5, # 默认并发
-    #     'run_screenshot_task': 2 # 截图任务并发限制为 2
-    # }
 
 # --- 如何运行这个 Worker ---
 # 你需要在 *另一个* 终端窗口 (与运行 uvicorn 的窗口分开)
@@ -45,13 +45,15 @@ export interface HostSummary {
   root_asset_id: number
 }
 
-export interface HostListResponse {
-  items: HostSummary[]
+export interface CursorPage<T> {
+  items: T[]
   next_cursor: number | null
   has_more: boolean
   limit: number
 }
 
+export type HostListResponse = CursorPage<HostSummary>
+
 export interface PortSummary {
   id: number
   ip: string
@@ -63,7 +65,7 @@ export interface HTTPServiceSummary {
   id: number
   url: string
   title?: string | null
-  tech?: string | null
+  tech?: string[] | Record<string, unknown> | null
   status?: number | null
 }
 
@@ -72,6 +74,9 @@ export interface VulnerabilitySummary {
   name: string
   severity: string
   url?: string | null
+  first_seen?: string | null
+  last_seen?: string | null
+  hit_count: number
 }
 
 export async function fetchScanConfigs() {
@@ -119,23 +124,23 @@ export async function fetchAssetHosts(
 
 export async function fetchAssetPorts(
   assetId: number,
-  params: { skip?: number; limit?: number } = {}
+  params: { limit?: number; cursor?: number | null; port?: number } = {}
 ) {
-  return request<PortSummary[]>(http.get(`/results/assets/${assetId}/ports`, { params }))
+  return request<CursorPage<PortSummary>>(http.get(`/results/assets/${assetId}/ports`, { params }))
 }
 
 export async function fetchAssetWeb(
   assetId: number,
-  params: { skip?: number; limit?: number } = {}
+  params: { limit?: number; cursor?: number | null; status_code?: number; tech?: string } = {}
 ) {
-  return request<HTTPServiceSummary[]>(http.get(`/results/assets/${assetId}/web`, { params }))
+  return request<CursorPage<HTTPServiceSummary>>(http.get(`/results/assets/${assetId}/web`, { params }))
 }
 
 export async function fetchAssetVulns(
   assetId: number,
-  params: { skip?: number; limit?: number } = {}
+  params: { limit?: number; cursor?: number | null; severity?: string } = {}
 ) {
-  return request<VulnerabilitySummary[]>(http.get(`/results/assets/${assetId}/vulns`, { params }))
+  return request<CursorPage<VulnerabilitySummary>>(http.get(`/results/assets/${assetId}/vulns`, { params }))
 }
 
 export async function listTasks(params: Record<string, unknown> = {}) {
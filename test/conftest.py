@@ -0,0 +1,101 @@
+# tests/conftest.py
+"""
+单元测试的公共配置。
+在仓库根目录运行: python -m pytest -q test
+需要数据库 / Redis 的测试在连接不上时自动跳过:
+  TEST_DATABASE_URL  测试用的 PostgreSQL (每次运行都会重建表结构，不要指向正式库)，
+                     例如 postgresql+asyncpg://postgres@localhost:5432/scan_test
+  Redis              沿用 REDIS_HOST / REDIS_PORT (默认 localhost:6379)
+"""
+import asyncio
+import os
+import sys
+import uuid
+
+import pytest
+
+BACKEND_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "backend")
+sys.path.insert(0, BACKEND_DIR)
+
+# app.data.session 在导入时按 DATABASE_URL 创建引擎，必须在导入 app 之前设置
+if os.getenv("TEST_DATABASE_URL"):
+    os.environ["DATABASE_URL"] = os.environ["TEST_DATABASE_URL"]
+
+# test_scan_flow.py 是针对运行中服务的端到端脚本 (python test/test_scan_flow.py)，不参与单元测试
+collect_ignore = ["test_scan_flow.py"]
+
+
+def run(coro):
+    """
+    在新的事件循环中执行协程 (测试不依赖 pytest-asyncio)。
+    数据库引擎的连接池与 ARQ 连接池都绑定在创建它们的事件循环上，结束前一并释放
+    """
+    async def main():
+        try:
+            return await coro
+        finally:
+            session = sys.modules.get("app.data.session")
+            if session is not None:
+                await session.engine.dispose()
+            arq_config = sys.modules.get("app.core.arq_config")
+            if arq_config is not None and arq_config.arq_pool is not None:
+                await arq_config.arq_pool.aclose()
+                arq_config.arq_pool = None
+
+    return asyncio.run(main())
+
+
+@pytest.fixture
+def database():
+    """重建表结构后返回 AsyncSessionLocal；未配置 TEST_DATABASE_URL 或连接失败时跳过"""
+    if not os.getenv("TEST_DATABASE_URL"):
+        pytest.skip("未设置 TEST_DATABASE_URL")
+    from app.core import entity_cache
+    from app.data import models  # noqa: F401  注册全部模型
+    from app.data.base import Base
+    from app.data.session import AsyncSessionLocal, engine
+
+    async def reset():
+        async with engine.begin() as conn:
+            await conn.run_sync(Base.metadata.drop_all)
+            await conn.run_sync(Base.metadata.create_all)
+
+    try:
+        run(reset())
+    except (OSError, ConnectionError) as e:
+        pytest.skip(f"测试数据库不可用: {e}")
+    # 表已重建，之前测试缓存的实体 ID 全部失效
+    entity_cache.clear_all()
+    return AsyncSessionLocal
+
+
+@pytest.fixture
+def redis_settings():
+    """可用的 Redis 连接设置；连接失败时跳过"""
+    import redis
+    from app.core import arq_config
+
+    settings = arq_config.redis_settings
+    try:
+        redis.Redis(host=settings.host, port=settings.port, db=settings.database).ping()
+    except redis.exceptions.ConnectionError as e:
+        pytest.skip(f"测试 Redis 不可用: {e}")
+    return settings
+
+
+@pytest.fixture
+def isolated_queues(redis_settings, monkeypatch):
+    """命名队列 / 延后集合 / 在途集合 / ARQ 队列使用本次测试独有的键，结束后删除；返回 redis_settings"""
+    import redis
+    from app.core import dispatch
+
+    prefix = f"test:{uuid.uuid4().hex}:"
+    monkeypatch.setattr(dispatch, "SCAN_QUEUE_PREFIX", f"{prefix}queue:")
+    monkeypatch.setattr(dispatch, "SCAN_DELAYED_KEY", f"{prefix}delayed")
+    monkeypatch.setattr(dispatch, "SCAN_INFLIGHT_PREFIX", f"{prefix}inflight:")
+    monkeypatch.setattr(dispatch, "ARQ_QUEUE_NAME", f"{prefix}arq")
+    yield redis_settings
+    client = redis.Redis(host=redis_settings.host, port=redis_settings.port, db=redis_settings.database)
+    keys = list(client.scan_iter(match=f"{prefix}*"))
+    if keys:
+        client.delete(*keys)
@@ -0,0 +1,94 @@
+# tests/test_assets_api.py
+"""触发扫描接口: 重复提交"""
+import httpx
+import pytest
+from fastapi import FastAPI
+
+from conftest import run
+
+CONFIG = {"config_name": "subfinder", "agent_type": "subdomain"}
+
+
+@pytest.fixture
+def assets_client(database, isolated_queues, monkeypatch):
+    """只挂载资产路由 (跳过认证) 的 ASGI 客户端工厂，任务推送到本次测试独有的队列；返回 (客户端工厂, 资产 ID)"""
+    from app.api import deps
+    from app.api.v1 import assets
+    from app.core import dispatch
+    from app.data import models
+
+    monkeypatch.setattr(assets, "get_scan_config_by_name", lambda name: CONFIG if name == CONFIG["config_name"] else None)
+    monkeypatch.setattr(dispatch, "get_scan_config_by_name", lambda name: CONFIG)
+
+    async def create_asset():
+        async with database() as db:
+            project = models.Project(name="p")
+            db.add(project)
+            await db.flush()
+            asset = models.Asset(name="example.com", type="domain", project_id=project.id)
+            db.add(asset)
+            await db.commit()
+            return asset.id
+
+    app = FastAPI()
+    app.include_router(assets.router)
+    app.dependency_overrides[deps.get_current_active_user] = lambda: None
+
+    def client():
+        return httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://test")
+
+    return client, run(create_asset())
+
+
+def _trigger(client_factory, asset_id):
+    async def post():
+        async with client_factory() as client:
+            response = await client.post(f"/assets/{asset_id}/scan", json={"config_name": CONFIG["config_name"]})
+            return response.status_code, response.json()
+
+    return run(post())
+
+
+async def _active_task_ids(session_factory, asset_id):
+    from sqlalchemy import select
+    from app.data import models
+
+    async with session_factory() as db:
+        result = await db.execute(
+            select(models.ScanTask.id).where(
+                models.ScanTask.asset_id == asset_id, models.ScanTask.status.in_(("pending", "running"))
+            )
+        )
+        return list(result.scalars())
+
+
+def test_duplicate_trigger_returns_the_active_task(database, assets_client):
+    client, asset_id = assets_client
+    status_code, created = _trigger(client, asset_id)
+    assert (status_code, created["status"]) == (202, "pending")
+
+    # 未结束时重复提交返回已有任务，不再创建
+    status_code, duplicate = _trigger(client, asset_id)
+    assert (status_code, duplicate["id"]) == (200, created["id"])
+    assert run(_active_task_ids(database, asset_id)) == [created["id"]]
+
+
+def test_concurrent_duplicate_falls_back_to_the_winning_task(database, assets_client, monkeypatch):
+    from app.api.v1 import assets
+
+    client, asset_id = assets_client
+    _, created = _trigger(client, asset_id)
+
+    # 模拟并发: 预先检查时另一个请求的任务还没提交，插入时才撞上 uq_scan_tasks_active
+    find_active_task = assets._find_active_task
+    calls = []
+
+    async def racing_find_active_task(db, *args):
+        calls.append(args)
+        return None if len(calls) == 1 else await find_active_task(db, *args)
+
+    monkeypatch.setattr(assets, "_find_active_task", racing_find_active_task)
+    status_code, duplicate = _trigger(client, asset_id)
+    assert (status_code, duplicate["id"]) == (200, created["id"])
+    assert len(calls) == 2
+    assert run(_active_task_ids(database, asset_id)) == [created["id"]]
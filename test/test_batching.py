@@ -0,0 +1,81 @@
+# tests/test_batching.py
+"""合并执行的认领与输出分发"""
+from app.core.batching import TaskDemux
+from app.data import models
+
+from conftest import run
+
+
+def _demux():
+    assets = {
+        1: models.Asset(id=1, name="Example.com", type="domain", project_id=1),
+        2: models.Asset(id=2, name="example.com", type="domain", project_id=1),
+        3: models.Asset(id=3, name="other.org", type="domain", project_id=1),
+    }
+    tasks = [
+        models.ScanTask(id=10, asset_id=1, config_name="subfinder"),
+        models.ScanTask(id=11, asset_id=2, config_name="subfinder"),
+        models.ScanTask(id=12, asset_id=3, config_name="subfinder", target="api.other.org"),
+    ]
+    return TaskDemux(tasks, assets, "input")
+
+
+def test_task_demux_targets_are_deduplicated_in_order():
+    # task.target 优先于资产名；大小写不同的原样保留 (由工具自己处理)
+    assert _demux().targets() == ["Example.com", "example.com", "api.other.org"]
+
+
+def test_task_demux_routes_records_to_every_owner():
+    demux = _demux()
+    routed = demux.split([
+        {"input": "EXAMPLE.COM.", "host": "a.example.com"},
+        {"input": " api.other.org", "host": "v1.api.other.org"},
+        {"input": "other.org", "host": "x.other.org"},
+        {"host": "no-input.example.com"},
+    ])
+    # 同名资产的任务都收到这条记录
+    assert [record["host"] for record in routed[10]] == ["a.example.com"]
+    assert routed[11] == routed[10]
+    assert [record["host"] for record in routed[12]] == ["v1.api.other.org"]
+    assert demux.unmatched_count == 2
+    demux.split([{"input": "unknown.net"}])
+    assert demux.unmatched_count == 3
+
+
+def test_claim_coalesced_tasks_stays_within_project_parent_and_priority(database):
+    from app.core.batching import claim_coalesced_tasks
+
+    async def scenario():
+        async with database() as db:
+            projects = [models.Project(name="a"), models.Project(name="b")]
+            db.add_all(projects)
+            await db.flush()
+            assets = [
+                models.Asset(name=f"{name}.example.com", type="domain", project_id=project.id)
+                for project, name in (
+                    (projects[0], "a1"), (projects[0], "a2"), (projects[0], "a3"), (projects[1], "b1"), (projects[0], "a4")
+                )
+            ]
+            db.add_all(assets)
+            await db.flush()
+            parent = models.ScanTask(asset_id=assets[2].id, config_name="shard-parent", status="running")
+            db.add(parent)
+            await db.flush()
+            tasks = [
+                models.ScanTask(asset_id=assets[0].id, config_name="httpx", status="pending"),  # leader
+                models.ScanTask(asset_id=assets[1].id, config_name="httpx", status="pending"),
+                models.ScanTask(asset_id=assets[2].id, config_name="httpx", status="pending",
+                                parent_task_id=parent.id, target="10.0.0.0/24"),
+                models.ScanTask(asset_id=assets[3].id, config_name="httpx", status="pending"),
+                models.ScanTask(asset_id=assets[1].id, config_name="nuclei", status="pending"),
+                models.ScanTask(asset_id=assets[4].id, config_name="httpx", status="pending", priority=9),
+            ]
+            db.add_all(tasks)
+            await db.commit()
+            followers = await claim_coalesced_tasks(db, tasks[0], 10)
+            await db.commit()
+            return [task.id for task in tasks], [(f.id, f.status, f.batch_leader_id) for f in followers]
+
+    ids, followers = run(scenario())
+    # 其它项目、其它父任务 (分片子任务)、其它配置、其它优先级的任务都不被认领
+    assert followers == [(ids[1], "running", ids[0])]
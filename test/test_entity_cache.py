@@ -0,0 +1,73 @@
+# tests/test_entity_cache.py
+"""worker 实体 ID 缓存的跨进程失效"""
+import os
+import subprocess
+import sys
+import textwrap
+
+from conftest import BACKEND_DIR, run
+
+# 模拟 worker: 启动失效订阅，缓存一个主机 ID，等待 API 进程的删除广播把它清掉
+WORKER_SCRIPT = textwrap.dedent("""
+    import asyncio, sys
+    from app.core import entity_cache
+    from app.core.arq_config import get_arq_pool
+
+    async def main(hostname, host_id):
+        redis = await get_arq_pool()
+        listener = asyncio.create_task(entity_cache.invalidation_listener(redis))
+        while entity_cache._generation is None:
+            await asyncio.sleep(0.05)
+        entity_cache.host_ids.put(hostname, host_id)
+        print("ready", flush=True)
+        for _ in range(200):
+            if entity_cache.host_ids.get(hostname) is None:
+                print("cleared", flush=True)
+                break
+            await asyncio.sleep(0.05)
+        else:
+            print("stale", flush=True)
+        listener.cancel()
+
+    asyncio.run(main(sys.argv[1], int(sys.argv[2])))
+""")
+
+
+async def _seed_host(session_factory):
+    from app.data import models
+
+    async with session_factory() as db:
+        project = models.Project(name="p")
+        db.add(project)
+        await db.flush()
+        asset = models.Asset(name="example.com", type="domain", project_id=project.id)
+        db.add(asset)
+        await db.flush()
+        host = models.Host(hostname="a.example.com", project_id=project.id, root_asset_id=asset.id)
+        db.add(host)
+        await db.commit()
+        return asset.id, host.id
+
+
+async def _delete_host(session_factory, asset_id, host_id):
+    from app.api.v1.results import delete_host_for_asset
+
+    async with session_factory() as db:
+        await delete_host_for_asset(asset_id, host_id, db=db, current_user=None)
+
+
+def test_delete_host_clears_other_process_cache(database, redis_settings):
+    asset_id, host_id = run(_seed_host(database))
+    worker = subprocess.Popen(
+        [sys.executable, "-c", WORKER_SCRIPT, "a.example.com", str(host_id)],
+        cwd=BACKEND_DIR, env={**os.environ, "PYTHONPATH": BACKEND_DIR},
+        stdout=subprocess.PIPE, text=True,
+    )
+    try:
+        assert worker.stdout.readline().strip() == "ready"
+        run(_delete_host(database, asset_id, host_id))
+        output, _ = worker.communicate(timeout=30)
+        assert output.splitlines()[-1] == "cleared"
+    finally:
+        worker.kill()
+        worker.wait()
@@ -0,0 +1,291 @@
+# tests/test_ingestion.py
+"""入库辅助函数"""
+import importlib.util
+import os
+
+from sqlalchemy import event, func, select, text
+
+from conftest import BACKEND_DIR, run
+
+from app.core.ingestion import AssetServiceIndex, normalize_service_url, vulnerability_fingerprint
+
+
+async def _seed_asset(db):
+    await db.execute(text("INSERT INTO projects (id, name) VALUES (1, 'p')"))
+    await db.execute(text("INSERT INTO assets (id, name, type, project_id) VALUES (1, 'example.com', 'domain', 1)"))
+    await db.execute(text("INSERT INTO scan_tasks (id, asset_id, config_name, status) VALUES (1, 1, 'subfinder', 'running')"))
+    await db.commit()
+
+
+def test_subdomain_ingestor_upserts_batches_with_constant_statements(database):
+    from app.core.ingestion import SubdomainIngestor
+    from app.data import models
+    from app.data.session import engine
+
+    records = [{"host": f"h{i}.example.com", "ip": f"10.0.0.{i % 5}"} for i in range(40)]
+    records += [
+        {"host": "H1.example.com.", "ips": ["10.0.0.1", "10.0.0.9"]},  # 大小写 / 末尾的点归一化后与已有主机重复
+        {"ip": "10.0.0.8"},  # 没有主机名: 计入处理条数，不入库
+    ]
+
+    async def scenario():
+        async with database() as db:
+            await _seed_asset(db)
+            await db.execute(text(
+                "INSERT INTO hosts (hostname, status, is_bookmarked, project_id, root_asset_id) "
+                "VALUES ('h0.example.com', 'discovered', false, 1, 1)"
+            ))
+            await db.commit()
+            task = await db.get(models.ScanTask, 1)
+            asset = await db.get(models.Asset, 1)
+
+            statements = []
+            listener = lambda *args: statements.append(args[2])  # noqa: E731
+            event.listen(engine.sync_engine, "before_cursor_execute", listener)
+            try:
+                ingestor = SubdomainIngestor(db, task, asset, batch_size=len(records))
+                for res in records:
+                    await ingestor.add(res)
+                await ingestor.flush()
+            finally:
+                event.remove(engine.sync_engine, "before_cursor_execute", listener)
+            await db.commit()
+
+            counts = {
+                model.__tablename__: (await db.execute(select(func.count()).select_from(model))).scalar()
+                for model in (models.Host, models.IPAddress, models.DNSRecord, models.RawScanResult)
+            }
+            return ingestor, statements, counts
+
+    ingestor, statements, counts = run(scenario())
+    assert ingestor.processed_count == len(records)
+    # 一批: Host / IP 各一条 INSERT + 补查已存在的行，DNS 一条 INSERT ... SELECT，原始结果一次 executemany
+    assert len(statements) <= 6
+    assert counts == {"hosts": 40, "ip_addresses": 6, "dns_records": 41, "raw_scan_results": 41}
+    # 新增 = 39 个主机 + 6 个 IP + 41 条 DNS 记录 (h0 已存在，h1 -> 10.0.0.1 重复)
+    assert ingestor.results_count == 39 + 6 + 41
+
+
+def test_subdomain_ingestor_is_idempotent_across_runs(database):
+    from app.core.ingestion import SubdomainIngestor
+    from app.data import models
+
+    records = [{"host": f"h{i}.example.com", "ip": "192.0.2.1"} for i in range(10)]
+
+    async def ingest_once():
+        async with database() as db:
+            task = await db.get(models.ScanTask, 1)
+            asset = await db.get(models.Asset, 1)
+            ingestor = SubdomainIngestor(db, task, asset, batch_size=4)
+            for res in records:
+                await ingestor.add(res)
+            await ingestor.flush()
+            await db.commit()
+            dns = (await db.execute(select(func.count(models.DNSRecord.id)))).scalar()
+            return ingestor.results_count, dns
+
+    async def seed():
+        async with database() as db:
+            await _seed_asset(db)
+
+    run(seed())
+    assert run(ingest_once()) == (10 + 1 + 10, 10)
+    # 再次入库同样的结果: 没有新增，DNS 记录不重复
+    assert run(ingest_once()) == (0, 10)
+
+FINGERPRINT_CASES = [
+    # (template_id, vulnerability_name, matched_at, details)
+    ("cve-2021-44228", "Log4Shell", "https://a.example.com/login", {"matcher_name": "dns", "extracted_results": ["b", "a", "C"]}),
+    ("cve-2021-44228", "Log4Shell", "https://a.example.com/login", {"matcher_name": "dns", "extracted_results": ["a", "C", "b"]}),
+    (None, "Exposed panel", "https://a.example.com", {}),
+    ("", "Exposed panel", None, {"extracted_results": []}),
+    ("tech-detect", "Tech", "https://a.example.com", {"matcher_name": "nginx", "extracted_results": "1.25.3"}),
+    ("tech-detect", "Tech", "https://a.example.com", {"extracted_results": ["ü", "z", "Z", "é", "日本", "a,b"]}),
+    ("mixed", "Mixed", "a.example.com:443", {"matcher_name": 1, "extracted_results": [3, True, None, 1.5, "x", {"k": "v"}]}),
+    ("scalar", "Scalar", "a.example.com", {"extracted_results": False}),
+    ("null", "Null", "a.example.com", {"extracted_results": None, "matcher_name": None}),
+    ("nodetails", "No details", "a.example.com", None),
+]
+
+
+def test_fingerprint_ignores_extracted_order_but_not_content():
+    first, second = (vulnerability_fingerprint(*case) for case in FINGERPRINT_CASES[:2])
+    assert first == second
+    assert len(first) == 64
+    assert vulnerability_fingerprint("t", "n", "u", {"extracted_results": ["a"]}) != vulnerability_fingerprint("t", "n", "u", {"extracted_results": ["b"]})
+    assert vulnerability_fingerprint("t", "n", "u", {"matcher_name": "m1"}) != vulnerability_fingerprint("t", "n", "u", {"matcher_name": "m2"})
+    assert vulnerability_fingerprint("t", "n", "u1", {}) != vulnerability_fingerprint("t", "n", "u2", {})
+    # 名称只在没有模板 ID 时参与
+    assert vulnerability_fingerprint("t", "n1", "u", {}) == vulnerability_fingerprint("t", "n2", "u", {})
+    assert vulnerability_fingerprint(None, "n", "u", {}) == vulnerability_fingerprint("", "n", "u", {}) == vulnerability_fingerprint("n", "x", "u", {})
+
+
+def _migration_fingerprint_sql() -> str:
+    path = os.path.join(BACKEND_DIR, "alembic", "versions", "0004_vulnerability_fingerprint.py")
+    spec = importlib.util.spec_from_file_location("migration_0004", path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module.FINGERPRINT_SQL
+
+
+def test_fingerprint_matches_migration_sql(database):
+    from app.data import models
+
+    async def fingerprints():
+        async with database() as db:
+            rows = [
+                models.Vulnerability(
+                    vulnerability_name=name, template_id=template_id, matched_at=matched_at, details=details,
+                    severity="info", fingerprint=f"placeholder-{i}",
+                )
+                for i, (template_id, name, matched_at, details) in enumerate(FINGERPRINT_CASES)
+            ]
+            db.add_all(rows)
+            await db.commit()
+            result = await db.execute(text(f"SELECT id, {_migration_fingerprint_sql()} FROM vulnerabilities ORDER BY id"))
+            return [fingerprint for _, fingerprint in result.all()]
+
+    assert run(fingerprints()) == [vulnerability_fingerprint(*case) for case in FINGERPRINT_CASES]
+
+
+def test_normalize_service_url():
+    assert normalize_service_url("https://A.Example.com/login?x=1") == "https://a.example.com:443"
+    assert normalize_service_url("HTTP://a.example.com.:8080/") == "http://a.example.com:8080"
+    assert normalize_service_url("http://a.example.com") == "http://a.example.com:80"
+    assert normalize_service_url("https://[2001:DB8::1]/") == "https://[2001:db8::1]:443"
+    assert normalize_service_url("https://10.0.0.1:8443") == "https://10.0.0.1:8443"
+    # 无法确定 scheme / 端口或者无法解析的 URL
+    assert normalize_service_url("a.example.com:443") is None
+    assert normalize_service_url("ftp://a.example.com/") is None
+    assert normalize_service_url("http://a.example.com:99999") is None
+    assert normalize_service_url("https://") is None
+    assert normalize_service_url("") is None
+    assert normalize_service_url(None) is None
+
+
+def test_asset_service_index_resolve():
+    index = AssetServiceIndex(
+        services={
+            "https://a.example.com:443": 1,
+            "http://a.example.com:8080": 2,
+            "http://b.example.com:80": 3,
+        },
+        hosts={"a.example.com": 10, "b.example.com": 11, "c.example.com": 12},
+    )
+    assert index.resolve("https://A.example.com/path/x.js") == (1, 10)
+    assert index.resolve("http://a.example.com:8080/admin") == (2, 10)
+    # 服务没有被 httpx 记录时仍关联到主机
+    assert index.resolve("http://a.example.com/") == (None, 10)
+    assert index.resolve("https://c.example.com") == (None, 12)
+    # nuclei 网络类模板的 host:port: 依次尝试 https / http
+    assert index.resolve("a.example.com:443") == (1, 10)
+    assert index.resolve("b.example.com:80") == (3, 11)
+    assert index.resolve("a.example.com") == (None, 10)
+    assert index.resolve("unknown.example.com:443") == (None, None)
+    assert index.resolve("http://[::1") == (None, None)
+    assert index.resolve(None) == (None, None)
+
+
+async def _create_assets(db, *project_names):
+    """每个项目一个资产，返回资产列表"""
+    from app.data import models
+
+    assets = []
+    for name in project_names:
+        project = models.Project(name=name)
+        db.add(project)
+        await db.flush()
+        asset = models.Asset(name=f"{name}.example.com", type="domain", project_id=project.id)
+        db.add(asset)
+        await db.flush()
+        assets.append(asset)
+    await db.commit()
+    return assets
+
+
+async def _ingest_service(db, asset, ip, url):
+    """按 asset 的归属写入 IP / 端口 / Web 服务 / 漏洞，返回 (端口, 服务, 漏洞) 的新增数量"""
+    from app.core.ingestion import insert_http_services, upsert_ip_addresses, upsert_ports, upsert_vulnerabilities
+    from app.data import models
+
+    ip_ids, _ = await upsert_ip_addresses(db, {ip}, asset.project_id, asset.id)
+    port_ids, new_ports = await upsert_ports(db, {(ip_ids[ip], 443): "https"}, asset.project_id, asset.id)
+    owner = {"project_id": asset.project_id, "root_asset_id": asset.id}
+    new_services = await insert_http_services(db, [{"port_id": port_ids[(ip_ids[ip], 443)], "url": url, **owner}])
+    service_id = (await db.execute(
+        select(models.HTTPService.id).where(models.HTTPService.root_asset_id == asset.id, models.HTTPService.url == url)
+    )).scalar()
+    new_vulns = await upsert_vulnerabilities(db, [{
+        "vulnerability_name": "Exposed panel", "template_id": "exposed-panel", "severity": "high",
+        "matched_at": url, "details": {}, "http_service_id": service_id, "host_id": None, **owner,
+    }])
+    await db.commit()
+    return new_ports, new_services, new_vulns
+
+
+async def _owned_counts(db, asset_id):
+    from app.data import models
+
+    counts = []
+    for model in (models.Port, models.HTTPService, models.Vulnerability):
+        counts.append((await db.execute(select(func.count()).select_from(model).where(model.root_asset_id == asset_id))).scalar())
+    return tuple(counts)
+
+
+def test_shared_ip_is_listed_under_every_asset(database):
+    url = "https://10.0.0.1:443"
+
+    async def scenario():
+        async with database() as db:
+            first, second = await _create_assets(db, "p1", "p2")
+            created = [
+                await _ingest_service(db, first, "10.0.0.1", url),
+                await _ingest_service(db, second, "10.0.0.1", url),
+                # 同一资产再次扫描: 全部命中已有的行
+                await _ingest_service(db, first, "10.0.0.1", url),
+            ]
+            return created, await _owned_counts(db, first.id), await _owned_counts(db, second.id)
+
+    created, first, second = run(scenario())
+    # 第二个资产 (另一个项目) 扫到同一 IP 时有自己的端口 / 服务 / 漏洞，而不是只挂在最先发现的资产下
+    assert created == [(1, 1, 1), (1, 1, 1), (0, 0, 0)]
+    assert first == second == (1, 1, 1)
+
+
+def test_backfill_merges_legacy_rows_into_rows_ingested_after_upgrade(database):
+    from app.core.backfill import backfill_owners
+    from app.data import models
+
+    url = "https://10.0.0.1:443"
+
+    async def scenario():
+        async with database() as db:
+            asset, = await _create_assets(db, "p")
+            # 迁移 0006 之前的旧数据: 归属为空
+            ip = models.IPAddress(ip_address="10.0.0.1", project_id=asset.project_id, root_asset_id=asset.id)
+            db.add(ip)
+            await db.flush()
+            legacy_port, other_port = models.Port(ip_address_id=ip.id, port_number=443), models.Port(ip_address_id=ip.id, port_number=80)
+            db.add_all([legacy_port, other_port])
+            await db.flush()
+            legacy_service = models.HTTPService(port_id=legacy_port.id, url=url)
+            db.add(legacy_service)
+            await db.flush()
+            db.add(models.WebFinding(http_service_id=legacy_service.id, path="/admin"))
+            await db.commit()
+            # 回填之前同一资产重新入库了相同的端口 / 服务 / 漏洞
+            await _ingest_service(db, asset, "10.0.0.1", url)
+
+        counts = await backfill_owners(batch_size=1)
+        async with database() as db:
+            ports = (await db.execute(select(models.Port.port_number, models.Port.root_asset_id).order_by(models.Port.port_number))).all()
+            services = (await db.execute(select(models.HTTPService.id, models.HTTPService.root_asset_id))).all()
+            finding = (await db.execute(select(models.WebFinding.http_service_id))).scalar()
+            return asset.id, counts, ports, services, finding
+
+    asset_id, counts, ports, services, finding = run(scenario())
+    assert counts == {"ports": 2, "http_services": 1, "vulnerabilities": 0}
+    # 重复的旧端口与旧服务并入新入库的行，另一个旧端口补上归属
+    assert ports == [(80, asset_id), (443, asset_id)]
+    assert [owner for _, owner in services] == [asset_id]
+    assert finding == services[0][0]
@@ -0,0 +1,370 @@
+# tests/test_orchestrator.py
+"""扫描任务的执行、失败与从存档续传"""
+import asyncio
+import os
+import time
+
+import pytest
+
+from conftest import run
+
+HOST_COUNT = 1000
+
+
+@pytest.fixture
+def scan_env(database, redis_settings, tmp_path, monkeypatch):
+    """临时存档目录 + 一个输出 HOST_COUNT 个子域名的扫描配置，返回 (session 工厂, 记录工具运行次数的文件, 配置)"""
+    from app.core import artifacts, orchestrator
+
+    runs = tmp_path / "runs"
+    config = {
+        "config_name": "test-subdomains",
+        "agent_type": "subdomain",
+        "command_template": f"echo run >> {runs}; seq -f 'h%g.example.com' 1 {HOST_COUNT}",
+        "output_parser_type": "line_parser",
+        "data_mapping": {"hostname": "self"},
+        "commit_every": 100,
+    }
+    monkeypatch.setattr(artifacts, "ARTIFACT_DIR", tmp_path / "artifacts")
+    monkeypatch.setattr(orchestrator, "INGEST_BATCH_SIZE", 50)
+    monkeypatch.setattr(orchestrator, "get_scan_config_by_name", lambda name: config if name == config["config_name"] else None)
+    return database, runs, config
+
+
+async def _create_task(session_factory):
+    from app.data import models
+
+    async with session_factory() as db:
+        project = models.Project(name="p")
+        db.add(project)
+        await db.flush()
+        asset = models.Asset(name="example.com", type="domain", project_id=project.id)
+        db.add(asset)
+        await db.flush()
+        task = models.ScanTask(asset_id=asset.id, config_name="test-subdomains", status="pending")
+        db.add(task)
+        await db.commit()
+        return task.id
+
+
+async def _load_task(session_factory, task_id):
+    from app.data import models
+
+    async with session_factory() as db:
+        return await db.get(models.ScanTask, task_id)
+
+
+async def _host_count(session_factory):
+    from sqlalchemy import func, select
+    from app.data import models
+
+    async with session_factory() as db:
+        return (await db.execute(select(func.count(models.Host.id)))).scalar()
+
+
+def test_parser_yields_records_while_tool_is_still_running():
+    from app.parsers.line_parser import LineParser
+
+    async def first_record():
+        process = await asyncio.create_subprocess_shell(
+            "echo a.example.com; exec sleep 30", stdout=asyncio.subprocess.PIPE
+        )
+        started = time.monotonic()
+        try:
+            # 批大小为 1: 每条记录解析出来就立即产出，不等工具退出
+            async for batch in LineParser().parse_batches(process.stdout, {"hostname": "self"}, batch_size=1):
+                return batch, time.monotonic() - started
+        finally:
+            process.kill()
+            await process.wait()
+
+    batch, elapsed = run(first_record())
+    assert batch == [{"hostname": "a.example.com"}]
+    assert elapsed < 10
+
+
+def test_streams_large_stdout_and_stderr_without_blocking(scan_env):
+    from app.core.orchestrator import run_scan_task_logic
+
+    session_factory, _, config = scan_env
+    # stdout / stderr 都远大于管道缓冲 (64KB)，stderr 没有被并发读取时工具会卡住
+    config["command_template"] = (
+        f"head -c 2000000 /dev/zero | tr '\\0' 'e' >&2; seq -f 'h%g.example.com' 1 {HOST_COUNT}"
+    )
+    task_id = run(_create_task(session_factory))
+    run(asyncio.wait_for(run_scan_task_logic(task_id), 60))
+
+    task = run(_load_task(session_factory, task_id))
+    assert task.status == "completed"
+    assert f"处理 {HOST_COUNT} 条" in task.log
+    assert run(_host_count(session_factory)) == HOST_COUNT
+
+
+def test_failed_command_without_output_keeps_stderr_tail(scan_env):
+    from app.core.orchestrator import run_scan_task_logic
+
+    session_factory, _, config = scan_env
+    config["command_template"] = "echo 'boom: no such target' >&2; exit 3"
+    task_id = run(_create_task(session_factory))
+    run(run_scan_task_logic(task_id))
+
+    task = run(_load_task(session_factory, task_id))
+    assert task.status == "failed"
+    assert "boom: no such target" in task.log
+    # 工具失败时存档不完整，不能用来重新入库
+    assert task.artifact_path and task.artifact_size is None
+
+
+async def _set_pending(session_factory, task_id):
+    from app.data import models
+
+    async with session_factory() as db:
+        task = await db.get(models.ScanTask, task_id)
+        task.status = "pending"
+        await db.commit()
+
+
+def test_reingest_replays_artifact_without_running_tool(scan_env):
+    from app.core.orchestrator import run_scan_task_logic
+
+    session_factory, _, config = scan_env
+    task_id = run(_create_task(session_factory))
+    run(run_scan_task_logic(task_id))
+    task = run(_load_task(session_factory, task_id))
+    assert task.status == "completed"
+    assert task.artifact_size == os.path.getsize(task.artifact_path)
+
+    # 重新入库只读存档，工具即使已不可用也不影响
+    config["command_template"] = "exit 7"
+    run(_set_pending(session_factory, task_id))
+    run(run_scan_task_logic(task_id, reingest=True))
+    task = run(_load_task(session_factory, task_id))
+    assert task.status == "completed"
+    assert f"处理 {HOST_COUNT} 条" in task.log
+    assert run(_host_count(session_factory)) == HOST_COUNT
+
+
+def test_streaming_ingest_error_keeps_artifact_and_resumes_from_checkpoint(scan_env, monkeypatch):
+    from app.core.ingestion import SubdomainIngestor
+    from app.core.orchestrator import run_scan_task_logic
+
+    session_factory, runs, _ = scan_env
+    task_id = run(_create_task(session_factory))
+
+    # 第一次执行: 入库到一半时数据库写入出错
+    flush = SubdomainIngestor.flush
+    calls = {"flush": 0}
+
+    async def failing_flush(self):
+        calls["flush"] += 1
+        if calls["flush"] == 4:
+            raise RuntimeError("db blip")
+        await flush(self)
+
+    monkeypatch.setattr(SubdomainIngestor, "flush", failing_flush)
+    run(run_scan_task_logic(task_id))
+
+    task = run(_load_task(session_factory, task_id))
+    assert task.status == "failed"
+    assert 0 < task.checkpoint < HOST_COUNT
+    # 工具没有被中途终止: 存档完整并记录了大小，重试可以直接从存档续传
+    assert task.artifact_size == os.path.getsize(task.artifact_path)
+    assert open(task.artifact_path, "rb").read().count(b"\n") == HOST_COUNT
+    checkpoint = task.checkpoint
+    assert run(_host_count(session_factory)) == checkpoint
+
+    # 重试 (API 的 retry 在存档完整时按 reingest 入队): 不运行工具，跳过已提交的记录
+    monkeypatch.setattr(SubdomainIngestor, "flush", flush)
+    add_many = SubdomainIngestor.add_many
+    added = []
+
+    async def counting_add_many(self, records):
+        added.extend(records)
+        await add_many(self, records)
+
+    monkeypatch.setattr(SubdomainIngestor, "add_many", counting_add_many)
+    run(_set_pending(session_factory, task_id))
+    run(run_scan_task_logic(task_id, reingest=True))
+
+    task = run(_load_task(session_factory, task_id))
+    assert task.status == "completed"
+    assert task.checkpoint == HOST_COUNT
+    assert len(added) == HOST_COUNT - checkpoint
+    assert run(_host_count(session_factory)) == HOST_COUNT
+    assert runs.read_text().count("run") == 1
+
+
+def test_failed_tool_run_is_not_resumed_from_artifact(scan_env, monkeypatch):
+    from app.core.ingestion import SubdomainIngestor
+    from app.core.orchestrator import run_scan_task_logic
+
+    session_factory, runs, config = scan_env
+    # 工具输出了部分结果后以非 0 退出，入库同时出错
+    config["command_template"] += "; exit 2"
+    flush = SubdomainIngestor.flush
+    calls = {"flush": 0}
+
+    async def failing_flush(self):
+        calls["flush"] += 1
+        if calls["flush"] == 4:
+            raise RuntimeError("db blip")
+        await flush(self)
+
+    monkeypatch.setattr(SubdomainIngestor, "flush", failing_flush)
+    task_id = run(_create_task(session_factory))
+    run(run_scan_task_logic(task_id))
+
+    task = run(_load_task(session_factory, task_id))
+    assert task.status == "failed"
+    # 失败的工具输出不算完整存档: 不记录大小，重试时重新运行工具而不是续传
+    assert task.artifact_size is None
+    assert "续传" not in task.log
+
+
+def _alive(pid):
+    """进程存在且不是僵尸进程"""
+    try:
+        with open(f"/proc/{pid}/stat") as f:
+            return f.read().rsplit(")", 1)[1].split()[0] != "Z"
+    except FileNotFoundError:
+        return False
+
+
+def test_kill_process_group_terminates_grandchildren():
+    from app.core.cancellation import kill_process_group
+
+    async def scenario():
+        # shell 派生的子进程忽略 SIGTERM，只有对整个进程组发送 SIGKILL 才能清理
+        process = await asyncio.create_subprocess_shell(
+            "sh -c 'trap \"\" TERM; exec sleep 30' & echo $!; wait",
+            stdout=asyncio.subprocess.PIPE, start_new_session=True,
+        )
+        child = int((await process.stdout.readline()).decode())
+        await asyncio.sleep(0.2)
+        started = time.monotonic()
+        await kill_process_group(process, grace=0.5)
+        await asyncio.sleep(0.2)
+        return child, time.monotonic() - started
+
+    child, elapsed = run(scenario())
+    assert not _alive(child)
+    assert elapsed < 5
+
+
+def test_cancel_stops_running_tool_and_keeps_parsed_results(scan_env, monkeypatch):
+    from app.core import orchestrator
+    from app.core.arq_config import get_arq_pool
+    from app.core.cancellation import request_cancel
+
+    session_factory, _, config = scan_env
+    monkeypatch.setattr(orchestrator, "CANCEL_POLL_INTERVAL", 0.1)
+    config["command_template"] = f"seq -f 'h%g.example.com' 1 {HOST_COUNT}; sleep 30"
+    task_id = run(_create_task(session_factory))
+
+    async def scenario():
+        job = asyncio.create_task(orchestrator.run_scan_task_logic(task_id))
+        await asyncio.sleep(1)
+        await request_cancel(await get_arq_pool(), task_id)
+        started = time.monotonic()
+        await asyncio.wait_for(job, 20)
+        return time.monotonic() - started
+
+    assert run(scenario()) < 10
+    task = run(_load_task(session_factory, task_id))
+    assert task.status == "cancelled"
+    assert f"处理 {HOST_COUNT} 条" in task.log
+    # 被终止的工具输出不完整，不能用来重新入库
+    assert task.artifact_size is None
+    assert run(_host_count(session_factory)) == HOST_COUNT
+
+
+def test_cancel_is_checked_between_ingest_batches(redis_settings, monkeypatch):
+    from app.core import orchestrator
+    from app.core.arq_config import get_arq_pool
+    from app.core.cancellation import clear_cancel, request_cancel
+
+    closed = []
+
+    async def batches():
+        try:
+            for i in range(5):
+                yield [{"hostname": f"h{i}.example.com"}]
+        finally:
+            closed.append(True)
+
+    async def scenario():
+        # 没有工具进程可终止 (重新入库 / 进程池解析) 时，由批次之间的检查发现取消请求
+        task_id = -os.getpid()
+        await request_cancel(await get_arq_pool(), task_id)
+        cancelled = []
+        stop = orchestrator.CommandStop(task_id, on_cancel=lambda: cancelled.append(True))
+        try:
+            return [batch async for batch in stop.batches(batches())], stop.reason, cancelled
+        finally:
+            await clear_cancel(task_id)
+
+    consumed, reason, cancelled = run(scenario())
+    assert consumed == [[{"hostname": "h0.example.com"}]]
+    assert (reason, cancelled, closed) == ("cancelled", [True], [True])
+
+
+def test_job_deadline_fails_task_and_releases_inflight(scan_env, monkeypatch):
+    import worker
+    from app.core.arq_config import get_arq_pool
+    from app.core.dispatch import inflight_key
+
+    session_factory, runs, config = scan_env
+    config["command_template"] = f"echo run >> {runs}; sleep 60"
+    task_id = run(_create_task(session_factory))
+    project_id = 4242
+    # 任务时限 = job_timeout - margin = 2 秒
+    monkeypatch.setattr(worker, "JOB_TIMEOUT", 3)
+    monkeypatch.setattr(worker, "JOB_TIMEOUT_MARGIN", 1)
+
+    async def run_job():
+        redis = await get_arq_pool()
+        await redis.delete(inflight_key(project_id))
+        await redis.sadd(inflight_key(project_id), task_id)
+        # 到期时任务自行中止并正常返回 (不是 CancelledError)，ARQ 不会重新执行这个 job
+        await worker.run_scan_task({"redis": redis}, task_id, project_id=project_id)
+        return await redis.smembers(inflight_key(project_id))
+
+    started = time.monotonic()
+    inflight = run(run_job())
+    assert time.monotonic() - started < 30  # 工具进程组被终止，没有等 sleep 结束
+    assert inflight == set()
+    task = run(_load_task(session_factory, task_id))
+    assert task.status == "failed"
+    assert "任务时限" in task.log
+
+
+def test_worker_shutdown_requeues_task_and_keeps_inflight(scan_env):
+    import worker
+    from app.core.arq_config import get_arq_pool
+    from app.core.dispatch import inflight_key
+
+    session_factory, runs, config = scan_env
+    config["command_template"] = f"echo run >> {runs}; sleep 60"
+    task_id = run(_create_task(session_factory))
+    project_id = 4243
+
+    async def run_job():
+        redis = await get_arq_pool()
+        await redis.delete(inflight_key(project_id))
+        await redis.sadd(inflight_key(project_id), task_id)
+        job = asyncio.create_task(worker.run_scan_task({"redis": redis}, task_id, project_id=project_id))
+        while not runs.exists():
+            await asyncio.sleep(0.05)
+        # 排空超时后 ARQ 取消 job 并在之后重新执行: 在途名额保留给重新执行的 job
+        job.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await job
+        members = await redis.smembers(inflight_key(project_id))
+        await redis.delete(inflight_key(project_id))
+        return members
+
+    assert run(run_job()) == {str(task_id).encode()}
+    task = run(_load_task(session_factory, task_id))
+    assert task.status == "pending"
+    # 工具被中途终止，存档不完整: 重新执行时照常运行工具
+    assert task.artifact_size is None
@@ -0,0 +1,86 @@
+# tests/test_output_cache.py
+"""工具输出缓存的 TTL 与 LRU 淘汰"""
+import os
+import time
+
+import pytest
+
+from app.core import output_cache
+
+
+@pytest.fixture
+def cache_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(output_cache, "OUTPUT_CACHE_DIR", tmp_path / "cache")
+    monkeypatch.setattr(output_cache, "OUTPUT_CACHE_MAX_BYTES", 10 ** 9)
+    return tmp_path / "cache"
+
+
+def _artifact(tmp_path, name: str, data: bytes):
+    path = tmp_path / name
+    path.write_bytes(data)
+    return path
+
+
+def test_cache_key_includes_stdin():
+    assert output_cache.cache_key("subfinder -d a.com") == output_cache.cache_key("subfinder -d a.com", b"")
+    assert output_cache.cache_key("subfinder -d a.com") != output_cache.cache_key("subfinder -d b.com")
+    assert output_cache.cache_key("httpx", b"a.com\n") != output_cache.cache_key("httpx", b"b.com\n")
+
+
+def test_store_and_restore_within_ttl(cache_dir, tmp_path):
+    key = output_cache.cache_key("subfinder -d a.com")
+    assert output_cache.restore(key, 3600, tmp_path / "task_1.stdout") is None
+    output_cache.store(key, _artifact(tmp_path, "src.stdout", b"a.a.com\nb.a.com\n"))
+
+    dest = tmp_path / "task_2.stdout"
+    assert output_cache.restore(key, 3600, dest) == 16
+    # 任务存档是独立的副本，截断它不影响缓存
+    dest.write_bytes(b"")
+    assert output_cache.restore(key, 3600, tmp_path / "task_3.stdout") == 16
+    assert not list(cache_dir.glob("*.tmp"))
+
+
+def test_expired_entry_is_a_miss(cache_dir, tmp_path):
+    key = output_cache.cache_key("subfinder -d a.com")
+    output_cache.store(key, _artifact(tmp_path, "src.stdout", b"x\n"))
+    path = cache_dir / f"{key}.stdout"
+    written = time.time() - 7200
+    os.utime(path, (written, written))
+    assert output_cache.lookup(key, 3600) is None
+    assert output_cache.lookup(key, 10800) == path
+
+
+def test_hit_refreshes_atime_but_not_ttl(cache_dir, tmp_path):
+    key = output_cache.cache_key("subfinder -d a.com")
+    output_cache.store(key, _artifact(tmp_path, "src.stdout", b"x\n"))
+    path = cache_dir / f"{key}.stdout"
+    written = time.time() - 100
+    os.utime(path, (written, written))
+    output_cache.lookup(key, 3600)
+    stat = path.stat()
+    assert stat.st_mtime == pytest.approx(written)
+    assert stat.st_atime > written + 50
+
+
+def test_evict_least_recently_used_first(cache_dir, tmp_path):
+    keys = [output_cache.cache_key(f"cmd {i}") for i in range(3)]
+    now = time.time()
+    for i, key in enumerate(keys):
+        output_cache.store(key, _artifact(tmp_path, f"src{i}.stdout", b"x" * 100))
+        # 写入时间相同，最近使用时间: keys[1] 最久未用，其次 keys[0]
+        os.utime(cache_dir / f"{key}.stdout", (now - [200, 300, 100][i], now))
+    assert output_cache.evict(250) == 1
+    assert sorted(path.stem for path in cache_dir.glob("*.stdout")) == sorted([keys[0], keys[2]])
+    assert output_cache.evict(100) == 1
+    assert [path.stem for path in cache_dir.glob("*.stdout")] == [keys[2]]
+    assert output_cache.evict(100) == 0
+
+
+def test_store_enforces_size_limit(cache_dir, tmp_path, monkeypatch):
+    monkeypatch.setattr(output_cache, "OUTPUT_CACHE_MAX_BYTES", 150)
+    first, second = output_cache.cache_key("cmd 1"), output_cache.cache_key("cmd 2")
+    output_cache.store(first, _artifact(tmp_path, "a.stdout", b"x" * 100))
+    old = time.time() - 60
+    os.utime(cache_dir / f"{first}.stdout", (old, old))
+    output_cache.store(second, _artifact(tmp_path, "b.stdout", b"y" * 100))
+    assert [path.stem for path in cache_dir.glob("*.stdout")] == [second]
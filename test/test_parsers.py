@@ -0,0 +1,191 @@
+# tests/test_parsers.py
+"""解析器"""
+from conftest import run
+
+from app.parsers.base_parser import iter_buffer_lines, read_line_range
+from app.parsers.json_lines_parser import JsonLinesParser, compile_mapping
+from app.parsers.nmap_parser import NmapStreamParser, NmapXmlParser
+
+NMAP_HEADER = (
+    b'Starting Nmap 7.94 ( https://nmap.org )\n'
+    b'<?xml version="1.0" encoding="UTF-8"?>\n'
+    b'<!DOCTYPE nmaprun>\n'
+    b'<?xml-stylesheet href="file:///usr/share/nmap/nmap.xsl" type="text/xsl"?>\n'
+    b'<nmaprun scanner="nmap" args="nmap -oX - 10.0.0.0/24" start="1700000000" version="7.94">\n'
+    b'<scaninfo type="syn" protocol="tcp" numservices="2" services="22,80"/>\n'
+    b'<hosthint><status state="up" reason="arp-response"/><address addr="10.0.0.1" addrtype="ipv4"/></hosthint>\n'
+)
+NMAP_FOOTER = b'<runstats><finished time="1700000100" exit="success"/></runstats>\n</nmaprun>\n'
+
+
+def _nmap_host(index: int, state: str = "up") -> bytes:
+    return (
+        f'<host starttime="1700000001" endtime="1700000002"><status state="{state}" reason="syn-ack"/>\n'
+        f'<address addr="10.0.{index // 256}.{index % 256}" addrtype="ipv4"/>\n'
+        f'<hostnames><hostname name="h{index}.example.com" type="PTR"/></hostnames>\n'
+        f'<ports><port protocol="tcp" portid="22"><state state="open"/><service name="ssh" product="OpenSSH"/></port>\n'
+        f'<port protocol="tcp" portid="80"><state state="closed"/></port>\n'
+        f'<port protocol="tcp" portid="{1000 + index}"><state state="open"/><service name="http"/></port></ports>\n'
+        f'</host>\n'
+    ).encode()
+
+
+def _nmap_xml(count: int) -> bytes:
+    hosts = b"".join(_nmap_host(i, "down" if i % 10 == 9 else "up") for i in range(count))
+    return NMAP_HEADER + hosts + NMAP_FOOTER
+
+
+def _feed_all(data: bytes, chunk_size: int):
+    parser = NmapStreamParser()
+    records = []
+    for start in range(0, len(data), chunk_size):
+        records.extend(parser.feed(data[start:start + chunk_size]))
+    records.extend(parser.close())
+    return parser, records
+
+
+def test_nmap_stream_parser_any_chunking():
+    data = _nmap_xml(30)
+    _, expected = _feed_all(data, len(data))
+    assert len(expected) == 27 * 2
+    # 块边界落在 "<nmaprun" 之前的头部、标签中间时结果相同
+    for chunk_size in (1, 3, 7, 64, 1000):
+        _, records = _feed_all(data, chunk_size)
+        assert records == expected
+
+
+def test_nmap_stream_parser_emits_hosts_as_they_close_and_frees_them():
+    parser = NmapStreamParser()
+    assert parser.feed(NMAP_HEADER) == []
+    records = parser.feed(_nmap_host(1))
+    assert [record["port"] for record in records] == [22, 1001]
+    # 已处理的 <host> 从树中清除
+    assert len(parser._root) == 0
+    assert parser.feed(_nmap_host(2, "down")) == []
+    assert parser.feed(NMAP_FOOTER) == []
+    assert parser.close() == []
+
+
+def test_nmap_stream_parser_without_xml():
+    parser = NmapStreamParser()
+    assert parser.feed(b"Starting Nmap ...\nFailed to resolve target\n") == []
+    assert parser.close() == []
+
+
+def test_compile_mapping_splits_paths_once():
+    assert compile_mapping({"hostname": "input", "ip": "a.0", "raw": "self", "title": "http.title"}) == (
+        ("hostname", ("input",)),
+        ("ip", ("a", "0")),
+        ("raw", None),
+        ("title", ("http", "title")),
+    )
+    assert compile_mapping({}) == ()
+
+
+def test_json_lines_parser_applies_compiled_mapping():
+    lines = (
+        b'{"input": "a.example.com", "http": {"title": "A", "status": 200}}\n'
+        b'not json\n'
+        b'\n'
+        b'{"input": "b.example.com", "http": "flat"}\n'
+    )
+    mapping = {"hostname": "input", "title": "http.title", "record": "self"}
+
+    async def parse():
+        return [record async for record in JsonLinesParser().parse(lines, mapping)]
+
+    first, second = run(parse())
+    assert first["hostname"] == "a.example.com" and first["title"] == "A"
+    assert first["record"]["http"]["status"] == 200
+    # 中间路径不是对象时取不到值
+    assert second["hostname"] == "b.example.com" and second.get("title") is None
+
+
+def _parse_segments(path: str, segment_bytes: int):
+    size = len(open(path, "rb").read())
+    parser = NmapXmlParser()
+    segments = [parser.parse_file(path, {}, start, min(start + segment_bytes, size)) for start in range(0, size, segment_bytes)]
+    return segments, [record for segment in segments for record in segment]
+
+
+def test_nmap_parse_file_splits_by_host(tmp_path):
+    path = tmp_path / "nmap.xml"
+    path.write_bytes(_nmap_xml(200))
+    whole = NmapXmlParser().parse_file(str(path), {})
+    assert len(whole) == 180 * 2
+    assert whole[:2] == [
+        {"ip": "10.0.0.0", "port": 22, "protocol": "tcp", "service": "ssh", "product": "OpenSSH", "version": None},
+        {"ip": "10.0.0.0", "port": 1000, "protocol": "tcp", "service": "http", "product": None, "version": None},
+    ]
+    # 任意切分 (包括切在标签中间) 时每个主机恰好解析一次，每段的结果只与段大小有关
+    for segment_bytes in (1, 97, 500, 4096, 1 << 20):
+        segments, records = _parse_segments(str(path), segment_bytes)
+        assert records == whole
+        if segment_bytes <= 4096:
+            assert max(len(segment) for segment in segments) < len(whole) // 4
+
+
+def test_nmap_parse_file_truncated_output(tmp_path):
+    data = _nmap_xml(20)
+    path = tmp_path / "nmap.xml"
+    # nmap 被中断: 最后一个主机只写了一半，也没有 </nmaprun>
+    path.write_bytes(data[:data.rfind(b"<host ") + 120])
+    whole = NmapXmlParser().parse_file(str(path), {})
+    assert {record["ip"] for record in whole} == {f"10.0.0.{i}" for i in range(19) if i % 10 != 9}
+    _, records = _parse_segments(str(path), 300)
+    assert records == whole
+
+
+def test_nmap_parse_file_without_hosts(tmp_path):
+    path = tmp_path / "nmap.xml"
+    path.write_bytes(NMAP_HEADER + NMAP_FOOTER)
+    assert NmapXmlParser().parse_file(str(path), {}) == []
+    path.write_bytes(b"")
+    assert NmapXmlParser().parse_file(str(path), {}) == []
+
+
+LINES = b"alpha\nbravo\n\ncharlie\ndelta-without-newline"
+
+
+def _segments(size: int, step: int):
+    return [(start, min(start + step, size)) for start in range(0, size, step)]
+
+
+def test_read_line_range_segments_cover_each_line_once(tmp_path):
+    path = tmp_path / "out.txt"
+    path.write_bytes(LINES)
+    assert list(read_line_range(str(path))) == [b"alpha\n", b"bravo\n", b"\n", b"charlie\n", b"delta-without-newline"]
+    for step in range(1, len(LINES) + 1):
+        lines = [line for start, end in _segments(len(LINES), step) for line in read_line_range(str(path), start, end)]
+        assert b"".join(lines) == LINES
+        assert len(lines) == 5
+
+
+def test_read_line_range_empty_file(tmp_path):
+    path = tmp_path / "empty.txt"
+    path.write_bytes(b"")
+    assert list(read_line_range(str(path))) == []
+
+
+def test_iter_buffer_lines_boundaries():
+    # 起点落在行首时该行属于本段；落在行中间时属于上一段
+    start = LINES.index(b"bravo")
+    assert list(iter_buffer_lines(LINES, start, start + 1)) == [b"bravo\n"]
+    assert list(iter_buffer_lines(LINES, start + 1, start + 2)) == []
+    assert list(iter_buffer_lines(LINES, 0, 1)) == [b"alpha\n"]
+    # end 超出缓冲区时截到末尾
+    assert list(iter_buffer_lines(LINES, LINES.index(b"delta"), 10 ** 6)) == [b"delta-without-newline"]
+    assert list(iter_buffer_lines(b"")) == []
+    assert list(iter_buffer_lines(b"\n\n")) == [b"\n", b"\n"]
+
+
+def test_iter_buffer_lines_on_mmap(tmp_path):
+    from app.parsers.base_parser import open_mmap
+
+    path = tmp_path / "out.txt"
+    path.write_bytes(LINES)
+    with open_mmap(str(path)) as mapped:
+        assert list(iter_buffer_lines(mapped)) == LINES.splitlines(keepends=True)
+        for step in (2, 5, 11):
+            lines = [line for start, end in _segments(len(LINES), step) for line in iter_buffer_lines(mapped, start, end)]
+            assert b"".join(lines) == LINES
@@ -0,0 +1,114 @@
+# tests/test_pipeline.py
+"""流水线阶段之间的结果转发"""
+import pytest
+from sqlalchemy import select
+
+from conftest import run
+
+PIPELINE = {
+    "pipeline_name": "test-pipeline",
+    "stages": [
+        {"config": "test-stage0"},
+        {"config": "test-stage1", "input": "hosts", "forward_every": 10},
+    ],
+}
+CONFIGS = {
+    "test-stage0": {
+        "config_name": "test-stage0",
+        "agent_type": "subdomain",
+        # 第 25 行之后重复输出前 5 个主机
+        "command_template": "seq -f 'h%g.example.com' 1 25; seq -f 'h%g.example.com' 1 5",
+        "output_parser_type": "line_parser",
+        "data_mapping": {"hostname": "self"},
+    },
+    "test-stage1": {
+        "config_name": "test-stage1",
+        "agent_type": "subdomain",
+        "command_template": "true",
+        "batch_command_template": "cat",
+        "output_parser_type": "line_parser",
+        "data_mapping": {"hostname": "self"},
+    },
+}
+
+
+@pytest.fixture
+def pipeline_env(database, tmp_path, monkeypatch):
+    """两阶段流水线，下游子任务只记录不入队；返回 (session 工厂, 入队的子任务 ID 列表)"""
+    from app.core import artifacts, orchestrator, pipeline
+
+    enqueued = []
+
+    async def record_enqueue(db, child):
+        enqueued.append(child.id)
+
+    monkeypatch.setattr(artifacts, "ARTIFACT_DIR", tmp_path / "artifacts")
+    monkeypatch.setattr(orchestrator, "INGEST_BATCH_SIZE", 5)
+    monkeypatch.setattr(orchestrator, "get_scan_config_by_name", CONFIGS.get)
+    monkeypatch.setattr(orchestrator, "enqueue_stage_task", record_enqueue)
+    monkeypatch.setattr(pipeline, "get_pipeline_by_name", lambda name: PIPELINE if name == PIPELINE["pipeline_name"] else None)
+    return database, enqueued
+
+
+async def _create_stage_task(session_factory):
+    from app.data import models
+
+    async with session_factory() as db:
+        project = models.Project(name="p")
+        db.add(project)
+        await db.flush()
+        asset = models.Asset(name="example.com", type="domain", project_id=project.id)
+        db.add(asset)
+        await db.flush()
+        parent = models.ScanTask(asset_id=asset.id, config_name=PIPELINE["pipeline_name"], status="running",
+                                 pipeline_name=PIPELINE["pipeline_name"])
+        db.add(parent)
+        await db.flush()
+        task = models.ScanTask(asset_id=asset.id, config_name="test-stage0", status="pending",
+                               parent_task_id=parent.id, stage_index=0)
+        db.add(task)
+        await db.commit()
+        return parent.id, task.id
+
+
+async def _stage_targets(session_factory, parent_id, stage_index):
+    from app.data import models
+
+    async with session_factory() as db:
+        rows = await db.execute(
+            select(models.ScanTask.targets)
+            .where(models.ScanTask.parent_task_id == parent_id, models.ScanTask.stage_index == stage_index)
+            .order_by(models.ScanTask.id)
+        )
+        return [targets for targets in rows.scalars()]
+
+
+async def _reset_for_reingest(session_factory, task_id):
+    from app.data import models
+
+    async with session_factory() as db:
+        task = await db.get(models.ScanTask, task_id)
+        task.status = "pending"
+        task.checkpoint = 0
+        task.results_count = 0
+        await db.commit()
+
+
+def test_stage_results_are_forwarded_once_per_target(pipeline_env):
+    from app.core.orchestrator import run_scan_task_logic
+
+    session_factory, enqueued = pipeline_env
+    parent_id, task_id = run(_create_stage_task(session_factory))
+    run(run_scan_task_logic(task_id))
+
+    batches = run(_stage_targets(session_factory, parent_id, 1))
+    # 每 10 条记录转发一次；输出末尾重复的主机不会再次转发
+    assert [len(targets) for targets in batches] == [10, 10, 5]
+    assert sorted(t for targets in batches for t in targets) == sorted(f"h{i}.example.com" for i in range(1, 26))
+    assert len(enqueued) == 3
+
+    # 从存档重新入库: 上游结果被再次收集，但都已转发过，不再创建下游子任务
+    run(_reset_for_reingest(session_factory, task_id))
+    run(run_scan_task_logic(task_id, reingest=True))
+    assert len(run(_stage_targets(session_factory, parent_id, 1))) == 3
+    assert len(enqueued) == 3
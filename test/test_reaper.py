@@ -0,0 +1,164 @@
+# tests/test_reaper.py
+"""心跳超时任务的回收，以及 worker 退出时被中断任务的续传"""
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+from conftest import run
+
+CONFIG = {
+    "config_name": "test-subdomains",
+    "agent_type": "subdomain",
+    "output_parser_type": "line_parser",
+    "data_mapping": {"hostname": "self"},
+}
+HOST_COUNT = 100
+
+
+@pytest.fixture
+def reaper_env(database, isolated_queues, tmp_path, monkeypatch):
+    """返回 (session 工厂, redis_settings, 输出存档路径, 记录工具运行次数的文件)"""
+    from app.core import artifacts, dispatch, orchestrator
+
+    runs = tmp_path / "runs"
+    artifact = tmp_path / "out.txt"
+    artifact.write_text("".join(f"h{i}.example.com\n" for i in range(1, HOST_COUNT + 1)))
+    config = dict(CONFIG, command_template=f"echo run >> {runs}; seq -f 'h%g.example.com' 1 {HOST_COUNT}")
+    monkeypatch.setattr(artifacts, "ARTIFACT_DIR", tmp_path / "artifacts")
+    monkeypatch.setattr(dispatch, "get_scan_config_by_name", lambda name: config)
+    monkeypatch.setattr(orchestrator, "get_scan_config_by_name", lambda name: config)
+    return database, isolated_queues, artifact, runs
+
+
+async def _create_tasks(session_factory, *specs):
+    """按 spec (ScanTask 的字段) 在同一个项目中创建任务，返回 (项目 ID, 任务 ID 列表)"""
+    from app.data import models
+
+    async with session_factory() as db:
+        project = models.Project(name="p")
+        db.add(project)
+        await db.flush()
+        # 每个任务一个资产 (同一资产同一配置只能有一个未结束的任务)
+        assets = [models.Asset(name=f"t{i}.example.com", type="domain", project_id=project.id) for i in range(len(specs))]
+        db.add_all(assets)
+        await db.flush()
+        tasks = [
+            models.ScanTask(asset_id=asset.id, config_name=CONFIG["config_name"], **spec)
+            for asset, spec in zip(assets, specs)
+        ]
+        db.add_all(tasks)
+        await db.commit()
+        return project.id, [task.id for task in tasks]
+
+
+async def _load(session_factory, *task_ids):
+    from app.data import models
+
+    async with session_factory() as db:
+        return [await db.get(models.ScanTask, task_id) for task_id in task_ids]
+
+
+def _stale(**fields):
+    long_ago = datetime.now(timezone.utc) - timedelta(hours=1)
+    return dict(status="running", started_at=long_ago, heartbeat_at=long_ago, **fields)
+
+
+def test_reaper_requeues_stale_tasks_and_gives_up_after_max_requeues(reaper_env, monkeypatch):
+    from arq import create_pool
+    from app.core import dispatch, reaper
+
+    session_factory, redis_settings, artifact, _ = reaper_env
+    monkeypatch.setattr(reaper, "REAPER_MAX_REQUEUES", 2)
+    project_id, ids = run(_create_tasks(
+        session_factory,
+        _stale(),                                                                  # 重新运行工具
+        _stale(artifact_path=str(artifact), artifact_size=artifact.stat().st_size),  # 从存档续传
+        _stale(requeue_count=2),                                                   # 达到上限
+        dict(status="running", started_at=datetime.now(timezone.utc), heartbeat_at=datetime.now(timezone.utc)),
+    ))
+
+    async def scenario():
+        redis = await create_pool(redis_settings)
+        try:
+            for task_id in ids:
+                await redis.sadd(dispatch.inflight_key(project_id), task_id)
+            reaped = await reaper.reap_stale_tasks()
+            queued = await redis.zrange(dispatch.project_queue_key("passive", project_id), 0, -1)
+            inflight = {int(v) for v in await redis.smembers(dispatch.inflight_key(project_id))}
+            return reaped, sorted(member.decode() for member in queued), inflight
+        finally:
+            await redis.aclose()
+
+    reaped, queued, inflight = run(scenario())
+    assert reaped == 3
+    assert queued == sorted([f"{ids[0]}:0", f"{ids[1]}:1"])
+    # 失联 worker 占用的在途名额被释放，心跳正常的任务不受影响
+    assert inflight == {ids[3]}
+
+    rerun, resume, exhausted, alive = run(_load(session_factory, *ids))
+    assert (rerun.status, rerun.requeue_count) == ("pending", 1)
+    assert (resume.status, resume.requeue_count) == ("pending", 1)
+    assert "续传" in resume.log and "续传" not in rerun.log
+    assert exhausted.status == "failed" and "放弃执行" in exhausted.log
+    assert alive.status == "running"
+
+    # 已处理过的任务不会被重复回收
+    assert run(reaper.reap_stale_tasks()) == 0
+
+
+def test_interrupted_task_with_complete_artifact_resumes_without_rerunning_tool(reaper_env):
+    import worker
+    from arq import create_pool
+    from app.core.reaper import requeue_interrupted
+
+    session_factory, redis_settings, artifact, runs = reaper_env
+    project_id, (task_id,) = run(_create_tasks(
+        session_factory,
+        dict(status="running", artifact_path=str(artifact), artifact_size=artifact.stat().st_size, checkpoint=40),
+    ))
+    # worker 退出: 工具已正常跑完 (存档完整)，与回收器相同按续传处理
+    run(requeue_interrupted(task_id, []))
+    task, = run(_load(session_factory, task_id))
+    assert task.status == "pending" and "续传" in task.log
+
+    async def rerun():
+        redis = await create_pool(redis_settings)
+        try:
+            # ARQ 重新执行原 job (参数仍是 reingest=False)
+            await worker.run_scan_task({"redis": redis, "job_try": 2}, task_id, project_id=project_id)
+        finally:
+            await redis.aclose()
+
+    run(rerun())
+    task, = run(_load(session_factory, task_id))
+    assert task.status == "completed"
+    assert task.checkpoint == HOST_COUNT
+    assert not runs.exists()
+
+
+def test_interrupted_task_without_artifact_detaches_members(reaper_env):
+    from arq import create_pool
+    from app.core import dispatch
+    from app.core.reaper import requeue_interrupted
+
+    session_factory, redis_settings, _, _ = reaper_env
+    project_id, (leader, follower) = run(_create_tasks(session_factory, dict(status="running"), dict(status="running")))
+
+    async def scenario():
+        from app.data import models
+
+        async with session_factory() as db:
+            (await db.get(models.ScanTask, follower)).batch_leader_id = leader
+            await db.commit()
+        await requeue_interrupted(leader, [follower])
+        redis = await create_pool(redis_settings)
+        try:
+            return await redis.zrange(dispatch.project_queue_key("passive", project_id), 0, -1)
+        finally:
+            await redis.aclose()
+
+    # 重新运行工具: 成员解除合并并各自入队，leader 由 ARQ 重新执行原 job
+    assert run(scenario()) == [f"{follower}:0".encode()]
+    task, member = run(_load(session_factory, leader, follower))
+    assert task.status == "pending" and "续传" not in task.log
+    assert (member.status, member.batch_leader_id) == ("pending", None)
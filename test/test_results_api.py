@@ -0,0 +1,109 @@
+# tests/test_results_api.py
+"""资产结果列表: 游标分页与过滤"""
+import httpx
+import pytest
+from fastapi import FastAPI
+
+from conftest import run
+
+PORT_COUNT = 25
+
+
+@pytest.fixture
+def results_env(database):
+    """只挂载结果路由 (跳过认证) 的 ASGI 客户端工厂，并为两个资产写入端口 / Web 服务 / 漏洞；返回 (客户端工厂, 资产 ID)"""
+    from app.api import deps
+    from app.api.v1 import results
+    from app.data import models
+
+    async def seed():
+        async with database() as db:
+            project = models.Project(name="p")
+            db.add(project)
+            await db.flush()
+            asset, other = (models.Asset(name=f"{name}.example.com", type="domain", project_id=project.id) for name in "ab")
+            db.add_all([asset, other])
+            await db.flush()
+            ip = models.IPAddress(ip_address="10.0.0.1", project_id=project.id, root_asset_id=asset.id)
+            db.add(ip)
+            await db.flush()
+            for owner in (asset, other):
+                owned = {"project_id": project.id, "root_asset_id": owner.id}
+                ports = [models.Port(ip_address_id=ip.id, port_number=8000 + i, **owned) for i in range(PORT_COUNT)]
+                db.add_all(ports)
+                await db.flush()
+                db.add_all([
+                    models.HTTPService(port_id=ports[0].id, url="https://10.0.0.1:8000", status_code=200, tech=["Nginx", "PHP"], **owned),
+                    models.HTTPService(port_id=ports[1].id, url="https://10.0.0.1:8001", status_code=403, tech={"Nginx": "1.25"}, **owned),
+                    models.HTTPService(port_id=ports[2].id, url="https://10.0.0.1:8002", status_code=200, tech=["Apache"], **owned),
+                ])
+                db.add_all([
+                    models.Vulnerability(vulnerability_name=f"v{i}", severity=severity, fingerprint=f"f{i}", **owned)
+                    for i, severity in enumerate(["high", "info", "high", "low", "high"])
+                ])
+            await db.commit()
+            return asset.id
+
+    app = FastAPI()
+    app.include_router(results.router)
+    app.dependency_overrides[deps.get_current_active_user] = lambda: None
+
+    def client():
+        return httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://test")
+
+    return client, run(seed())
+
+
+def _get(client_factory, url, **params):
+    async def get():
+        async with client_factory() as client:
+            response = await client.get(url, params=params)
+            assert response.status_code == 200, response.text
+            return response.json()
+
+    return run(get())
+
+
+def _all_pages(client_factory, url, **params):
+    """沿 next_cursor 翻完所有页，返回每一页"""
+    pages = [_get(client_factory, url, **params)]
+    while pages[-1]["has_more"]:
+        pages.append(_get(client_factory, url, cursor=pages[-1]["next_cursor"], **params))
+    return pages
+
+
+def test_ports_keyset_pages_cover_each_row_once(results_env):
+    client, asset_id = results_env
+    pages = _all_pages(client, f"/assets/{asset_id}/ports", limit=10)
+    assert [len(page["items"]) for page in pages] == [10, 10, 5]
+    ids = [item["id"] for page in pages for item in page["items"]]
+    # 按 id 降序，不重不漏，只有本资产的端口
+    assert ids == sorted(set(ids), reverse=True)
+    assert sorted(item["port"] for page in pages for item in page["items"]) == list(range(8000, 8000 + PORT_COUNT))
+    assert pages[-1]["next_cursor"] is None
+    assert all(page["next_cursor"] == page["items"][-1]["id"] for page in pages[:-1])
+
+    filtered = _get(client, f"/assets/{asset_id}/ports", port=8003)
+    assert [item["port"] for item in filtered["items"]] == [8003]
+    assert filtered["has_more"] is False
+
+
+def test_web_filters_by_status_code_and_tech(results_env):
+    client, asset_id = results_env
+    url = f"/assets/{asset_id}/web"
+    assert [item["url"] for item in _get(client, url, status_code=200)["items"]] == [
+        "https://10.0.0.1:8002", "https://10.0.0.1:8000",
+    ]
+    # tech 为列表 (httpx) 或对象时都能匹配
+    assert [item["url"] for item in _get(client, url, tech="Nginx")["items"]] == [
+        "https://10.0.0.1:8001", "https://10.0.0.1:8000",
+    ]
+    assert [item["url"] for item in _get(client, url, tech="Nginx", status_code=200)["items"]] == ["https://10.0.0.1:8000"]
+    assert _get(client, url, tech="IIS")["items"] == []
+
+
+def test_vulns_filter_by_severity_across_pages(results_env):
+    client, asset_id = results_env
+    pages = _all_pages(client, f"/assets/{asset_id}/vulns", limit=2, severity="high")
+    assert [[item["name"] for item in page["items"]] for page in pages] == [["v4", "v2"], ["v0"]]
+    assert all(item["severity"] == "high" for page in pages for item in page["items"])
@@ -0,0 +1,108 @@
+# tests/test_schema.py
+"""Alembic 接管并升级 create_all 建好的旧库"""
+import pytest
+from sqlalchemy import inspect, text
+from sqlalchemy.exc import IntegrityError
+
+from conftest import run
+
+# 旧库由 create_all 在引入迁移前的不同版本建成，scan_tasks 可能已经有一部分新增的列
+PARTIAL_COLUMNS = {"parent_task_id": "INTEGER REFERENCES scan_tasks(id)", "priority": "INTEGER NOT NULL DEFAULT 5"}
+ADDED_COLUMNS = ("parent_task_id", "priority", "force", "heartbeat_at", "requeue_count")
+
+
+def _scan_task_columns(conn):
+    return {column["name"] for column in inspect(conn).get_columns("scan_tasks")}
+
+
+def _alembic_config():
+    from alembic.config import Config
+    from app.data.migrations import ALEMBIC_INI
+
+    return Config(str(ALEMBIC_INI))
+
+
+def _create_legacy_database(engine):
+    """
+    建一个引入迁移之前的旧库: 基线表结构 (0001 与当时 create_all 建出的相同) 加上部分新增的列，
+    没有 alembic_version 和唯一约束，并且已经积累了重复的未结束任务和重复的端口。返回资产 ID
+    """
+    from alembic import command
+    from app.data.base import Base
+
+    async def drop_all():
+        async with engine.begin() as conn:
+            await conn.run_sync(Base.metadata.drop_all)
+            await conn.execute(text("DROP TABLE IF EXISTS alembic_version"))
+
+    run(drop_all())
+    command.upgrade(_alembic_config(), "0001")
+    return run(_seed_legacy_rows(engine))
+
+
+async def _seed_legacy_rows(engine):
+    async with engine.begin() as conn:
+        await conn.execute(text("DROP TABLE alembic_version"))
+        for name, definition in PARTIAL_COLUMNS.items():
+            await conn.execute(text(f'ALTER TABLE scan_tasks ADD COLUMN "{name}" {definition}'))
+
+        project_id = (await conn.execute(text("INSERT INTO projects (name) VALUES ('p') RETURNING id"))).scalar()
+        asset_id = (await conn.execute(
+            text("INSERT INTO assets (name, type, project_id) VALUES ('example.com', 'domain', :p) RETURNING id"),
+            {"p": project_id},
+        )).scalar()
+        for status in ("running", "pending", "pending", "completed"):
+            await conn.execute(
+                text("INSERT INTO scan_tasks (asset_id, config_name, status) VALUES (:a, 'subfinder', :s)"),
+                {"a": asset_id, "s": status},
+            )
+        ip_id = (await conn.execute(
+            text("INSERT INTO ip_addresses (ip_address, project_id, status, is_bookmarked) VALUES ('10.0.0.1', :p, 'discovered', false) RETURNING id"),
+            {"p": project_id},
+        )).scalar()
+        for i in range(2):
+            port_id = (await conn.execute(
+                text("INSERT INTO ports (ip_address_id, port_number) VALUES (:ip, 443) RETURNING id"), {"ip": ip_id},
+            )).scalar()
+            await conn.execute(
+                text("INSERT INTO http_services (port_id, url, is_bookmarked) VALUES (:port, :url, false)"),
+                {"port": port_id, "url": f"https://10.0.0.1/{i}"},
+            )
+        return asset_id
+
+
+def test_alembic_upgrades_create_all_database_with_duplicates(database):
+    from alembic import command
+    from app.data.migrations import check_schema_revision, head_revision
+    from app.data.session import engine
+
+    asset_id = _create_legacy_database(engine)
+    command.upgrade(_alembic_config(), "head")
+
+    async def inspect_upgraded():
+        async with engine.connect() as conn:
+            columns = await conn.run_sync(_scan_task_columns)
+            tasks = (await conn.execute(
+                text("SELECT status, log FROM scan_tasks WHERE asset_id = :a ORDER BY id"), {"a": asset_id},
+            )).all()
+            ports = (await conn.execute(text("SELECT DISTINCT port_id FROM http_services"))).scalars().all()
+        return await check_schema_revision(engine), columns, tasks, ports
+
+    revision, columns, tasks, ports = run(inspect_upgraded())
+    assert revision == head_revision()
+    assert set(ADDED_COLUMNS) <= columns
+    # 同一资产同一配置只保留最早的未结束任务，已结束的任务不受影响
+    assert [status for status, _ in tasks] == ["running", "failed", "failed", "completed"]
+    assert all("重复任务" in log for _, log in tasks[1:3])
+    # 重复端口合并，HTTP 服务都指向保留的端口
+    assert len(ports) == 1
+
+    async def insert_duplicate_active_task():
+        async with engine.begin() as conn:
+            await conn.execute(
+                text("INSERT INTO scan_tasks (asset_id, config_name, status) VALUES (:a, 'subfinder', 'pending')"),
+                {"a": asset_id},
+            )
+
+    with pytest.raises(IntegrityError, match="uq_scan_tasks_active"):
+        run(insert_duplicate_active_task())
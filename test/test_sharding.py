@@ -0,0 +1,43 @@
+# tests/test_sharding.py
+"""网段分片"""
+import ipaddress
+
+from app.core.sharding import split_cidr
+
+
+def test_split_cidr_by_shard_prefix():
+    assert split_cidr("10.0.0.0/22") == ["10.0.0.0/24", "10.0.1.0/24", "10.0.2.0/24", "10.0.3.0/24"]
+    assert split_cidr("10.0.0.0/23", shard_prefix=25) == [
+        "10.0.0.0/25", "10.0.0.128/25", "10.0.1.0/25", "10.0.1.128/25",
+    ]
+
+
+def test_split_cidr_normalizes_host_bits_and_whitespace():
+    assert split_cidr(" 192.168.1.77/23 ") == ["192.168.0.0/24", "192.168.1.0/24"]
+
+
+def test_split_cidr_small_or_invalid_targets_unchanged():
+    assert split_cidr("10.0.0.0/24") == ["10.0.0.0/24"]
+    assert split_cidr("10.0.0.0/28") == ["10.0.0.0/28"]
+    assert split_cidr("10.0.0.1") == ["10.0.0.1/32"]
+    assert split_cidr("example.com") == ["example.com"]
+    # 分片前缀比网段还长 (不合理的配置) 时也不拆
+    assert split_cidr("10.0.0.0/20", shard_prefix=8) == ["10.0.0.0/20"]
+
+
+def test_split_cidr_caps_shard_count():
+    shards = split_cidr("10.0.0.0/8", shard_prefix=24, max_shards=1024)
+    # /8 按 /24 会拆出 65536 段，逐级增大分片直到不超过上限
+    assert len(shards) == 1024
+    assert {ipaddress.ip_network(shard).prefixlen for shard in shards} == {18}
+    assert split_cidr("10.0.0.0/16", max_shards=1) == ["10.0.0.0/16"]
+
+
+def test_split_cidr_covers_network_exactly():
+    network = ipaddress.ip_network("172.16.0.0/19")
+    shards = [ipaddress.ip_network(shard) for shard in split_cidr(str(network), shard_prefix=24)]
+    assert sum(shard.num_addresses for shard in shards) == network.num_addresses
+    assert all(shard.subnet_of(network) for shard in shards)
+    assert split_cidr("2001:db8::/62", shard_prefix=64) == [
+        "2001:db8::/64", "2001:db8:0:1::/64", "2001:db8:0:2::/64", "2001:db8:0:3::/64",
+    ]
@@ -0,0 +1,79 @@
+# tests/test_tasks_api.py
+"""任务接口: 取消"""
+import httpx
+import pytest
+from fastapi import FastAPI
+
+from conftest import run
+
+
+@pytest.fixture
+def tasks_client(database, redis_settings):
+    """只挂载任务路由 (跳过认证) 的 ASGI 客户端工厂"""
+    from app.api import deps
+    from app.api.v1 import tasks
+
+    app = FastAPI()
+    app.include_router(tasks.router, prefix="/tasks")
+    app.dependency_overrides[deps.get_current_active_user] = lambda: None
+
+    def client():
+        return httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://test")
+
+    return client
+
+
+async def _create_tasks(session_factory, *statuses):
+    from app.data import models
+
+    async with session_factory() as db:
+        project = models.Project(name="p")
+        db.add(project)
+        await db.flush()
+        assets = [models.Asset(name=f"t{i}.example.com", type="domain", project_id=project.id) for i in range(len(statuses))]
+        db.add_all(assets)
+        await db.flush()
+        tasks = [
+            models.ScanTask(asset_id=asset.id, config_name="subfinder", status=status)
+            for asset, status in zip(assets, statuses)
+        ]
+        db.add_all(tasks)
+        await db.commit()
+        return [task.id for task in tasks]
+
+
+def _post(client_factory, url):
+    async def post():
+        async with client_factory() as client:
+            response = await client.post(url)
+            return response.status_code, response.json()
+
+    return run(post())
+
+
+def test_cancel_marks_pending_task_and_flags_running_task(database, tasks_client):
+    from app.core.arq_config import get_arq_pool
+    from app.core.cancellation import cancel_key, clear_cancel, is_cancel_requested
+
+    pending_id, running_id, completed_id = run(_create_tasks(database, "pending", "running", "completed"))
+
+    # 排队中的任务直接取消，不需要 worker 参与
+    status_code, body = _post(tasks_client, f"/tasks/{pending_id}/cancel")
+    assert (status_code, body["status"]) == (202, "cancelled")
+    assert not run(is_cancel_requested(pending_id))
+
+    # 运行中的任务只写入取消标记，由执行它的 worker 终止
+    status_code, body = _post(tasks_client, f"/tasks/{running_id}/cancel")
+    assert (status_code, body["status"]) == (202, "running")
+
+    async def flag_ttl():
+        try:
+            return await (await get_arq_pool()).ttl(cancel_key(running_id))
+        finally:
+            await clear_cancel(running_id)
+
+    assert run(flag_ttl()) > 0
+
+    status_code, _ = _post(tasks_client, f"/tasks/{completed_id}/cancel")
+    assert status_code == 409
+    assert _post(tasks_client, "/tasks/999999/cancel")[0] == 404
@@ -0,0 +1,271 @@
+# tests/test_worker.py
+"""worker 配置、准入调度与分发轮询"""
+import asyncio
+from collections import Counter
+
+import pytest
+from arq.worker import get_kwargs
+
+from app.core.dispatch import WeightedRoundRobin
+from conftest import run
+from worker import WorkerSettings
+
+HEAVY = {"config_name": "nmap", "agent_type": "portscan"}
+LIGHT = {"config_name": "subfinder", "agent_type": "subdomain"}
+
+
+@pytest.fixture
+def scheduler_env(monkeypatch):
+    """可调整的 scheduler 设置与机器状态 (默认内存 / 负载都充足)，返回 (settings, machine)"""
+    from app.core import scheduler
+
+    settings = {"max_concurrency_by_agent_type": {"portscan": 1}}
+    machine = {"free_mb": None, "load": None}
+    monkeypatch.setattr(scheduler, "get_scheduler_settings", lambda: settings)
+    monkeypatch.setattr(scheduler, "read_free_memory_mb", lambda: machine["free_mb"])
+    monkeypatch.setattr(scheduler, "read_load_per_cpu", lambda: machine["load"])
+    monkeypatch.setattr(scheduler, "_running", {})
+    return settings, machine
+
+
+def test_admit_enforces_per_agent_type_and_per_config_limits(scheduler_env):
+    from app.core.scheduler import AdmissionDeferred, admit, running_snapshot
+
+    with admit(HEAVY):
+        with pytest.raises(AdmissionDeferred) as deferred:
+            with admit(dict(HEAVY, config_name="nmap-full")):
+                pass
+        assert "agent_type:portscan" in deferred.value.reason
+        # 其它类型不受影响
+        with admit(LIGHT):
+            assert running_snapshot() == {"agent_type:portscan": 1}
+    # 槽位随 with 块释放 (包括被拒绝的那次没有占用槽位)
+    assert running_snapshot() == {}
+    with admit(HEAVY):
+        pass
+
+    limited = dict(LIGHT, max_concurrency=2)
+    with admit(limited), admit(limited):
+        with pytest.raises(AdmissionDeferred):
+            with admit(limited):
+                pass
+    assert running_snapshot() == {}
+
+
+def test_admit_defers_on_low_memory_and_heavy_tasks_on_high_load(scheduler_env):
+    from app.core.scheduler import AdmissionDeferred, admit
+
+    settings, machine = scheduler_env
+    settings["defer_seconds"] = 10
+    machine["load"] = 3.0
+    with pytest.raises(AdmissionDeferred) as deferred:
+        with admit(HEAVY):
+            pass
+    assert 8 <= deferred.value.delay <= 15
+    # 负载高时轻量任务照常准入，配置中的 heavy 字段优先于 agent_type
+    with admit(LIGHT):
+        pass
+    with pytest.raises(AdmissionDeferred):
+        with admit(dict(LIGHT, heavy=True)):
+            pass
+
+    machine["load"] = None
+    machine["free_mb"] = 100
+    with pytest.raises(AdmissionDeferred) as deferred:
+        with admit(LIGHT):
+            pass
+    assert "可用内存" in deferred.value.reason
+
+
+@pytest.fixture
+def queues(isolated_queues, monkeypatch):
+    """独立的队列键 + 每个项目在途上限 1 的 scheduler 设置，返回 (redis_settings, scheduler 设置)"""
+    from app.core import dispatch
+
+    settings = {"max_inflight_per_project": 1}
+    monkeypatch.setattr(dispatch, "get_scheduler_settings", lambda: settings)
+    monkeypatch.setattr(dispatch, "get_scan_config_by_name", lambda name: HEAVY if name == HEAVY["config_name"] else LIGHT)
+    return isolated_queues, settings
+
+
+async def _create_tasks(session_factory, *config_names, project_name="p"):
+    """在一个新项目中创建 pending 任务，返回 (项目 ID, 任务列表)"""
+    from app.data import models
+
+    async with session_factory() as db:
+        project = models.Project(name=project_name)
+        db.add(project)
+        await db.flush()
+        # 每个任务一个资产 (同一资产同一配置只能有一个未结束的任务)
+        assets = [models.Asset(name=f"t{i}.example.com", type="domain", project_id=project.id) for i in range(len(config_names))]
+        db.add_all(assets)
+        await db.flush()
+        tasks = [
+            models.ScanTask(asset_id=asset.id, config_name=name, status="pending")
+            for asset, name in zip(assets, config_names)
+        ]
+        db.add_all(tasks)
+        await db.commit()
+        return project.id, tasks
+
+
+async def _inflight(redis, project_id):
+    from app.core import dispatch
+
+    return sorted(int(v) for v in await redis.smembers(dispatch.inflight_key(project_id)))
+
+
+def test_dispatch_respects_per_project_inflight_limit(database, queues):
+    from arq import create_pool
+    from app.core import dispatch
+
+    redis_settings, settings = queues
+    project_a, tasks_a = run(_create_tasks(database, *[LIGHT["config_name"]] * 3, project_name="a"))
+    project_b, tasks_b = run(_create_tasks(database, *[LIGHT["config_name"]] * 3, project_name="b"))
+
+    async def scenario():
+        redis = await create_pool(redis_settings)
+        try:
+            for task in tasks_a:
+                await dispatch.enqueue_scan_task(redis, task, project_a)
+            for task in tasks_b:
+                await dispatch.enqueue_scan_task(redis, task, project_b)
+            dispatcher = dispatch.Dispatcher()
+            # 每个项目在途上限 1: 两个项目各分发一个，之后不再分发
+            first = await dispatcher.dispatch_once(redis)
+            blocked = await dispatcher.dispatch_once(redis)
+            inflight = await _inflight(redis, project_a), await _inflight(redis, project_b)
+            # 释放项目 A 的名额后只补充项目 A 的下一个任务
+            await dispatch.release_inflight(redis, project_a, tasks_a[0].id)
+            refill = await dispatcher.dispatch_once(redis)
+            return first, blocked, inflight, refill, await _inflight(redis, project_a), await dispatch.queue_lengths(redis)
+        finally:
+            await redis.aclose()
+
+    first, blocked, inflight, refill, after, lengths = run(scenario())
+    assert (first, blocked, refill) == (2, 0, 1)
+    assert inflight == ([tasks_a[0].id], [tasks_b[0].id])
+    assert after == [tasks_a[1].id]
+    assert lengths["passive"] == 3
+
+
+def test_worker_releases_inflight_when_job_finishes(database, queues, monkeypatch):
+    import worker
+    from arq import create_pool
+    from app.core import dispatch
+
+    redis_settings, _ = queues
+    ran = []
+
+    async def finished_logic(task_id, reingest=False, deadline=None):
+        ran.append(task_id)
+
+    monkeypatch.setattr(worker, "run_scan_task_logic", finished_logic)
+    project_id, (task,) = run(_create_tasks(database, LIGHT["config_name"]))
+
+    async def scenario():
+        redis = await create_pool(redis_settings)
+        try:
+            await dispatch.enqueue_scan_task(redis, task, project_id)
+            await dispatch.Dispatcher().dispatch_once(redis)
+            before = await _inflight(redis, project_id)
+            await worker.run_scan_task({"redis": redis}, task.id, project_id=project_id)
+            return before, await _inflight(redis, project_id)
+        finally:
+            await redis.aclose()
+
+    assert run(scenario()) == ([task.id], [])
+    assert ran == [task.id]
+
+
+def test_deferred_task_returns_to_its_named_queue_after_the_delay(database, queues, monkeypatch):
+    import worker
+    from arq import create_pool
+    from app.core import dispatch
+    from app.core.scheduler import AdmissionDeferred
+
+    redis_settings, _ = queues
+
+    async def deferred_logic(task_id, reingest=False, deadline=None):
+        raise AdmissionDeferred("agent_type:portscan 并发已达上限 1", 0.3)
+
+    monkeypatch.setattr(worker, "run_scan_task_logic", deferred_logic)
+    project_id, (task,) = run(_create_tasks(database, HEAVY["config_name"]))
+
+    async def scenario():
+        redis = await create_pool(redis_settings)
+        try:
+            await redis.sadd(dispatch.inflight_key(project_id), task.id)
+            # 不抛出 arq.Retry (不计入重试次数)，任务进入延后集合并释放项目的在途名额，到期前不参与分发
+            await worker.run_scan_task({"redis": redis}, task.id, reingest=True, project_id=project_id)
+            delayed = await redis.zcard(dispatch.SCAN_DELAYED_KEY)
+            inflight = await _inflight(redis, project_id)
+            early = await dispatch.Dispatcher().dispatch_once(redis)
+            await asyncio.sleep(0.4)
+            promoted = await dispatch.promote_delayed(redis)
+            queued = await redis.zrange(dispatch.project_queue_key(dispatch.queue_for_config(HEAVY), project_id), 0, -1)
+            return delayed, inflight, early, promoted, queued, await dispatch.queue_lengths(redis)
+        finally:
+            await redis.aclose()
+
+    delayed, inflight, early, promoted, queued, lengths = run(scenario())
+    assert (delayed, inflight, early, promoted) == (1, [], 0, 1)
+    assert queued == [f"{task.id}:1".encode()]
+    assert lengths["active-heavy"] == 1
+
+
+def test_discard_queued_tasks_removes_claimed_followers(database, queues):
+    from arq import create_pool
+    from app.core import dispatch
+
+    redis_settings, _ = queues
+    project_id, tasks = run(_create_tasks(database, *[LIGHT["config_name"]] * 3))
+
+    async def scenario():
+        redis = await create_pool(redis_settings)
+        try:
+            for task in tasks:
+                await dispatch.enqueue_scan_task(redis, task, project_id)
+            await dispatch.discard_queued_tasks(redis, tasks[0], project_id, [tasks[1].id, tasks[2].id])
+            return await redis.zrange(dispatch.project_queue_key(dispatch.queue_for_config(LIGHT), project_id), 0, -1)
+        finally:
+            await redis.aclose()
+
+    assert run(scenario()) == [f"{tasks[0].id}:0".encode()]
+
+
+def test_worker_settings_register_lifecycle_hooks():
+    # ARQ 只按 Worker 的参数名从 WorkerSettings 取值，名字不对的钩子会被静默忽略
+    kwargs = get_kwargs(WorkerSettings)
+    assert kwargs["on_startup"] is WorkerSettings.on_startup
+    assert kwargs["on_shutdown"] is WorkerSettings.on_shutdown
+    assert kwargs["functions"]
+    assert kwargs["cron_jobs"]
+
+
+def test_weighted_round_robin_is_proportional_and_interleaved():
+    wrr = WeightedRoundRobin()
+    weights = {"passive": 5, "active-light": 3, "active-heavy": 1}
+    picks = [wrr.pick(list(weights), weights) for _ in range(9)]
+    assert Counter(picks) == {"passive": 5, "active-light": 3, "active-heavy": 1}
+    # 平滑轮询: 权重最大的候选也不会连续占满
+    assert picks[:3] != ["passive"] * 3
+    # 下一轮重复同样的序列
+    assert [wrr.pick(list(weights), weights) for _ in range(9)] == picks
+
+
+def test_weighted_round_robin_skips_unavailable_without_accumulating():
+    wrr = WeightedRoundRobin()
+    weights = {"a": 1, "b": 1}
+    # b 长时间不可选时不累积份额，恢复后与 a 交替而不是连续被选
+    for _ in range(10):
+        assert wrr.pick(["a"], weights) == "a"
+    picks = [wrr.pick(["a", "b"], weights) for _ in range(4)]
+    assert Counter(picks) == {"a": 2, "b": 2}
+    assert picks[0] != picks[1]
+
+
+def test_weighted_round_robin_default_weight():
+    wrr = WeightedRoundRobin()
+    picks = [wrr.pick([1, 2], {1: 2}) for _ in range(3)]
+    assert Counter(picks) == {1: 2, 2: 1}